@@ -0,0 +1,142 @@
+"""
+Migration of the to-do table to the due date index used by GET /tasks (see DUE_DATE_INDEX in
+chalice-todo-backend/app.py):
+
+1. Creates the global secondary index if the table does not have it yet (partition key `listBucket`, sort key
+   `dueCreated`, all attributes projected).
+2. Sets `listBucket` and `dueCreated` on the existing tasks (the ones created before the index), which are not listed
+   until then. Each task is updated only if its due date did not change meanwhile, so the script can run while the API
+   is serving requests, and again after a failure.
+
+Usage:
+    python backfill_due_index.py --table ChaliceTodoListTable [--region us-east-1] [--endpoint-url http://localhost:8000]
+"""
+
+import argparse
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Must match chalice-todo-backend/app.py
+DUE_DATE_INDEX = "dueDateIndex"
+LIST_BUCKET = "tasks"
+
+
+def due_created(due_date, created_at):
+    return f"{due_date}#{created_at}"
+
+
+def create_index(client, table_name, index_name):
+    """
+    Create the index if it does not exist.
+    Returns:
+        bool: True if the index was created by this call.
+    """
+    description = client.describe_table(TableName=table_name)["Table"]
+    if any(index["IndexName"] == index_name for index in description.get("GlobalSecondaryIndexes", [])):
+        print(f"Index {index_name} already exists")
+        return False
+
+    index = {
+        "IndexName": index_name,
+        "KeySchema": [
+            {"AttributeName": "listBucket", "KeyType": "HASH"},
+            {"AttributeName": "dueCreated", "KeyType": "RANGE"},
+        ],
+        "Projection": {"ProjectionType": "ALL"},
+    }
+    if description.get("BillingModeSummary", {}).get("BillingMode") != "PAY_PER_REQUEST":
+        # Provisioned tables need the capacity of the index too: the same as the table
+        throughput = description["ProvisionedThroughput"]
+        index["ProvisionedThroughput"] = {
+            "ReadCapacityUnits": throughput["ReadCapacityUnits"],
+            "WriteCapacityUnits": throughput["WriteCapacityUnits"],
+        }
+    client.update_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {"AttributeName": "listBucket", "AttributeType": "S"},
+            {"AttributeName": "dueCreated", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexUpdates=[{"Create": index}],
+    )
+    print(f"Creating index {index_name}")
+    return True
+
+
+def wait_for_index(client, table_name, index_name, poll_seconds=10):
+    while True:
+        indexes = client.describe_table(TableName=table_name)["Table"].get("GlobalSecondaryIndexes", [])
+        status = next((index["IndexStatus"] for index in indexes if index["IndexName"] == index_name), None)
+        if status in (None, "ACTIVE"):
+            print(f"Index {index_name} is active")
+            return
+        print(f"Index {index_name} is {status}, waiting...")
+        time.sleep(poll_seconds)
+
+
+def backfill(table, dry_run=False):
+    """
+    Set the keys of the index on the tasks that do not have them.
+    Returns:
+        tuple: The number of tasks updated, and skipped (deleted or changed during the backfill).
+    """
+    scan_kwargs = {
+        # Either key may be missing, e.g. dueCreated set by a change of the due date in an older version of the API
+        "FilterExpression": "attribute_not_exists(listBucket) OR attribute_not_exists(dueCreated)",
+        "ProjectionExpression": "taskId, dueDate, createdAt",
+    }
+    updated = skipped = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            if dry_run:
+                updated += 1
+                continue
+            try:
+                table.update_item(
+                    Key={"taskId": item["taskId"]},
+                    UpdateExpression="SET listBucket = :listBucket, dueCreated = :dueCreated",
+                    ConditionExpression="attribute_exists(taskId) AND dueDate = :dueDate",
+                    ExpressionAttributeValues={
+                        ":listBucket": LIST_BUCKET,
+                        ":dueCreated": due_created(item["dueDate"], item["createdAt"]),
+                        ":dueDate": item["dueDate"],
+                    },
+                )
+                updated += 1
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                skipped += 1
+        if "LastEvaluatedKey" not in response:
+            return updated, skipped
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the due date index of the to-do table and backfill its keys.")
+    parser.add_argument("--table", default="ChaliceTodoListTable", help="Name of the DynamoDB table.")
+    parser.add_argument("--index-name", default=DUE_DATE_INDEX, help="Name of the index.")
+    parser.add_argument("--region", help="AWS region (defaults to the AWS CLI configuration).")
+    parser.add_argument("--endpoint-url", help="DynamoDB endpoint, e.g. DynamoDB Local.")
+    parser.add_argument("--no-wait", action="store_true", help="Do not wait for the index to be active.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the tasks to update.")
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource("dynamodb", region_name=args.region, endpoint_url=args.endpoint_url)
+    table = dynamodb.Table(args.table)
+    client = dynamodb.meta.client
+
+    if not args.dry_run:
+        create_index(client, args.table, args.index_name)
+    # The index is built in the background: the tasks can be updated meanwhile
+    updated, skipped = backfill(table, args.dry_run)
+    print(f"{'Would update' if args.dry_run else 'Updated'} {updated} tasks, skipped {skipped}")
+    if not args.dry_run and not args.no_wait:
+        wait_for_index(client, args.table, args.index_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,20 @@
-from chalice import Chalice, NotFoundError, BadRequestError
+from chalice import Chalice, NotFoundError, BadRequestError, ConflictError, ChaliceViewError
 import boto3
 import uuid
+import json
+import base64
+import binascii
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os  # For environment variables (optional for table name)
 
 app = Chalice(app_name="chalice-todo-backend")
 app.debug = True  # Optional: for more detailed error messages during development
 
-# Option 1: Get table name from environment variable (recommended for flexibility)
-# DYNAMODB_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'ChaliceTodoListTable')
-# Option 2: Hardcode table name (simpler for this example)
-DYNAMODB_TABLE_NAME = (
-    "ChaliceTodoListTable"  # <<< MAKE SURE THIS MATCHES YOUR TABLE NAME
+# Get table name from environment variable (set in .chalice/config.json), defaulting to the table of the tutorial
+DYNAMODB_TABLE_NAME = os.environ.get(
+    "DYNAMODB_TABLE_NAME", "ChaliceTodoListTable"  # <<< MAKE SURE THIS MATCHES YOUR TABLE NAME
 )
 
 dynamodb = None
@@ -21,10 +24,103 @@ else:  # For local development, ensure your AWS CLI is configured
     # You might need to specify region if not in default AWS CLI config
     # session = boto3.Session(region_name='your-aws-region')
     # dynamodb = session.resource('dynamodb')
-    dynamodb = boto3.resource("dynamodb")  # Assumes default session is fine
+    # DYNAMODB_ENDPOINT_URL can point to DynamoDB Local (e.g. http://localhost:8000) for tests
+    dynamodb = boto3.resource("dynamodb", endpoint_url=os.environ.get("DYNAMODB_ENDPOINT_URL"))
 
 table = dynamodb.Table(DYNAMODB_TABLE_NAME)
 
+# Pagination of GET /tasks: tasks per page by default, and at most
+DEFAULT_PAGE_SIZE = int(os.environ.get("TASKS_PAGE_SIZE", 100))
+MAX_PAGE_SIZE = 1000
+# Attributes returned when listing tasks (only these are read from the items)
+TASK_ATTRIBUTES = ["taskId", "title", "dueDate", "completed", "createdAt", "updatedAt"]
+# Segments scanned in parallel by GET /tasks/export
+MAX_EXPORT_SEGMENTS = 16
+
+# Global secondary index listing the tasks in order (see backfill_due_index.py, which creates it): all the tasks are in
+# the same partition (listBucket), sorted by dueCreated = "<dueDate>#<createdAt>". A page of GET /tasks is then read with
+# a Query, whose cost depends on the page size instead of the size of the table.
+DUE_DATE_INDEX = os.environ.get("TASKS_DUE_DATE_INDEX", "dueDateIndex")
+LIST_BUCKET = "tasks"
+
+
+def due_created(due_date, created_at):
+    "Sort key of a task in the due date index"
+    return f"{due_date}#{created_at}"
+
+
+def encode_token(last_evaluated_key):
+    "Opaque continuation token of a page: the key where DynamoDB stopped reading"
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode()).decode()
+
+
+def decode_token(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError):
+        key = None
+    if not isinstance(key, dict):
+        raise BadRequestError("Invalid 'nextToken'.")
+    return key
+
+
+def int_param(params, name, default, minimum, maximum):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadRequestError(f"'{name}' must be an integer.")
+    if not minimum <= value <= maximum:
+        raise BadRequestError(f"'{name}' must be between {minimum} and {maximum}.")
+    return value
+
+
+def task_view(item):
+    "The attributes of a task returned by the API (without the keys of the index)"
+    return {name: item[name] for name in TASK_ATTRIBUTES if name in item}
+
+
+def write_condition(task_id, expected_updated_at, names, values):
+    """
+    ConditionExpression of a write to a task, checked by DynamoDB in the same call (no get_item before): the task exists
+    and, if the client sent the updatedAt of the task it read, it was not updated since (optimistic concurrency).
+    """
+    if expected_updated_at is None:
+        return "attribute_exists(taskId)"
+    if not isinstance(expected_updated_at, str):
+        raise BadRequestError("Invalid 'updatedAt': expected the updatedAt of the task.")
+    names["#expectedUa"] = "updatedAt"
+    values[":expectedUpdatedAt"] = expected_updated_at
+    return "attribute_exists(taskId) AND #expectedUa = :expectedUpdatedAt"
+
+
+def condition_error(task_id, error):
+    """
+    The error of a write whose condition failed (see write_condition), or None for other errors. The write returns the
+    current task (ReturnValuesOnConditionCheckFailure), which tells a missing task from a concurrent update.
+    """
+    if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+        return None
+    current = error.response.get("Item")
+    if not current:
+        return NotFoundError(f"Task with ID '{task_id}' not found.")
+    return ConflictError(
+        f"Task '{task_id}' was updated since it was read "
+        f"(updatedAt is now '{current.get('updatedAt', {}).get('S')}')."
+    )
+
+
+def projection():
+    "ProjectionExpression of the listed attributes (with placeholders, as some names are reserved words)"
+    return {
+        "ProjectionExpression": ", ".join(f"#{name}" for name in TASK_ATTRIBUTES),
+        "ExpressionAttributeNames": {f"#{name}": name for name in TASK_ATTRIBUTES},
+    }
+
 
 @app.route("/", methods=["GET"])
 def index():
@@ -55,12 +151,15 @@ def add_task():
         "completed": False,
         "createdAt": timestamp,
         "updatedAt": timestamp,
+        # Keys of the due date index
+        "listBucket": LIST_BUCKET,
+        "dueCreated": due_created(due_date_str, timestamp),
     }
 
     try:
         table.put_item(Item=item)
         app.log.info(f"Task added: {task_id} - {title}")
-        return {"message": "Task added successfully", "task": item}, 201
+        return {"message": "Task added successfully", "task": task_view(item)}, 201
     except Exception as e:
         app.log.error(f"Error adding task: {e}")
         raise ChaliceViewError("Could not add task")
@@ -68,18 +167,77 @@ def add_task():
 
 @app.route("/tasks", methods=["GET"])
 def list_tasks():
+    """
+    A page of tasks, by due date then creation date: GET /tasks?limit=100, then
+    GET /tasks?limit=100&nextToken=<nextToken of the previous page>, until the response has no nextToken.
+    The tasks are read in order from the due date index. A single Query call reads at most 1 MB, so a page is filled
+    with several calls if needed, and only the listed attributes are read.
+    """
+    params = app.current_request.query_params or {}
+    limit = int_param(params, "limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    query_kwargs = {
+        "IndexName": DUE_DATE_INDEX,
+        "KeyConditionExpression": "#listBucket = :listBucket",
+        "ExpressionAttributeValues": {":listBucket": LIST_BUCKET},
+        **projection(),
+    }
+    query_kwargs["ExpressionAttributeNames"]["#listBucket"] = "listBucket"
+    if params.get("nextToken"):
+        start_key = decode_token(params["nextToken"])
+        # A key of the index has the keys of the table and of the index (e.g. not a token of the former Scan pages)
+        if set(start_key) != {"taskId", "listBucket", "dueCreated"}:
+            raise BadRequestError("Invalid 'nextToken'.")
+        query_kwargs["ExclusiveStartKey"] = start_key
+
     try:
-        # For a real app, consider pagination for large datasets
-        response = table.scan()
-        # Sort by due date, then by creation date if due dates are the same
-        tasks = sorted(
-            response.get("Items", []), key=lambda x: (x["dueDate"], x["createdAt"])
-        )
-        return {"tasks": tasks}
-    except Exception as e:
+        tasks = []
+        while True:
+            response = table.query(Limit=limit - len(tasks), **query_kwargs)
+            tasks.extend(response.get("Items", []))
+            last_evaluated_key = response.get("LastEvaluatedKey")
+            if not last_evaluated_key or len(tasks) >= limit:
+                break
+            query_kwargs["ExclusiveStartKey"] = last_evaluated_key
+    except ClientError as e:
         app.log.error(f"Error listing tasks: {e}")
+        # e.g. a token of another index, or edited
+        if "ExclusiveStartKey" in query_kwargs and e.response["Error"]["Code"] == "ValidationException":
+            raise BadRequestError("Invalid 'nextToken'.")
         raise ChaliceViewError("Could not list tasks")
 
+    return {"tasks": tasks, "nextToken": encode_token(last_evaluated_key)}
+
+
+def scan_segment(segment, total_segments):
+    "All the tasks of a segment of the table (the low-level client is thread-safe, unlike the table resource)"
+    client = table.meta.client
+    scan_kwargs = {"TableName": DYNAMODB_TABLE_NAME, "Segment": segment, "TotalSegments": total_segments, **projection()}
+    tasks = []
+    while True:
+        response = client.scan(**scan_kwargs)
+        tasks.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return tasks
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@app.route("/tasks/export", methods=["GET"])
+def export_tasks():
+    """
+    All the tasks, read with a parallel scan: GET /tasks/export?segments=4 scans 4 segments of the table at once, which
+    is faster for large tables (but uses more read capacity at once). The tasks are not sorted.
+    """
+    params = app.current_request.query_params or {}
+    segments = int_param(params, "segments", 4, 1, MAX_EXPORT_SEGMENTS)
+    try:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            results = executor.map(scan_segment, range(segments), [segments] * segments)
+            tasks = [task for segment_tasks in results for task in segment_tasks]
+    except Exception as e:
+        app.log.error(f"Error exporting tasks: {e}")
+        raise ChaliceViewError("Could not export tasks")
+    return {"tasks": tasks, "count": len(tasks)}
+
 
 @app.route("/tasks/{task_id}", methods=["GET"])
 def get_task(task_id):
@@ -87,7 +245,7 @@ def get_task(task_id):
         response = table.get_item(Key={"taskId": task_id})
         if "Item" not in response:
             raise NotFoundError(f"Task with ID '{task_id}' not found.")
-        return {"task": response["Item"]}
+        return {"task": task_view(response["Item"])}
     except Exception as e:
         app.log.error(f"Error getting task {task_id}: {e}")
         if isinstance(e, NotFoundError):
@@ -95,6 +253,35 @@ def get_task(task_id):
         raise ChaliceViewError(f"Could not get task {task_id}")
 
 
+def set_due_created(task):
+    """
+    Update the sort key of a task in the due date index after a change of its due date. It also needs createdAt, which
+    is only known after the update (an UpdateExpression cannot concatenate), so this second write is only made when the
+    due date changes. It is skipped if the due date changed again (or the task was deleted) meanwhile: the other write
+    sets its own key. The partition key is set too, for the tasks created before the index (see backfill_due_index.py).
+    Other errors are only logged, as the task itself is already updated.
+    """
+    try:
+        table.update_item(
+            Key={"taskId": task["taskId"]},
+            UpdateExpression="SET #lb = :listBucket, #dc = :dueCreated",
+            ConditionExpression="#dd = :dueDate",
+            ExpressionAttributeNames={"#lb": "listBucket", "#dc": "dueCreated", "#dd": "dueDate"},
+            ExpressionAttributeValues={
+                ":listBucket": LIST_BUCKET,
+                ":dueCreated": due_created(task["dueDate"], task["createdAt"]),
+                ":dueDate": task["dueDate"],
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            # The task itself is updated: the index key is fixed by the next change of the due date, or by
+            # backfill_due_index.py
+            app.log.error(f"Could not update the due date index key of task {task['taskId']}: {e}")
+            return
+        app.log.info(f"Due date of task {task['taskId']} changed meanwhile, index key left to the other update.")
+
+
 @app.route("/tasks/{task_id}", methods=["PUT"])
 def update_task(task_id):
     updates = app.current_request.json_body
@@ -107,20 +294,6 @@ def update_task(task_id):
             "No update data provided. Provide 'title', 'dueDate', or 'completed'."
         )
 
-    # Check if task exists
-    try:
-        response = table.get_item(Key={"taskId": task_id})
-        if "Item" not in response:
-            raise NotFoundError(f"Task with ID '{task_id}' not found.")
-    except NotFoundError:  # Specifically catch NotFoundError to re-raise
-        app.log.warn(f"Task {task_id} not found for update.")
-        raise
-    except Exception as e:
-        app.log.error(f"Error finding task {task_id} for update: {e}")
-        raise ChaliceViewError(
-            f"Could not find task {task_id} to update due to an internal issue."
-        )
-
     update_expression_parts = []
     expression_attribute_values = {}
     expression_attribute_names = {}
@@ -171,9 +344,7 @@ def update_task(task_id):
 
     # If only nulls were provided for updatable fields (or no valid fields),
     # we will still update 'updatedAt'.
-    if not update_expression_parts and not (
-        "updatedAt" in updates and updates["updatedAt"] is not None
-    ):  # Avoid adding updatedAt twice if provided
+    if not update_expression_parts:
         # If you require at least one field to be changed other than updatedAt:
         # raise BadRequestError("No valid fields or non-null values provided for update.")
         # For now, we'll allow an "update" that only touches updatedAt if no other fields are validly set.
@@ -187,10 +358,15 @@ def update_task(task_id):
     expression_attribute_values[":updatedAt"] = datetime.utcnow().isoformat()
 
     update_expression = "SET " + ", ".join(update_expression_parts)
+    # The existence of the task (and its updatedAt, if sent with the updates) is checked by the update itself
+    condition_expression = write_condition(
+        task_id, updates.get("updatedAt"), expression_attribute_names, expression_attribute_values
+    )
 
     # CRITICAL LOGGING: See exactly what's being sent to DynamoDB
     app.log.info(f"Attempting UpdateItem for task {task_id}:")
     app.log.info(f"  UpdateExpression: {update_expression}")
+    app.log.info(f"  ConditionExpression: {condition_expression}")
     app.log.info(f"  ExpressionAttributeValues: {expression_attribute_values}")
     app.log.info(
         f"  ExpressionAttributeNames: {expression_attribute_names if expression_attribute_names else 'Not Used'}"
@@ -200,17 +376,27 @@ def update_task(task_id):
         updated_item_response = table.update_item(
             Key={"taskId": task_id},
             UpdateExpression=update_expression,
+            ConditionExpression=condition_expression,
             ExpressionAttributeValues=expression_attribute_values,
-            ExpressionAttributeNames=(
-                expression_attribute_names if expression_attribute_names else None
-            ),  # Pass None if empty
+            ExpressionAttributeNames=expression_attribute_names,
             ReturnValues="ALL_NEW",
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
         )
+        task = updated_item_response["Attributes"]
+        if "#dd" in expression_attribute_names:
+            set_due_created(task)
         app.log.info(f"Task updated successfully in DynamoDB: {task_id}")
         return {
             "message": "Task updated successfully",
-            "task": updated_item_response["Attributes"],
+            "task": task_view(task),
         }
+    except ClientError as e:
+        error = condition_error(task_id, e)
+        if error is None:
+            app.log.error(f"DynamoDB UpdateItem call failed for task {task_id}: {e}")
+            raise ChaliceViewError(f"Could not update task {task_id} in the database.")
+        app.log.warning(f"Task {task_id} not updated: {error.args[0]}")
+        raise error
     except Exception as e:
         # This is where your current error message is coming from
         app.log.error(
@@ -225,17 +411,26 @@ def update_task(task_id):
 
 @app.route("/tasks/{task_id}", methods=["DELETE"])
 def delete_task(task_id):
+    """
+    Delete a task, in a single call: DynamoDB checks that it exists (404 otherwise) and, with
+    DELETE /tasks/{task_id}?updatedAt=<updatedAt of the task read>, that it was not updated since (409 otherwise).
+    """
+    params = app.current_request.query_params or {}
+    names, values = {}, {}
+    condition_expression = write_condition(task_id, params.get("updatedAt"), names, values)
     try:
-        # Ensure task exists before attempting delete for a clearer error
-        response = table.get_item(Key={"taskId": task_id})
-        if "Item" not in response:
-            raise NotFoundError(f"Task with ID '{task_id}' not found.")
-
-        table.delete_item(Key={"taskId": task_id})
+        table.delete_item(
+            Key={"taskId": task_id},
+            ConditionExpression=condition_expression,
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            **({"ExpressionAttributeNames": names, "ExpressionAttributeValues": values} if values else {}),
+        )
         app.log.info(f"Task deleted: {task_id}")
         return {"message": f"Task '{task_id}' deleted successfully."}
-    except Exception as e:
+    except ClientError as e:
+        error = condition_error(task_id, e)
+        if error is not None:
+            app.log.warning(f"Task {task_id} not deleted: {error.args[0]}")
+            raise error
         app.log.error(f"Error deleting task {task_id}: {e}")
-        if isinstance(e, NotFoundError):
-            raise
         raise ChaliceViewError(f"Could not delete task {task_id}")
@@ -0,0 +1,194 @@
+"""
+Tests of the API against a mocked DynamoDB table (moto), with the due date index of GET /tasks.
+
+    cd chalice-todo-backend && python -m pytest tests
+"""
+
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+import boto3  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+from chalice.test import Client  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+import app as todo  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import backfill_due_index  # noqa: E402
+
+
+class AppTestCase(unittest.TestCase):
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.table = boto3.resource("dynamodb").create_table(
+            TableName=todo.DYNAMODB_TABLE_NAME,
+            KeySchema=[{"AttributeName": "taskId", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "taskId", "AttributeType": "S"},
+                {"AttributeName": "listBucket", "AttributeType": "S"},
+                {"AttributeName": "dueCreated", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[{
+                "IndexName": todo.DUE_DATE_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "listBucket", "KeyType": "HASH"},
+                    {"AttributeName": "dueCreated", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            }],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.client = Client(todo.app)
+        self.addCleanup(self.client.__exit__, None, None, None)
+
+    def request(self, method, path, body=None):
+        response = self.client.http.request(
+            method, path, headers={"Content-Type": "application/json"}, body=json.dumps(body) if body else b""
+        )
+        return response.status_code, json.loads(response.body) if response.body else None
+
+    def add_tasks(self, count):
+        for i in range(count):
+            status, _ = self.request("POST", "/tasks", {"title": f"Task {i}", "dueDate": f"2025-06-{i % 28 + 1:02d}"})
+            self.assertEqual(status, 200)
+
+    def list_all(self, limit=10):
+        "All the tasks of GET /tasks, following the nextToken of the pages"
+        tasks, pages, token = [], 0, None
+        while True:
+            status, body = self.request("GET", f"/tasks?limit={limit}" + (f"&nextToken={token}" if token else ""))
+            self.assertEqual(status, 200)
+            tasks.extend(body["tasks"])
+            pages += 1
+            token = body["nextToken"]
+            if not token:
+                return tasks, pages
+
+
+class ListTasksTest(AppTestCase):
+    def test_pages_are_chained_in_due_date_order(self):
+        self.add_tasks(25)
+        tasks, pages = self.list_all(limit=10)
+        self.assertEqual(pages, 3)
+        self.assertEqual(len({task["taskId"] for task in tasks}), 25)
+        due_dates = [task["dueDate"] for task in tasks]
+        self.assertEqual(due_dates, sorted(due_dates))
+        self.assertEqual(set(tasks[0]), set(todo.TASK_ATTRIBUTES))
+
+    def test_invalid_next_token_is_a_bad_request(self):
+        self.add_tasks(1)
+        for token in ("abc", "WzFd", "eyJ0YXNrSWQiOiB7fX0="):  # Not base64 JSON, a list, a key of the table
+            status, _ = self.request("GET", f"/tasks?nextToken={token}")
+            self.assertEqual(status, 400, token)
+
+    def test_invalid_limit_is_a_bad_request(self):
+        self.assertEqual(self.request("GET", "/tasks?limit=0")[0], 400)
+        self.assertEqual(self.request("GET", f"/tasks?limit={todo.MAX_PAGE_SIZE + 1}")[0], 400)
+
+    def test_export_returns_every_task(self):
+        self.add_tasks(30)
+        status, body = self.request("GET", "/tasks/export?segments=3")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["count"], 30)
+        listed, _ = self.list_all(limit=100)
+        key = lambda task: task["taskId"]  # noqa: E731
+        self.assertEqual(sorted(body["tasks"], key=key), sorted(listed, key=key))
+
+
+class DueDateIndexTest(AppTestCase):
+    "Tasks created before the index (without listBucket and dueCreated) are only listed once they have both keys"
+
+    def put_legacy_task(self, task_id, **attributes):
+        item = {"taskId": task_id, "title": task_id, "dueDate": "2025-06-01", "completed": False,
+                "createdAt": "2025-05-01T00:00:00", "updatedAt": "2025-05-01T00:00:00", **attributes}
+        self.table.put_item(Item=item)
+
+    def listed_ids(self):
+        return {task["taskId"] for task in self.list_all()[0]}
+
+    def test_change_of_due_date_indexes_a_legacy_task(self):
+        self.put_legacy_task("legacy")
+        self.assertEqual(self.listed_ids(), set())
+        status, _ = self.request("PUT", "/tasks/legacy", {"dueDate": "2025-07-01"})
+        self.assertEqual(status, 200)
+        self.assertEqual(self.listed_ids(), {"legacy"})
+
+    def test_backfill_sets_the_missing_keys(self):
+        self.put_legacy_task("legacy")
+        # dueCreated without listBucket: a change of the due date by an older version of the API
+        self.put_legacy_task("half", dueCreated=todo.due_created("2025-06-01", "2025-05-01T00:00:00"))
+        self.add_tasks(1)
+        self.assertEqual(backfill_due_index.backfill(self.table), (2, 0))
+        self.assertEqual(len(self.listed_ids()), 3)
+        self.assertEqual(backfill_due_index.backfill(self.table), (0, 0))
+
+
+class ConditionalWritesTest(AppTestCase):
+    "PUT and DELETE check the existence and the updatedAt of the task in the same call"
+
+    def setUp(self):
+        super().setUp()
+        self.add_tasks(1)
+        self.task = self.list_all()[0][0]
+        self.path = f"/tasks/{self.task['taskId']}"
+
+    def test_update_with_the_current_updated_at(self):
+        status, body = self.request("PUT", self.path, {"completed": True, "updatedAt": self.task["updatedAt"]})
+        self.assertEqual(status, 200)
+        self.assertTrue(body["task"]["completed"])
+        self.assertNotEqual(body["task"]["updatedAt"], self.task["updatedAt"])
+
+    def test_update_with_a_stale_updated_at_is_a_conflict(self):
+        self.request("PUT", self.path, {"title": "First"})
+        status, _ = self.request("PUT", self.path, {"title": "Second", "updatedAt": self.task["updatedAt"]})
+        self.assertEqual(status, 409)
+        self.assertEqual(self.request("GET", self.path)[1]["task"]["title"], "First")
+
+    def test_update_of_a_missing_task_is_not_found(self):
+        status, _ = self.request("PUT", "/tasks/missing", {"title": "Title"})
+        self.assertEqual(status, 404)
+        self.assertNotIn("Item", self.table.get_item(Key={"taskId": "missing"}))
+
+    def test_update_is_kept_when_the_index_key_cannot_be_set(self):
+        update_item = todo.table.update_item
+        throttled = ClientError({"Error": {"Code": "ThrottlingException", "Message": "Throttled"}}, "UpdateItem")
+
+        def fail_index_update(**kwargs):
+            if kwargs["UpdateExpression"].startswith("SET #lb"):
+                raise throttled
+            return update_item(**kwargs)
+
+        with mock.patch.object(todo.table, "update_item", side_effect=fail_index_update):
+            status, body = self.request("PUT", self.path, {"dueDate": "2025-07-01"})
+        self.assertEqual(status, 200)
+        self.assertEqual(body["task"]["dueDate"], "2025-07-01")
+
+    def test_conflict_with_a_task_without_updated_at(self):
+        error = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}, "Item": {"taskId": {"S": "legacy"}}}, "UpdateItem"
+        )
+        self.assertIsInstance(todo.condition_error("legacy", error), todo.ConflictError)
+
+    def test_delete_with_a_stale_updated_at_is_a_conflict(self):
+        self.request("PUT", self.path, {"title": "Updated"})
+        self.assertEqual(self.request("DELETE", f"{self.path}?updatedAt={self.task['updatedAt']}")[0], 409)
+        self.assertEqual(self.request("GET", self.path)[0], 200)
+
+    def test_delete(self):
+        _, task = self.request("GET", self.path)
+        self.assertEqual(self.request("DELETE", f"{self.path}?updatedAt={task['task']['updatedAt']}")[0], 200)
+        self.assertEqual(self.request("DELETE", self.path)[0], 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,71 +1,156 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
-from dynatrace.backend.dynatrace_logger import send_log_to_dynatrace
-from dynatrace.backend.otel_metrics import setup_metrics
-import time, random
+from dynatrace.backend.dynatrace_logger import setup_logging, pending_logs, send_log_to_dynatrace_sync
+from dynatrace.backend.otel_metrics import setup_metrics, observe_queues, RequestMetricsMiddleware
+from dynatrace.backend.otel_tracing import setup_tracing
+from dynatrace.backend.workloads import (
+    ITERATIONS, MODES, PoolBusy, Timings, WorkerPool, overload_loop, overload_vectorized, timed
+)
+import os, time, asyncio, logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.metrics import NoOpMeter
 
-app = FastAPI()
-FastAPIInstrumentor().instrument_app(app)
+# Records of this logger are shipped to Dynatrace (built and formatted in a background thread)
+logger = logging.getLogger("fastapi-app")
 
-# Setup OpenTelemetry meter
-meter = setup_metrics()
-# Replace histogram with counter
-overload_duration = meter.create_up_down_counter(
-    "overload_duration_seconds",
-    unit="s",
-    description="Duration of overload simulations (as up/down counter)"
-)
 
+@dataclass
+class AppConfig:
+    "The observability of the app (the benchmark compares the overhead of each part, see benchmark.py)"
+    tracing: bool = True  # Spans of the requests (FastAPIInstrumentor)
+    metrics: bool = True  # Request metrics, and the other metrics of the app
+    logs: str = "batched"  # "batched" (background shipper), "sync" (one ingest request per log, in the request) or "none"
+    metric_readers: list = None  # Passed to setup_metrics, e.g. an InMemoryMetricReader in tests
+    span_exporter: object = None  # Passed to setup_tracing
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Or set to ["http://localhost:5500"] for stricter control
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
 class Thing(BaseModel):
     item: str
 
-@app.post("/add-thing")
-def add_thing(data: Thing):
-    send_log_to_dynatrace(
-        f"Adding thing: {data.item}",
-        level="INFO",
-        route="/add-thing",
-        item=data.item
-    )
-    return {"message": f"Thing '{data.item}' added successfully."}
 
-@app.post("/overload")
-def overload_app():
-    send_log_to_dynatrace("Overload triggered", level="WARNING", route="/overload")
+def create_app(config: AppConfig = None) -> FastAPI:
+    config = config or AppConfig()
 
-    start = time.time()
-    for _ in range(5_000_000):
-        _ = random.random() * random.random()
-    duration = time.time() - start
+    log_listener = setup_logging("fastapi-app") if config.logs == "batched" else None
 
-    overload_duration.add(duration, {"route": "/overload"})
+    def log(level, message, *args, **attributes):
+        if config.logs == "batched":
+            logger.log(level, message, *args, extra=attributes, stacklevel=2)
+        elif config.logs == "sync":
+            send_log_to_dynatrace_sync(message % args, level=logging.getLevelName(level), **attributes)
 
-    send_log_to_dynatrace(f"Overload completed in {duration:.2f}s", level="INFO", duration=f"{duration:.2f}")
-    return {"status": "Overload simulated"}
+    # Process pool of the CPU-bound work (/overload?mode=process), see workloads.py
+    worker_pool = WorkerPool(
+        max_workers=int(os.getenv("OVERLOAD_POOL_WORKERS", 0)) or None,  # Defaults to the number of CPUs
+        max_queue=int(os.getenv("OVERLOAD_POOL_QUEUE", 0)) or None,  # Tasks waiting for a worker, before answering 503
+    )
+    overload_timings = Timings()
 
+    # Setup OpenTelemetry meter (see otel_metrics.py for the histogram buckets, export interval and temporality)
+    meter = setup_metrics(readers=config.metric_readers) if config.metrics else NoOpMeter("overload_app")
+    overload_duration = meter.create_histogram(
+        "overload_duration_seconds",
+        unit="s",
+        description="Duration of overload simulations"
+    )
+    queues = {"overload_pool": lambda: worker_pool.pending}
+    if log_listener is not None:
+        queues["log_listener"] = lambda: log_listener.queue.qsize()
+        queues["log_shipper"] = pending_logs
 
-from fastapi.responses import JSONResponse
-@app.get("/random-error")
-def always_fail():
-    send_log_to_dynatrace(
-        "Intentional error triggered",
-        level="ERROR",
-        route="/random-error",
-        error="ForcedError"
+    # Setup OpenTelemetry tracing (see otel_tracing.py for the sampling and batching settings)
+    tracer_provider = None
+    if config.tracing:
+        tracer_provider, span_processor = setup_tracing(exporter=config.span_exporter, meter=meter)
+        queues["spans"] = lambda: span_processor.queue_depth
+    observe_queues(meter, queues)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        worker_pool.shutdown()
+        if tracer_provider is not None:
+            tracer_provider.shutdown()
+        # Logs are shipped in the background: send the pending ones before exiting
+        if log_listener is not None:
+            log_listener.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    if config.tracing:
+        FastAPIInstrumentor.instrument_app(app, tracer_provider=tracer_provider)
+    if config.metrics:
+        # Latency, payload sizes and in-flight requests per route
+        app.add_middleware(RequestMetricsMiddleware, meter=meter)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # Or set to ["http://localhost:5500"] for stricter control
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
-    return JSONResponse(
-        status_code=500,
-        content={"error": "This error was intentionally triggered."}
-    )
\ No newline at end of file
+
+    @app.post("/add-thing")
+    def add_thing(data: Thing):
+        log(logging.INFO, "Adding thing: %s", data.item, route="/add-thing", item=data.item)
+        return {"message": f"Thing '{data.item}' added successfully."}
+
+    @app.post("/overload")
+    async def overload_app(
+        mode: str = Query("loop", pattern=f"^({'|'.join(MODES)})$"),
+        iterations: int = Query(ITERATIONS, ge=1, le=50_000_000),
+    ):
+        """
+        Simulate a CPU-heavy request:
+        - loop: the pure Python loop, in the threadpool (it holds the GIL, so it slows down the other requests);
+        - vectorized: the same work with NumPy, in the threadpool;
+        - process: the pure Python loop in a worker process (503 when the pool is full).
+        """
+        log(logging.WARNING, "Overload triggered", route="/overload", mode=mode)
+
+        start = time.perf_counter()
+        if mode == "process":
+            try:
+                duration = await worker_pool.run(timed, overload_loop, iterations)
+            except PoolBusy:
+                log(logging.WARNING, "Overload rejected, the worker pool is full", route="/overload", mode=mode)
+                raise HTTPException(status_code=503, detail="Too many overload simulations", headers={"Retry-After": "1"})
+        else:
+            workload = overload_vectorized if mode == "vectorized" else overload_loop
+            duration = await asyncio.get_running_loop().run_in_executor(None, timed, workload, iterations)
+        wall = time.perf_counter() - start
+
+        overload_duration.record(duration, {"route": "/overload", "mode": mode})
+        overload_timings.record(mode, duration, wall)
+
+        log(logging.INFO, "Overload completed in %.2fs", duration, duration=f"{duration:.2f}", mode=mode)
+        return {"status": "Overload simulated", "mode": mode, "duration": round(duration, 4), "wall": round(wall, 4)}
+
+    @app.get("/overload/stats")
+    def overload_stats():
+        "Compare the durations of the overload modes served by this process"
+        return {"modes": overload_timings.summary(), "pool": {"pending": worker_pool.pending, "workers": worker_pool.max_workers}}
+
+    @app.get("/random-error")
+    def always_fail():
+        log(logging.ERROR, "Intentional error triggered", route="/random-error", error="ForcedError")
+        return JSONResponse(
+            status_code=500,
+            content={"error": "This error was intentionally triggered."}
+        )
+
+    return app
+
+
+def __getattr__(name):
+    # `app` (e.g. for `uvicorn app:app`) is created on first access, so importing create_app has no side effects
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
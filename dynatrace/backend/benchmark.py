@@ -0,0 +1,267 @@
+"""
+Benchmark of the cost of the observability of the app: drives the app in-process (httpx ASGI transport, no network
+nor server) with each configuration below, and compares the latency percentiles and the throughput. The exporters and
+the log ingest API point to a local stub collector, which answers after `--collector-latency-ms` (the round-trip to
+Dynatrace).
+
+Each configuration runs in its own process, as the OpenTelemetry providers and the loggers are global:
+
+    PYTHONPATH=. python -m dynatrace.backend.benchmark --requests 2000 --concurrency 20
+
+With `--save-baseline FILE`, the results are saved; with `--baseline FILE`, they are compared to the saved ones, and the
+exit status is 1 if the overhead of a configuration grew by more than `--tolerance`. The overhead is the latency (p50 and
+p95) and the throughput relative to the configuration without instrumentation of the same run, so a baseline can be
+reused on a faster or slower machine.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configurations compared (see AppConfig in app.py): each one adds a single feature to "none", so its overhead is its
+# own, and "all" is the production setup
+CONFIGS = {
+    "none": {"tracing": False, "metrics": False, "logs": "none"},
+    "tracing": {"tracing": True, "metrics": False, "logs": "none"},
+    "metrics": {"tracing": False, "metrics": True, "logs": "none"},
+    "sync-logs": {"tracing": False, "metrics": False, "logs": "sync"},
+    "batched-logs": {"tracing": False, "metrics": False, "logs": "batched"},
+    "all": {"tracing": True, "metrics": True, "logs": "batched"},
+}
+BASE_CONFIG = "none"
+
+
+class StubCollector:
+    """
+    A local HTTP server accepting the OTLP exports and the log ingest requests (answering 200 after `latency` seconds),
+    and counting them per path.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = {}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, as with Dynatrace
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with collector._lock:
+                    collector.requests[self.path] = collector.requests.get(self.path, 0) + 1
+                    collector.bytes += len(body)
+                if collector.latency:
+                    time.sleep(collector.latency)
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="stub-collector", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def percentile(values: list, fraction: float) -> float:
+    "Nearest-rank percentile of sorted values"
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+async def drive(app, requests: int, concurrency: int, warmup: int) -> dict:
+    "Send `requests` requests to the app, `concurrency` at a time, and measure them"
+    import httpx
+
+    latencies = []
+    errors = 0
+    remaining = {"warmup": warmup, "requests": requests}
+
+    async def worker(client, counter):
+        nonlocal errors
+        while remaining[counter] > 0:
+            remaining[counter] -= 1
+            start = time.perf_counter()
+            response = await client.post("/add-thing", json={"item": "benchmark"})
+            if counter == "requests":
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += response.status_code >= 400
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        await asyncio.gather(*(worker(client, "warmup") for _ in range(concurrency)))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client, "requests") for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+    }
+
+
+def run(config: str, requests: int, concurrency: int, warmup: int, collector_latency: float, repeat: int = 1) -> dict:
+    "Benchmark a configuration in this process (the best of `repeat` runs, the least disturbed by the machine)"
+    collector = StubCollector(collector_latency).start()
+    # Read when the modules are imported
+    os.environ["DYNATRACE_API_TOKEN"] = "benchmark"
+    os.environ["DYNATRACE_OTLP_ENDPOINT"] = collector.url
+    os.environ["DYNATRACE_LOGS_ENDPOINT"] = f"{collector.url}/api/v2/logs/ingest"
+    os.environ.setdefault("OTEL_METRIC_EXPORT_INTERVAL", "1000")
+    from dynatrace.backend.app import AppConfig, create_app
+    from opentelemetry import metrics
+
+    app = create_app(AppConfig(**CONFIGS[config]))
+
+    async def measure():
+        # The app is started once (the shutdown of its lifespan stops the exporters and the log shipper)
+        async with app.router.lifespan_context(app):
+            return [await drive(app, requests, concurrency, warmup) for _ in range(repeat)]
+
+    try:
+        stats = max(asyncio.run(measure()), key=lambda stats: stats["throughput_rps"])
+        # Last export, while the collector still runs
+        meter_provider = metrics.get_meter_provider()
+        if hasattr(meter_provider, "shutdown"):
+            meter_provider.shutdown()
+    finally:
+        collector.stop()
+    stats["collector_requests"] = dict(collector.requests)
+    return stats
+
+
+def compare(args) -> dict:
+    "Benchmark every configuration, each in a new process"
+    results = {}
+    for config in args.configs:
+        command = [
+            sys.executable, "-m", "dynatrace.backend.benchmark", "--config", config, "--json",
+            "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--warmup", str(args.warmup),
+            "--collector-latency-ms", str(args.collector_latency_ms), "--repeat", str(args.repeat),
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+            print(f"{config:>13}: failed ({error})")
+            continue
+        results[config] = json.loads(result.stdout.strip().splitlines()[-1])
+        print_stats(config, results[config], results.get(BASE_CONFIG))
+    return results
+
+
+def print_stats(config: str, stats: dict, base: dict = None):
+    overhead = ""
+    if base and config != BASE_CONFIG:
+        overhead = f", p50 +{stats['p50_ms'] - base['p50_ms']:.2f} ms vs {BASE_CONFIG}"
+    print(
+        f"{config:>13}: {stats['throughput_rps']:.0f} req/s, mean {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, "
+        f"p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, {stats['errors']} errors{overhead}"
+    )
+
+
+def relative(results: dict) -> dict:
+    "Latency and throughput of each configuration relative to the one without instrumentation"
+    base = results[BASE_CONFIG]
+    return {
+        config: {
+            "p50": stats["p50_ms"] / base["p50_ms"],
+            "p95": stats["p95_ms"] / base["p95_ms"],
+            "throughput": stats["throughput_rps"] / base["throughput_rps"],
+        }
+        for config, stats in results.items()
+    }
+
+
+def check_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Compare the overhead of each configuration to the baseline.
+    Returns:
+        list: The regressions found (as messages).
+    """
+    if BASE_CONFIG not in results or BASE_CONFIG not in baseline:
+        return [f"Both runs need the {BASE_CONFIG} configuration"]
+    current, previous = relative(results), relative(baseline)
+    regressions = []
+    for config in current.keys() & previous.keys():
+        for metric in ("p50", "p95"):
+            if current[config][metric] > previous[config][metric] * (1 + tolerance):
+                regressions.append(
+                    f"{config}: {metric} is {current[config][metric]:.2f}x {BASE_CONFIG} "
+                    f"(baseline {previous[config][metric]:.2f}x)"
+                )
+        if current[config]["throughput"] < previous[config]["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{config}: throughput is {current[config]['throughput']:.2f}x {BASE_CONFIG} "
+                f"(baseline {previous[config]['throughput']:.2f}x)"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of the observability of the app.")
+    parser.add_argument("--config", choices=CONFIGS, help="Benchmark a single configuration in this process.")
+    parser.add_argument("--configs", nargs="+", choices=CONFIGS, default=list(CONFIGS), help="Configurations compared.")
+    parser.add_argument("--requests", type=int, default=2000, help="Measured requests per configuration.")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once.")
+    parser.add_argument("--warmup", type=int, default=200, help="Requests sent before measuring.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per configuration (the best one is kept).")
+    parser.add_argument("--collector-latency-ms", type=float, default=20, help="Response time of the stub collector.")
+    parser.add_argument("--json", action="store_true", help="Print the statistics as JSON.")
+    parser.add_argument("--save-baseline", type=str, help="Save the results to this file.")
+    parser.add_argument("--baseline", type=str, help="Fail if the overhead grew compared to this file.")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed growth of the relative overhead.")
+    args = parser.parse_args()
+
+    if args.config:
+        stats = run(
+            args.config, args.requests, args.concurrency, args.warmup, args.collector_latency_ms / 1000, args.repeat
+        )
+        if args.json:
+            print(json.dumps(stats))
+        else:
+            print_stats(args.config, stats)
+        return
+
+    # The overheads saved or compared are relative to the configuration without instrumentation
+    if (args.baseline or args.save_baseline) and BASE_CONFIG not in args.configs:
+        args.configs.insert(0, BASE_CONFIG)
+    results = compare(args)
+    if (args.baseline or args.save_baseline) and BASE_CONFIG not in results:
+        sys.exit(f"The {BASE_CONFIG} configuration failed, no baseline saved nor compared")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = check_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,197 @@
 import os
 import json
+import atexit
+import queue
+import logging
+import threading
 import requests
-from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+from dynatrace.backend.log_shipper import LogShipper
+
 load_dotenv()
 
 DYNATRACE_ENV_ID = os.getenv("DYNATRACE_ENV_ID")
 DYNATRACE_API_TOKEN = os.getenv("DYNATRACE_API_TOKEN")
+# Defaults to the ingest API of the environment; can point to a local stub collector for tests and benchmarks
+DYNATRACE_LOGS_ENDPOINT = os.getenv("DYNATRACE_LOGS_ENDPOINT") or (
+    f"https://{DYNATRACE_ENV_ID}.live.dynatrace.com/api/v2/logs/ingest" if DYNATRACE_ENV_ID else None
+)
+
+logger = logging.getLogger("dynatrace.log_shipper")
+
+_shipper = None
+_shipper_lock = threading.Lock()
+_warned = False
+_sync_session = requests.Session()
 
-def send_log_to_dynatrace(content, level="INFO", service="fastapi-app", **kwargs):
-    if not DYNATRACE_ENV_ID or not DYNATRACE_API_TOKEN:
-        print("Missing Dynatrace credentials")
-        return
 
-    log = {
-        "timestamp": int(datetime.utcnow().timestamp() * 1000),
+def build_log(content, level="INFO", service="fastapi-app", **kwargs):
+    "A log record in the format of the Dynatrace log ingest API"
+    return {
+        "timestamp": int(datetime.now(timezone.utc).timestamp() * 1000),
         "content": content,
         "log.level": level,
         "service.name": service,
         **kwargs
     }
 
+
+def get_log_shipper():
+    """
+    The background log shipper of this process, configured from the environment (None without credentials).
+    See LogShipper for the meaning of the DYNATRACE_LOG_* variables.
+    """
+    global _shipper, _warned
+    if not DYNATRACE_LOGS_ENDPOINT:
+        if not _warned:
+            _warned = True
+            logger.warning("Missing Dynatrace credentials (DYNATRACE_ENV_ID), logs are not sent")
+        return None
+    if _shipper is None:
+        with _shipper_lock:
+            if _shipper is None:
+                _shipper = LogShipper(
+                    DYNATRACE_LOGS_ENDPOINT,
+                    api_token=DYNATRACE_API_TOKEN,
+                    max_batch_size=int(os.getenv("DYNATRACE_LOG_BATCH_SIZE", 1000)),
+                    flush_interval=float(os.getenv("DYNATRACE_LOG_FLUSH_INTERVAL", 1.0)),
+                    max_queue_size=int(os.getenv("DYNATRACE_LOG_QUEUE_SIZE", 10_000)),
+                    overflow=os.getenv("DYNATRACE_LOG_OVERFLOW", "drop"),  # "drop" or "spill"
+                    spill_path=os.getenv("DYNATRACE_LOG_SPILL_PATH"),
+                    max_retries=int(os.getenv("DYNATRACE_LOG_MAX_RETRIES", 3)),
+                    timeout=float(os.getenv("DYNATRACE_LOG_TIMEOUT", 5.0)),
+                )
+    return _shipper
+
+
+def send_log_to_dynatrace(content, level="INFO", service="fastapi-app", **kwargs):
+    """
+    Queue a log record to be sent to Dynatrace in the background (see LogShipper); it never blocks the request.
+    Returns False if the record was dropped (buffer full or missing credentials).
+    """
+    shipper = get_log_shipper()
+    if shipper is None:
+        return False
+    return shipper.enqueue(build_log(content, level, service, **kwargs))
+
+
+def send_log_to_dynatrace_sync(content, level="INFO", service="fastapi-app", **kwargs):
+    """
+    Send a single log record synchronously, in the request (the previous behavior).
+    Kept to compare the request latency with the background shipper (see benchmark.py).
+    """
+    if not DYNATRACE_LOGS_ENDPOINT:
+        return False
     try:
-        response = requests.post(
-            f"https://{DYNATRACE_ENV_ID}.live.dynatrace.com/api/v2/logs/ingest",
+        response = _sync_session.post(
+            DYNATRACE_LOGS_ENDPOINT,
             headers={
                 "Authorization": f"Api-Token {DYNATRACE_API_TOKEN}",
                 "Content-Type": "application/json"
             },
-            data=json.dumps([log])
+            data=json.dumps([build_log(content, level, service, **kwargs)]),
+            timeout=5,
         )
-        print("Log sent:", response.status_code)
-    except Exception as e:
-        print("Failed to send log:", e)
+        return response.status_code < 300
+    except requests.RequestException as e:
+        logger.error(f"Failed to send log: {e}")
+        return False
+
+
+def pending_logs():
+    "Number of records waiting to be sent by the log shipper of this process"
+    return _shipper.pending if _shipper is not None else 0
+
+
+def close_log_shipper():
+    "Send the pending records, e.g. when the app shuts down"
+    if _shipper is not None:
+        _shipper.close()
+
+
+class DynatraceLogHandler(logging.Handler):
+    """
+    A logging handler that ships the records to Dynatrace through the background LogShipper, in the same format
+    as send_log_to_dynatrace: the formatted message is the content, and the `extra` values of the call become
+    attributes of the log, e.g.:
+
+        logger.info("Adding thing: %s", item, extra={"route": "/add-thing", "item": item})
+
+    Exceptions are added as `exception.type`, `exception.message` and `exception.stack_trace`.
+    Emitting only builds the record and enqueues it. To also format it off the request thread, put the handler
+    behind a queue (see setup_logging).
+    """
+
+    # Attributes of every LogRecord, i.e. not passed with `extra`
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+    def __init__(self, level=logging.NOTSET, service="fastapi-app", shipper=None):
+        super().__init__(level)
+        self.service = service
+        self.shipper = shipper
+
+    def emit(self, record):
+        # e.g. the urllib3 records of the requests that send the batches, or the errors of the shipper
+        if record.threadName == "dynatrace-log-shipper" or record.name.startswith("dynatrace.log_shipper"):
+            return
+        try:
+            shipper = self.shipper or get_log_shipper()
+            if shipper is None:
+                return
+            attributes = {
+                key: value if isinstance(value, (str, int, float, bool)) or value is None else str(value)
+                for key, value in vars(record).items()
+                if key not in self.RESERVED and not key.startswith("_")
+            }
+            attributes["logger.name"] = record.name
+            attributes["code.function"] = record.funcName
+            attributes["code.lineno"] = record.lineno
+            if record.exc_info and record.exc_info[0] is not None:
+                attributes["exception.type"] = record.exc_info[0].__name__
+                attributes["exception.message"] = str(record.exc_info[1])
+                attributes["exception.stack_trace"] = logging.Formatter().formatException(record.exc_info)
+            log = build_log(record.getMessage() if self.formatter is None else self.format(record),
+                            record.levelname, self.service, **attributes)
+            log["timestamp"] = int(record.created * 1000)
+            shipper.enqueue(log)
+        except Exception:
+            self.handleError(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    A QueueHandler for a listener in the same process: the record is queued as is, so its message is formatted
+    by the listener thread instead of the thread that logs it (the arguments should not be mutated afterwards).
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class _Listener(QueueListener):
+    def stop(self):
+        # Can be stopped by the app (e.g. at shutdown) and then at exit
+        if self._thread is not None:
+            super().stop()
+            # The records the listener has just handled are still in the shipper
+            close_log_shipper()
+
+
+def setup_logging(logger_name=None, service="fastapi-app", level=logging.INFO):
+    """
+    Ship the records of a logger (the root logger by default) to Dynatrace, building and formatting them in a
+    background thread (QueueListener). Returns the listener, which is stopped at exit; stopping it also sends the
+    pending records.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = _Listener(log_queue, DynatraceLogHandler(service=service), respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    target = logging.getLogger(logger_name)
+    target.addHandler(DeferredQueueHandler(log_queue))
+    if target.level == logging.NOTSET or target.level > level:
+        target.setLevel(level)
+    return listener
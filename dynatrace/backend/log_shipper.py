@@ -0,0 +1,314 @@
+"""
+Background shipping of log records to the Dynatrace log ingest API (`/api/v2/logs/ingest`).
+
+Request handlers only append the record to an in-memory buffer (`LogShipper.enqueue`); a background thread sends the
+buffered records in batches, so the latency of a request never includes a round-trip to Dynatrace.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Records of this logger are not shipped by DynatraceLogHandler (they would feed the shipper with its own errors)
+logger = logging.getLogger("dynatrace.log_shipper")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# How often a batch being collected checks whether the shipper is stopping (seconds)
+STOP_POLL_INTERVAL = 0.1
+
+
+class LogShipper:
+    """
+    Buffers log records and sends them to the ingest API in batches, from a background thread.
+
+    - A batch is sent as soon as it has `max_batch_size` records (or `max_batch_bytes` of JSON), or `flush_interval`
+      seconds after its first record.
+    - Batches are sent gzip-compressed over a pooled HTTP session (one keep-alive connection is reused), with a timeout.
+    - Failed requests (connection errors, 429 and 5xx responses) are retried `max_retries` times with exponential
+      backoff and jitter, honoring `Retry-After`. Other errors (e.g. 400, 401) are not retried.
+    - When the buffer holds `max_queue_size` records, new records are dropped (`overflow="drop"`) or appended to
+      `spill_path` as JSON lines (`overflow="spill"`), which are sent later, when the shipper is idle. Batches that
+      still fail after the retries are spilled too, if a spill file is configured.
+
+    Pending records are sent when the process exits cleanly (`close` is registered with `atexit`).
+    """
+
+    OVERFLOW_MODES = ("drop", "spill")
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_token: str = None,
+        max_batch_size: int = 1000,
+        max_batch_bytes: int = 1_000_000,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10_000,
+        overflow: str = "drop",
+        spill_path: str = None,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 5.0,
+        compress: bool = True,
+    ):
+        if overflow not in self.OVERFLOW_MODES:
+            raise ValueError(f"Unknown overflow mode: {overflow}")
+        if overflow == "spill" and not spill_path:
+            raise ValueError("The spill overflow mode needs a spill_path")
+        self.endpoint = endpoint
+        self.api_token = api_token
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.compress = compress
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.batches = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._session = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def pending(self) -> int:
+        "Number of records waiting in the buffer"
+        return self._queue.qsize()
+
+    def enqueue(self, record: dict) -> bool:
+        """
+        Add a log record to the buffer, without blocking.
+        Args:
+            record (dict): The log record (a JSON object of the ingest API).
+        Returns:
+            bool: True if the record was buffered (or spilled), False if it was dropped.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+        if self.overflow == "spill":
+            self._spill(self._encode([record]))
+            return True
+        self.dropped += 1
+        return False
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Wait until the buffered records have been sent (or given up on).
+        Returns:
+            bool: True if the buffer was emptied before the timeout.
+        """
+        if self._thread is None or self._pid != os.getpid():
+            self._send_all(self._drain())
+            return True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._queue.unfinished_tasks == 0:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def close(self, timeout: float = 10.0):
+        """
+        Stop the background thread and send the pending records.
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._stopping.set()
+            thread.join(timeout=timeout)
+            self._thread = None
+        self._send_all(self._drain())
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _ensure_started(self):
+        # Servers may fork the workers after the app is imported, so the thread is started lazily in each process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._session = None
+            self._thread = threading.Thread(target=self._run, name="dynatrace-log-shipper", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                try:
+                    self._replay_spill()
+                except Exception:
+                    logger.exception("Failed to replay the spilled log records")
+                continue
+            taken = 1
+            try:
+                batch = self._encode([first])
+                size = sum(len(line) + 1 for line in batch)
+                deadline = time.monotonic() + self.flush_interval
+                while taken < self.max_batch_size and size < self.max_batch_bytes:
+                    remaining = deadline - time.monotonic()
+                    # Stopping: the batch collected so far is sent now, not lost when close() stops waiting
+                    if remaining <= 0 or self._stopping.is_set():
+                        break
+                    try:
+                        record = self._queue.get(timeout=min(remaining, STOP_POLL_INTERVAL))
+                    except queue.Empty:
+                        continue
+                    taken += 1
+                    lines = self._encode([record])
+                    batch += lines
+                    size += sum(len(line) + 1 for line in lines)
+                if batch:
+                    self._send_or_spill(batch)
+            except Exception:
+                # The thread must survive any record or error, or the buffer would never be emptied again
+                logger.exception(f"Failed to ship a batch of {taken} log records")
+                self.dropped += taken
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _encode(self, records: list) -> list:
+        """
+        The records as JSON, each serialized only once (for the size of the batch and its body). Values that are not
+        JSON types are sent as strings; records that still cannot be serialized (e.g. circular) are dropped.
+        """
+        lines = []
+        for record in records:
+            try:
+                lines.append(json.dumps(record, default=str))
+            except (TypeError, ValueError) as e:
+                self.dropped += 1
+                logger.error(f"Log record dropped, not serializable: {e}")
+        return lines
+
+    def _drain(self) -> list:
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return self._encode(records)
+            self._queue.task_done()
+
+    def _send_all(self, batch: list):
+        for start in range(0, len(batch), self.max_batch_size):
+            self._send_or_spill(batch[start : start + self.max_batch_size])
+
+    def _send_or_spill(self, batch: list):
+        if self._send(batch):
+            self.sent += len(batch)
+        elif self.spill_path:
+            self._spill(batch)
+        else:
+            self.dropped += len(batch)
+
+    def _send(self, batch: list) -> bool:
+        "POST a batch (of records serialized by _encode), with retries. Returns True if it was accepted"
+        if self._session is None:
+            self._session = requests.Session()
+            self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        body = f"[{','.join(batch)}]".encode()
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if self.api_token:
+            headers["Authorization"] = f"Api-Token {self.api_token}"
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff * 2**attempt * random.uniform(0.5, 1.5)
+            try:
+                response = self._session.post(self.endpoint, data=body, headers=headers, timeout=self.timeout)
+                if response.status_code < 300:
+                    self.batches += 1
+                    return True
+                if response.status_code not in RETRY_STATUSES:
+                    logger.error(f"Log batch of {len(batch)} records rejected: {response.status_code} {response.text}")
+                    return False
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.max_retries and not self._stopping.wait(delay):
+                continue
+            logger.error(f"Failed to send a log batch of {len(batch)} records: {error}")
+            return False
+
+    def _spill(self, batch: list):
+        with self._spill_lock:
+            with open(self.spill_path, "a") as f:
+                for line in batch:
+                    f.write(line + "\n")
+        self.spilled += len(batch)
+
+    def _read_spill(self, path: str) -> list:
+        "The records of a spill file, without the lines that are not valid JSON (e.g. cut by a crash while writing)"
+        lines, invalid = [], 0
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    json.loads(line)
+                except ValueError:
+                    invalid += 1
+                    continue
+                lines.append(line)
+        if invalid:
+            self.dropped += invalid
+            logger.warning(f"Skipped {invalid} invalid lines of the log spill file {path}")
+        return lines
+
+    def _replay_spill(self):
+        "Send the spilled records (called when the buffer is empty)"
+        if not self.spill_path:
+            return
+        replay_path = f"{self.spill_path}.replay"
+        with self._spill_lock:
+            # A replay file left by a process that died while replaying it is sent first
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+        records = self._read_spill(replay_path)
+        for start in range(0, len(records), self.max_batch_size):
+            batch = records[start : start + self.max_batch_size]
+            if not self._send(batch):
+                # Still failing: keep the rest for the next replay
+                self._spill(records[start:])
+                self.spilled -= len(records) - start
+                break
+            self.sent += len(batch)
+        os.remove(replay_path)
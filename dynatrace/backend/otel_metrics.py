@@ -1,20 +1,189 @@
 import os
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+import time
+from typing import Callable
+
+from opentelemetry.sdk.metrics import (
+    Counter,
+    Histogram,
+    MeterProvider,
+    ObservableCounter,
+    ObservableGauge,
+    ObservableUpDownCounter,
+    UpDownCounter,
+)
+from opentelemetry.sdk.metrics.export import AggregationTemporality, PeriodicExportingMetricReader
+from opentelemetry.sdk.metrics.view import (
+    ExplicitBucketHistogramAggregation,
+    ExponentialBucketHistogramAggregation,
+    View,
+)
 from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
-from opentelemetry.metrics import set_meter_provider, get_meter_provider
+from opentelemetry.metrics import Observation, set_meter_provider
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Bucket boundaries of the histograms (with "explicit" histograms)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 7.5, 10)  # Seconds
+OVERLOAD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)  # Seconds
+SIZE_BUCKETS = (0, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)  # Bytes
+
+REQUEST_DURATION = "http_server_request_duration_seconds"
+REQUEST_SIZE = "http_server_request_size_bytes"
+RESPONSE_SIZE = "http_server_response_size_bytes"
+REQUESTS_IN_FLIGHT = "http_server_requests_in_flight"
+OVERLOAD_DURATION = "overload_duration_seconds"
+QUEUE_DEPTH = "queue_depth"
+
+
+def temporality_preference(temporality: str) -> dict:
+    """
+    The aggregation temporality of each instrument type.
+    Args:
+        temporality (str): "delta" (what the Dynatrace OTLP endpoint ingests: counters and histograms are sent as the
+            change since the previous export; up/down counters stay cumulative) or "cumulative".
+    """
+    if temporality == "cumulative":
+        return {}
+    if temporality != "delta":
+        raise ValueError(f"Unknown temporality: {temporality}")
+    return {
+        Counter: AggregationTemporality.DELTA,
+        Histogram: AggregationTemporality.DELTA,
+        ObservableCounter: AggregationTemporality.DELTA,
+        UpDownCounter: AggregationTemporality.CUMULATIVE,
+        ObservableUpDownCounter: AggregationTemporality.CUMULATIVE,
+        ObservableGauge: AggregationTemporality.CUMULATIVE,
+    }
+
+
+def histogram_views(histogram: str = "explicit") -> list:
+    """
+    Views setting the buckets of the histograms of the app.
+    Args:
+        histogram (str): "explicit" (the bucket boundaries above) or "exponential" (buckets scaled to the recorded
+            values, with no boundaries to choose, if the backend supports them).
+    """
+    def aggregation(boundaries):
+        if histogram == "exponential":
+            return ExponentialBucketHistogramAggregation()
+        return ExplicitBucketHistogramAggregation(boundaries)
+
+    return [
+        View(instrument_name=REQUEST_DURATION, aggregation=aggregation(LATENCY_BUCKETS)),
+        View(instrument_name=OVERLOAD_DURATION, aggregation=aggregation(OVERLOAD_BUCKETS)),
+        View(instrument_name=REQUEST_SIZE, aggregation=aggregation(SIZE_BUCKETS)),
+        View(instrument_name=RESPONSE_SIZE, aggregation=aggregation(SIZE_BUCKETS)),
+    ]
+
+
+def setup_metrics(
+    export_interval_ms: int = None,
+    temporality: str = None,
+    histogram: str = None,
+    readers: list = None,
+    exporter=None,
+    set_global: bool = True,
+):
+    """
+    Create the meter provider of the app and return its meter.
+    Args:
+        export_interval_ms (int): Milliseconds between exports (OTEL_METRIC_EXPORT_INTERVAL, 60000 by default).
+        temporality (str): "delta" or "cumulative" (OTEL_METRIC_TEMPORALITY, "delta" by default), of the default
+            exporter. The temporality of a reader or exporter passed by the caller is set when it is created (e.g.
+            `preferred_temporality=temporality_preference("delta")`), so passing both is an error.
+        histogram (str): "explicit" or "exponential" histograms (OTEL_METRIC_HISTOGRAM, "explicit" by default).
+        readers (list): The metric readers, e.g. an InMemoryMetricReader in tests. By default, a periodic reader
+            exporting to `exporter`.
+        exporter: The metric exporter. Defaults to the OTLP endpoint of Dynatrace (DYNATRACE_OTLP_ENDPOINT).
+        set_global (bool): Also set the provider as the global one (e.g. for the instrumentations).
+    """
+    if temporality is not None and (readers is not None or exporter is not None):
+        raise ValueError("The temporality only applies to the default exporter, set it on the readers or exporter")
+    temporality = temporality or os.getenv("OTEL_METRIC_TEMPORALITY", "delta")
+    histogram = histogram or os.getenv("OTEL_METRIC_HISTOGRAM", "explicit")
+    if readers is None:
+        if exporter is None:
+            exporter = OTLPMetricExporter(
+                endpoint=f"{os.getenv('DYNATRACE_OTLP_ENDPOINT')}/v1/metrics",
+                headers={"Authorization": f"Api-Token {os.getenv('DYNATRACE_API_TOKEN')}"},
+                preferred_temporality=temporality_preference(temporality),
+            )
+        readers = [PeriodicExportingMetricReader(
+            exporter,
+            export_interval_millis=export_interval_ms or int(os.getenv("OTEL_METRIC_EXPORT_INTERVAL", 60_000)),
+        )]
+    provider = MeterProvider(metric_readers=readers, views=histogram_views(histogram))
+    if set_global:
+        set_meter_provider(provider)
+    return provider.get_meter("overload_app")
 
 
-def setup_metrics():
-    exporter = OTLPMetricExporter(
-        endpoint=f"{os.getenv('DYNATRACE_OTLP_ENDPOINT')}/v1/metrics",
-        headers={"Authorization": f"Api-Token {os.getenv('DYNATRACE_API_TOKEN')}"}
+def observe_queues(meter, queues: dict[str, Callable[[], int]]):
+    """
+    Report the depth of in-process queues (e.g. the log shipper buffer) as the `queue_depth` gauge, with a `queue`
+    attribute. The callables are called at each export.
+    """
+    def observe(options):
+        return [Observation(depth(), {"queue": name}) for name, depth in queues.items()]
+
+    return meter.create_observable_gauge(
+        QUEUE_DEPTH, callbacks=[observe], unit="{item}", description="Items waiting in the in-process queues"
     )
-    reader = PeriodicExportingMetricReader(exporter)
-    provider = MeterProvider(metric_readers=[reader])
-    set_meter_provider(provider)
-    return get_meter_provider().get_meter("overload_app")
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording, for each HTTP request, its duration and the sizes of its request and response bodies
+    (histograms with the method, the route template and the status code), and the number of requests in progress.
+    Routes are the templates (e.g. `/items/{id}`), or "unmatched", to keep the number of series bounded.
+    """
+
+    def __init__(self, app, meter):
+        self.app = app
+        self.duration = meter.create_histogram(REQUEST_DURATION, unit="s", description="Duration of the requests")
+        self.request_size = meter.create_histogram(REQUEST_SIZE, unit="By", description="Size of the request bodies")
+        self.response_size = meter.create_histogram(RESPONSE_SIZE, unit="By", description="Size of the response bodies")
+        self.in_flight = meter.create_up_down_counter(
+            REQUESTS_IN_FLIGHT, unit="{request}", description="Requests in progress"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight.add(1, {"http.method": method})
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = scope.get("route")
+            attributes = {
+                "http.method": method,
+                "http.route": getattr(route, "path", "unmatched"),
+                "http.status_code": status["code"],
+            }
+            self.duration.record(time.perf_counter() - start, attributes)
+            # The body may not have been read by the app (e.g. a route without a body parameter)
+            content_length = dict(scope["headers"]).get(b"content-length", b"")
+            request_size = int(content_length) if content_length.isdigit() else sizes["request"]
+            self.request_size.record(max(request_size, sizes["request"]), attributes)
+            self.response_size.record(sizes["response"], attributes)
+            self.in_flight.add(-1, {"http.method": method})
@@ -1,22 +1,186 @@
+import logging
 import os
+import threading
+import time
+
 from dotenv import load_dotenv
 
 from opentelemetry import trace
-from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanLimits, TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import Decision, ParentBased, Sampler, SamplingResult, TraceIdRatioBased
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 
 load_dotenv()
 
-# Setup Tracing Provider
-trace.set_tracer_provider(TracerProvider())
-tracer_provider = trace.get_tracer_provider()
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    "Allows `rate` operations per second, in bursts of up to `rate` operations"
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RateLimitingSampler(Sampler):
+    """
+    Samples at most `max_per_second` traces per second (token bucket, allowing bursts of `max_per_second` traces),
+    among the ones sampled by `delegate` (all of them by default). Under high load, the number of exported spans is
+    bounded instead of growing with the requests. Samplers sharing a `bucket` share the limit (see setup_tracing).
+    """
+
+    def __init__(self, max_per_second: float, delegate: Sampler = None, bucket: TokenBucket = None):
+        self.max_per_second = max_per_second
+        self.delegate = delegate
+        self.bucket = bucket or TokenBucket(max_per_second)
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        if self.delegate is not None:
+            result = self.delegate.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+            if result.decision != Decision.RECORD_AND_SAMPLE:
+                return result
+            attributes, trace_state = result.attributes, result.trace_state
+        elif trace_state is None:
+            # As the SDK samplers: the span keeps the trace state of its parent (e.g. the vendor entries of the caller)
+            parent = trace.get_current_span(parent_context).get_span_context()
+            trace_state = parent.trace_state if parent.is_valid else None
+        if not self.bucket.take():
+            return SamplingResult(Decision.DROP, trace_state=trace_state)
+        return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, trace_state)
+
+    def get_description(self) -> str:
+        delegate = self.delegate.get_description() if self.delegate is not None else "AlwaysOnSampler"
+        return f"RateLimitingSampler{{{self.max_per_second}, {delegate}}}"
+
+
+class CountingBatchSpanProcessor(BatchSpanProcessor):
+    """
+    A BatchSpanProcessor that counts the spans it drops because its queue is full (the exporter cannot keep up), and
+    reports them with the `dropped_counter` (e.g. an OpenTelemetry counter), as the SDK only logs a warning.
+    """
+
+    def __init__(self, span_exporter, dropped_counter=None, **kwargs):
+        super().__init__(span_exporter, **kwargs)
+        self.dropped = 0
+        self.dropped_counter = dropped_counter
+        self._warned = False
+
+    def _span_queue(self):
+        # Private attributes of the SDK: the queue moved to a shared BatchProcessor in recent versions
+        processor = getattr(self, "_batch_processor", self)
+        queue = getattr(processor, "_queue", None)
+        if queue is None:
+            queue = getattr(processor, "queue", None)
+        if queue is None and not self._warned:
+            self._warned = True
+            logger.warning("Span queue of the BatchSpanProcessor not found: queue depth and dropped spans not reported")
+        return queue, getattr(processor, "_max_queue_size", None) or getattr(processor, "max_queue_size", None)
+
+    @property
+    def queue_depth(self) -> int:
+        "Number of spans waiting to be exported"
+        queue, _ = self._span_queue()
+        return len(queue) if queue is not None else 0
+
+    def on_end(self, span):
+        if span.context and span.context.trace_flags.sampled:
+            queue, max_queue_size = self._span_queue()
+            if queue is not None and max_queue_size and len(queue) >= max_queue_size:
+                self.dropped += 1
+                if self.dropped_counter is not None:
+                    self.dropped_counter.add(1)
+        super().on_end(span)
+
+
+def setup_tracing(
+    service_name: str = "fastapi-app",
+    ratio: float = None,
+    max_per_second: float = None,
+    max_queue_size: int = None,
+    max_export_batch_size: int = None,
+    schedule_delay_ms: float = None,
+    export_timeout_ms: float = None,
+    max_attributes: int = None,
+    max_attribute_length: int = None,
+    exporter=None,
+    meter=None,
+    set_global: bool = True,
+):
+    """
+    Create the tracer provider of the app, exporting its spans in batches.
 
-# Configure OTLP exporter for Dynatrace
-otlp_exporter = OTLPSpanExporter(
-    endpoint= f"{os.getenv('DYNATRACE_OTLP_ENDPOINT')}/v1/traces",
-    headers={"Authorization": f"Api-Token {os.getenv('DYNATRACE_API_TOKEN')}"}
-)
+    Traces started by the app are sampled with a ratio and/or a rate limit; the spans of a request whose caller
+    sampled its trace (or not) follow the decision of the caller (parent based sampling), so traces stay complete.
+    The rate limit also applies to the requests of callers that sampled their trace (sharing the same budget), so
+    they cannot bypass it: above the limit, some of their traces miss the spans of this service.
+    Args:
+        service_name (str): The `service.name` of the spans.
+        ratio (float): Fraction of the traces sampled (OTEL_TRACES_SAMPLER_ARG, 1.0 by default).
+        max_per_second (float): Maximum number of traces sampled per second (OTEL_TRACES_MAX_PER_SECOND, no limit by
+            default).
+        max_queue_size (int): Spans waiting for the exporter, before dropping new ones (OTEL_BSP_MAX_QUEUE_SIZE, 2048).
+        max_export_batch_size (int): Spans per export request (OTEL_BSP_MAX_EXPORT_BATCH_SIZE, 512).
+        schedule_delay_ms (float): Milliseconds between exports (OTEL_BSP_SCHEDULE_DELAY, 5000).
+        export_timeout_ms (float): Timeout of an export (OTEL_BSP_EXPORT_TIMEOUT, 30000).
+        max_attributes (int): Attributes per span (OTEL_SPAN_ATTRIBUTE_COUNT_LIMIT, 128).
+        max_attribute_length (int): Length of the attribute values (OTEL_SPAN_ATTRIBUTE_VALUE_LENGTH_LIMIT, no limit).
+        exporter: The span exporter. Defaults to the OTLP endpoint of Dynatrace (DYNATRACE_OTLP_ENDPOINT).
+        meter: If given, the dropped spans are counted with its `otel_spans_dropped` counter.
+        set_global (bool): Also set the provider as the global one.
+    Returns:
+        tuple: The tracer provider and its span processor (see CountingBatchSpanProcessor).
+    """
+    ratio = float(os.getenv("OTEL_TRACES_SAMPLER_ARG", 1.0)) if ratio is None else ratio
+    if max_per_second is None and os.getenv("OTEL_TRACES_MAX_PER_SECOND"):
+        max_per_second = float(os.getenv("OTEL_TRACES_MAX_PER_SECOND"))
+    sampler = ParentBased(TraceIdRatioBased(ratio))
+    if max_per_second:
+        bucket = TokenBucket(max_per_second)
+        sampler = ParentBased(
+            RateLimitingSampler(max_per_second, delegate=TraceIdRatioBased(ratio), bucket=bucket),
+            remote_parent_sampled=RateLimitingSampler(max_per_second, bucket=bucket),
+        )
 
-span_processor = BatchSpanProcessor(otlp_exporter)
-tracer_provider.add_span_processor(span_processor)
+    tracer_provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=sampler,
+        span_limits=SpanLimits(max_span_attributes=max_attributes, max_attribute_length=max_attribute_length),
+    )
+    if exporter is None:
+        # Configure OTLP exporter for Dynatrace
+        exporter = OTLPSpanExporter(
+            endpoint=f"{os.getenv('DYNATRACE_OTLP_ENDPOINT')}/v1/traces",
+            headers={"Authorization": f"Api-Token {os.getenv('DYNATRACE_API_TOKEN')}"}
+        )
+    dropped_counter = None
+    if meter is not None:
+        dropped_counter = meter.create_counter(
+            "otel_spans_dropped", unit="{span}", description="Spans dropped because the export queue was full"
+        )
+    span_processor = CountingBatchSpanProcessor(
+        exporter,
+        dropped_counter=dropped_counter,
+        max_queue_size=max_queue_size,
+        max_export_batch_size=max_export_batch_size,
+        schedule_delay_millis=schedule_delay_ms,
+        export_timeout_millis=export_timeout_ms,
+    )
+    tracer_provider.add_span_processor(span_processor)
+    if set_global:
+        trace.set_tracer_provider(tracer_provider)
+    return tracer_provider, span_processor
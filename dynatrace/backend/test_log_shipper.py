@@ -0,0 +1,153 @@
+"""
+Tests of the background log shipper against a local stub of the log ingest API.
+
+    PYTHONPATH=. python -m pytest dynatrace/backend/test_log_shipper.py
+"""
+
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dynatrace.backend.log_shipper import LogShipper
+
+
+class StubIngest:
+    "A local log ingest API, answering with the given statuses in turn (then 200), and keeping the received batches"
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.batches = []
+        self.headers = []
+        self.responses = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status = stub.statuses.pop(0) if stub.statuses else 200
+                stub.headers.append(dict(self.headers))
+                stub.responses.append(status)
+                if status < 300:
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        body = gzip.decompress(body)
+                    stub.batches.append(json.loads(body))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}/api/v2/logs/ingest"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def records(self) -> list:
+        return [record["content"] for batch in self.batches for record in batch]
+
+
+class LogShipperTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spill_path = os.path.join(self.tmp.name, "spill.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def shipper(self, stub, **kwargs) -> LogShipper:
+        kwargs = {"api_token": "token", "flush_interval": 0.05, "backoff": 0.01, **kwargs}
+        shipper = LogShipper(stub.url, **kwargs)
+        self.addCleanup(shipper.close)
+        self.addCleanup(stub.stop)
+        return shipper
+
+    def test_records_are_sent_in_compressed_batches(self):
+        stub = StubIngest()
+        shipper = self.shipper(stub, max_batch_size=10)
+        for i in range(25):
+            self.assertTrue(shipper.enqueue({"content": i}))
+        self.assertTrue(shipper.flush())
+        self.assertEqual(sorted(stub.records()), list(range(25)))
+        self.assertTrue(all(len(batch) <= 10 for batch in stub.batches))
+        self.assertEqual(shipper.sent, 25)
+        self.assertEqual(stub.headers[0]["Authorization"], "Api-Token token")
+        self.assertEqual(stub.headers[0]["Content-Encoding"], "gzip")
+
+    def test_failed_batches_are_retried(self):
+        stub = StubIngest(statuses=[503, 429])
+        shipper = self.shipper(stub)
+        shipper.enqueue({"content": "retried"})
+        self.assertTrue(shipper.flush())
+        self.assertEqual(stub.responses, [503, 429, 200])
+        self.assertEqual(stub.records(), ["retried"])
+        self.assertEqual(shipper.dropped, 0)
+
+    def test_rejected_batches_are_not_retried(self):
+        stub = StubIngest(statuses=[400])
+        shipper = self.shipper(stub)
+        shipper.enqueue({"content": "rejected"})
+        self.assertTrue(shipper.flush())
+        self.assertEqual(stub.responses, [400])
+        self.assertEqual(shipper.dropped, 1)
+
+    def test_spilled_batches_are_sent_when_idle(self):
+        stub = StubIngest(statuses=[400])
+        shipper = self.shipper(stub, overflow="spill", spill_path=self.spill_path)
+        shipper.enqueue({"content": "spilled"})
+        self.assertTrue(shipper.flush())
+        self.assertEqual(shipper.spilled, 1)
+        # Replayed the next time the buffer stays empty for flush_interval
+        deadline = time.monotonic() + 5
+        while shipper.sent == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(stub.records(), ["spilled"])
+        self.assertEqual(shipper.sent, 1)
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_records_are_sent_at_close(self):
+        stub = StubIngest()
+        shipper = self.shipper(stub, flush_interval=60)
+        shipper.enqueue({"content": "last"})
+        shipper.close()
+        self.assertEqual(stub.records(), ["last"])
+
+    def test_records_that_cannot_be_serialized_are_dropped(self):
+        stub = StubIngest()
+        shipper = self.shipper(stub)
+        circular = {"content": "circular"}
+        circular["self"] = circular
+        shipper.enqueue(circular)
+        shipper.enqueue({"content": "object", "value": object()})
+        self.assertTrue(shipper.flush())
+        self.assertEqual(shipper.dropped, 1)
+        # The thread is still running
+        shipper.enqueue({"content": "next"})
+        self.assertTrue(shipper.flush())
+        self.assertEqual(stub.records(), ["object", "next"])
+        self.assertTrue(stub.batches[0][0]["value"].startswith("<object object"))
+
+    def test_invalid_spill_lines_are_skipped(self):
+        stub = StubIngest()
+        with open(self.spill_path, "w") as f:
+            f.write('{"content": "valid"}\n{"content": "cut\n')
+        shipper = self.shipper(stub, overflow="spill", spill_path=self.spill_path)
+        shipper._replay_spill()
+        self.assertEqual(stub.records(), ["valid"])
+        self.assertEqual(shipper.dropped, 1)
+        self.assertFalse(os.path.exists(f"{self.spill_path}.replay"))
+
+
+if __name__ == "__main__":
+    unittest.main()
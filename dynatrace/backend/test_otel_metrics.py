@@ -0,0 +1,80 @@
+"""
+Tests of the request metrics, read with an in-memory metric reader.
+
+    PYTHONPATH=. python -m pytest dynatrace/backend/test_otel_metrics.py
+"""
+
+import asyncio
+import unittest
+
+import httpx
+from fastapi import FastAPI
+from opentelemetry.sdk.metrics.export import AggregationTemporality, InMemoryMetricReader
+
+from dynatrace.backend.otel_metrics import (
+    LATENCY_BUCKETS,
+    REQUEST_DURATION,
+    REQUEST_SIZE,
+    REQUESTS_IN_FLIGHT,
+    RequestMetricsMiddleware,
+    setup_metrics,
+    temporality_preference,
+)
+
+
+def metric_points(reader) -> dict:
+    "The data points of each metric collected by the reader"
+    points = {}
+    for resource_metrics in reader.get_metrics_data().resource_metrics:
+        for scope_metrics in resource_metrics.scope_metrics:
+            for metric in scope_metrics.metrics:
+                points[metric.name] = (metric.data, list(metric.data.data_points))
+    return points
+
+
+class RequestMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.reader = InMemoryMetricReader(preferred_temporality=temporality_preference("delta"))
+        meter = setup_metrics(readers=[self.reader], set_global=False)
+        app = FastAPI()
+
+        @app.post("/items/{item_id}")
+        def add_item(item_id: int):
+            return {"id": item_id}
+
+        app.add_middleware(RequestMetricsMiddleware, meter=meter)
+        self.app = app
+
+    def post(self, *paths):
+        async def send():
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return [await client.post(path, content=b"body") for path in paths]
+
+        return asyncio.run(send())
+
+    def test_requests_are_recorded_per_route_template(self):
+        self.post("/items/1", "/items/2", "/missing")
+        metric, points = metric_points(self.reader)[REQUEST_DURATION]
+        counts = {(p.attributes["http.route"], p.attributes["http.status_code"]): p.count for p in points}
+        self.assertEqual(counts, {("/items/{item_id}", 200): 2, ("unmatched", 404): 1})
+        self.assertEqual(tuple(points[0].explicit_bounds), LATENCY_BUCKETS)
+        self.assertEqual(metric.aggregation_temporality, AggregationTemporality.DELTA)
+        # Delta temporality: nothing new since the previous collection
+        self.assertNotIn(REQUEST_DURATION, metric_points(self.reader))
+
+    def test_request_sizes_and_in_flight(self):
+        self.post("/items/1")
+        points = metric_points(self.reader)
+        _, sizes = points[REQUEST_SIZE]
+        self.assertEqual([p.sum for p in sizes], [4])
+        _, in_flight = points[REQUESTS_IN_FLIGHT]
+        self.assertEqual([p.value for p in in_flight], [0])
+
+    def test_temporality_of_caller_readers_is_rejected(self):
+        with self.assertRaises(ValueError):
+            setup_metrics(temporality="cumulative", readers=[InMemoryMetricReader()], set_global=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
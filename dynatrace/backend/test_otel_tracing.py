@@ -0,0 +1,102 @@
+"""
+Tests of the trace sampling and of the span processor, with an in-memory exporter.
+
+    PYTHONPATH=. python -m pytest dynatrace/backend/test_otel_tracing.py
+"""
+
+import unittest
+from unittest import mock
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags, TraceState
+
+from dynatrace.backend.otel_tracing import RateLimitingSampler, setup_tracing
+
+TRACE_STATE = TraceState([("dt", "caller")])
+
+
+def remote_parent(trace_id: int, sampled: bool = True):
+    "The context of a request whose caller started the trace (as propagated by a `traceparent` header)"
+    span_context = SpanContext(
+        trace_id,
+        span_id=1,
+        is_remote=True,
+        trace_flags=TraceFlags(TraceFlags.SAMPLED if sampled else TraceFlags.DEFAULT),
+        trace_state=TRACE_STATE,
+    )
+    return trace.set_span_in_context(NonRecordingSpan(span_context))
+
+
+class SamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        self.provider, self.processor = setup_tracing(
+            ratio=1.0, max_per_second=5, exporter=self.exporter, schedule_delay_ms=60_000, set_global=False
+        )
+        self.addCleanup(self.provider.shutdown)
+        self.tracer = self.provider.get_tracer(__name__)
+
+    def exported(self) -> list:
+        self.provider.force_flush()
+        return self.exporter.get_finished_spans()
+
+    def test_root_traces_are_rate_limited(self):
+        for _ in range(20):
+            with self.tracer.start_as_current_span("request"):
+                with self.tracer.start_as_current_span("query"):
+                    pass
+        spans = self.exported()
+        # Complete traces: the children of the sampled roots follow their decision
+        self.assertEqual(len({span.context.trace_id for span in spans}), 5)
+        self.assertEqual(len(spans), 10)
+
+    def test_traces_sampled_by_the_callers_share_the_limit(self):
+        for trace_id in range(1, 21):
+            with self.tracer.start_as_current_span("request", context=remote_parent(trace_id)):
+                pass
+        self.assertEqual(len(self.exported()), 5)
+
+    def test_traces_not_sampled_by_the_callers_are_dropped(self):
+        with self.tracer.start_as_current_span("request", context=remote_parent(1, sampled=False)):
+            pass
+        self.assertEqual(self.exported(), ())
+
+    def test_trace_state_of_the_caller_is_kept(self):
+        with self.tracer.start_as_current_span("request", context=remote_parent(1)):
+            pass
+        (span,) = self.exported()
+        self.assertEqual(span.context.trace_state, TRACE_STATE)
+
+    def test_description(self):
+        self.assertEqual(RateLimitingSampler(5).get_description(), "RateLimitingSampler{5, AlwaysOnSampler}")
+
+
+class SpanProcessorTest(unittest.TestCase):
+    def test_queue_depth(self):
+        provider, processor = setup_tracing(
+            exporter=InMemorySpanExporter(), max_queue_size=4, max_export_batch_size=4, schedule_delay_ms=60_000,
+            set_global=False,
+        )
+        self.addCleanup(provider.shutdown)
+        tracer = provider.get_tracer(__name__)
+        # The export of a full batch is asynchronous: only the first spans are certain to stay in the queue
+        for _ in range(3):
+            with tracer.start_as_current_span("request"):
+                pass
+        self.assertEqual(processor.queue_depth, 3)
+
+    def test_missing_queue_is_reported_once(self):
+        provider, processor = setup_tracing(exporter=InMemorySpanExporter(), set_global=False)
+        self.addCleanup(provider.shutdown)
+        # As with a version of the SDK that renamed its private attributes
+        with mock.patch.object(processor, "_batch_processor", object()), self.assertLogs(
+            "dynatrace.backend.otel_tracing", "WARNING"
+        ) as logs:
+            self.assertEqual(processor.queue_depth, 0)
+            self.assertEqual(processor.queue_depth, 0)
+        self.assertEqual(len(logs.records), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+Tests of the worker pool of the CPU-bound workloads, and of the modes of the /overload endpoint.
+
+    PYTHONPATH=. python -m pytest dynatrace/backend/test_workloads.py
+"""
+
+import asyncio
+import os
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import httpx
+
+from dynatrace.backend.app import AppConfig, create_app
+from dynatrace.backend.workloads import PoolBusy, WorkerPool, overload_loop, overload_vectorized
+
+
+class WorkloadsTest(unittest.TestCase):
+    def test_loop_and_vectorized_do_the_same_work(self):
+        # The mean of a product of two uniform numbers is 1/4
+        self.assertAlmostEqual(overload_loop(100_000) / 100_000, 0.25, delta=0.01)
+        self.assertAlmostEqual(overload_vectorized(100_000, chunk_size=30_000) / 100_000, 0.25, delta=0.01)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(max_workers=1, max_queue=0)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_full_pool_rejects_right_away(self):
+        async def run():
+            running = asyncio.ensure_future(self.pool.run(time.sleep, 0.5))
+            await asyncio.sleep(0)
+            self.assertEqual(self.pool.pending, 1)
+            start = time.perf_counter()
+            with self.assertRaises(PoolBusy):
+                await self.pool.run(time.sleep, 0)
+            self.assertLess(time.perf_counter() - start, 0.1)
+            await running
+
+        asyncio.run(run())
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_pool_is_restarted_after_a_worker_died(self):
+        async def run():
+            with self.assertRaises(BrokenProcessPool):
+                await self.pool.run(os._exit, 1)
+            return await self.pool.run(overload_loop, 10)
+
+        self.assertGreater(asyncio.run(run()), 0)
+        self.assertEqual(self.pool.pending, 0)
+
+
+class OverloadEndpointTest(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.dict(os.environ, {"OVERLOAD_POOL_WORKERS": "1", "OVERLOAD_POOL_QUEUE": "1"}):
+            self.app = create_app(AppConfig(tracing=False, metrics=False, logs="none"))
+
+    def request(self, *requests):
+        "Send the (method, path) requests in turn, with the app started and stopped around them"
+
+        async def send():
+            async with self.app.router.lifespan_context(self.app):
+                transport = httpx.ASGITransport(app=self.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    return [await client.request(method, path) for method, path in requests]
+
+        return asyncio.run(send())
+
+    def test_every_mode_is_timed(self):
+        responses = self.request(
+            *[("POST", f"/overload?mode={mode}&iterations=1000") for mode in ("loop", "vectorized", "process")],
+            ("GET", "/overload/stats"),
+        )
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 200])
+        self.assertEqual([response.json()["mode"] for response in responses[:3]], ["loop", "vectorized", "process"])
+        stats = responses[3].json()
+        counts = {mode: mode_stats["count"] for mode, mode_stats in stats["modes"].items()}
+        self.assertEqual(counts, {"loop": 1, "vectorized": 1, "process": 1})
+        self.assertEqual(stats["pool"], {"pending": 0, "workers": 1})
+
+    def test_full_pool_is_service_unavailable(self):
+        with mock.patch.object(WorkerPool, "run", side_effect=PoolBusy()):
+            (response,) = self.request(("POST", "/overload?mode=process&iterations=1000"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_invalid_parameters_are_rejected(self):
+        responses = self.request(("POST", "/overload?mode=threads"), ("POST", "/overload?iterations=0"))
+        self.assertEqual([response.status_code for response in responses], [422, 422])
+
+
+if __name__ == "__main__":
+    unittest.main()
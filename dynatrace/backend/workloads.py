@@ -0,0 +1,158 @@
+"""
+CPU-bound workloads of the `/overload` endpoint, and the process pool that runs them outside of the server process.
+
+The pure Python loop holds the GIL for its whole duration: run in the threadpool of the server, it still slows down
+every other request of the worker. It can run instead:
+- vectorized with NumPy, which does the same work in a few calls to compiled code;
+- in a `WorkerPool` (a `ProcessPoolExecutor` with a bounded queue), so the server process only awaits the result.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+ITERATIONS = 5_000_000
+MODES = ("loop", "vectorized", "process")
+
+
+def overload_loop(iterations: int = ITERATIONS) -> float:
+    """
+    Multiply `iterations` pairs of random numbers in pure Python (the original workload).
+    Returns:
+        float: The sum of the products (so the work cannot be skipped).
+    """
+    total = 0.0
+    for _ in range(iterations):
+        total += random.random() * random.random()
+    return total
+
+
+def overload_vectorized(iterations: int = ITERATIONS, chunk_size: int = 1_000_000) -> float:
+    """
+    The same workload with NumPy, in chunks of `chunk_size` numbers to bound the memory used (16 bytes per number).
+    Returns:
+        float: The sum of the products.
+    """
+    rng = np.random.default_rng()
+    total = 0.0
+    for start in range(0, iterations, chunk_size):
+        size = min(chunk_size, iterations - start)
+        total += float(np.dot(rng.random(size), rng.random(size)))
+    return total
+
+
+def timed(function, *args) -> float:
+    "Run a workload and return its duration in seconds (measured where it runs, e.g. in a worker process)"
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+class PoolBusy(Exception):
+    "The pool has `max_workers + max_queue` tasks already: the request should be rejected (503) instead of queued"
+
+
+class WorkerPool:
+    """
+    A `ProcessPoolExecutor` for the CPU-bound work of the requests, with a limit on the queued tasks.
+
+    At most `max_workers` tasks run at once, and `max_queue` more wait for a worker; when both are full, `run` raises
+    `PoolBusy` right away, so a burst of requests is rejected instead of piling up behind minutes of work. The
+    executor is started at the first task, in each server process, with the `spawn` start method: forking a process
+    that runs threads (the event loop, the log shipper, the exporters) is unsafe.
+    """
+
+    def __init__(self, max_workers: int = None, max_queue: int = None, start_method: str = "spawn"):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = self.max_workers if max_queue is None else max_queue
+        self.start_method = start_method
+        self._pending = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        "Number of tasks running or waiting for a worker"
+        return self._pending
+
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                    )
+        return self._executor
+
+    async def run(self, function, *args):
+        """
+        Run `function(*args)` in a worker process and await its result.
+        Raises:
+            PoolBusy: If `max_workers + max_queue` tasks are already running or queued.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise PoolBusy()
+            self._pending += 1
+        executor = self.executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed when out of memory): the next task starts a new pool
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+
+
+class Timings:
+    "Count and duration of the workloads per mode, for the comparison endpoint"
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, mode: str, duration: float, wall: float):
+        with self._lock:
+            stats = self._stats.setdefault(mode, {"count": 0, "total": 0.0, "wall_total": 0.0, "min": None, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["wall_total"] += wall
+            stats["min"] = duration if stats["min"] is None else min(stats["min"], duration)
+            stats["max"] = max(stats["max"], duration)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: Per mode, the number of runs and the mean, min and max duration of the workload, and the mean wall
+                time of the request (including the wait for a thread or a worker process), in seconds.
+        """
+        with self._lock:
+            return {
+                mode: {
+                    "count": stats["count"],
+                    "mean_s": round(stats["total"] / stats["count"], 4),
+                    "min_s": round(stats["min"], 4),
+                    "max_s": round(stats["max"], 4),
+                    "mean_wall_s": round(stats["wall_total"] / stats["count"], 4),
+                }
+                for mode, stats in self._stats.items()
+            }
@@ -0,0 +1,123 @@
+"""
+Benchmark of the local ETL pipeline (`etl_pipeline.py`) at increasing numbers of article hits.
+
+For each size, it generates a synthetic dataset as Parquet files (same layout as `create_data.py --output-dir`), runs
+the pipeline in a separate process (so that the peak memory of each run is measured independently) and reports the
+throughput in hits/s and the peak resident memory.
+
+Usage:
+    python3 benchmark_etl.py --sizes 1000000,10000000,100000000 --work-dir /tmp/etl_benchmark
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SIZES = [1_000_000, 10_000_000, 100_000_000]
+HITS_PER_LEAD = 50  # Average number of hits per lead
+NUM_ARTICLES = 1000
+PERC_USERS = 0.9
+CHUNK_SIZE = 5_000_000  # Hits generated (and written) per chunk, to generate datasets larger than memory
+
+
+def generate_dataset(path: str, num_hits: int, seed: int = 0):
+    """
+    Generate leads, users and article hits as Parquet files.
+    Args:
+        path (str): The folder of the dataset.
+        num_hits (int): The number of article hits.
+        seed (int): The random seed.
+    """
+    rng = np.random.default_rng(seed)
+    num_leads = max(1, num_hits // HITS_PER_LEAD)
+    for table in ("form_leads", "users", "form_articlehits"):
+        os.makedirs(os.path.join(path, table), exist_ok=True)
+
+    ids = np.arange(1, num_leads + 1)
+    emails = pa.array([f"user{i}@example.com" for i in ids.tolist()])
+    leads = pa.table({"id": ids, "name": pa.array([f"User {i}" for i in ids.tolist()]), "email": emails})
+    leads = leads.append_column("preview", pa.array(rng.integers(0, 2, size=num_leads).astype(bool)))
+    pq.write_table(leads, os.path.join(path, "form_leads", "part-00000.parquet"))
+
+    selected = np.sort(rng.choice(num_leads, size=int(num_leads * PERC_USERS), replace=False))
+    users = pa.table(
+        {"email": emails.take(selected), "country": pa.array(rng.choice(["Spain", "France", "Peru"], len(selected)))}
+    )
+    pq.write_table(users, os.path.join(path, "users", "part-00000.parquet"))
+
+    now = np.datetime64("2025-06-01T00:00:00", "us")
+    writer = None
+    for start in range(0, num_hits, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, num_hits - start)
+        hits = pa.table(
+            {
+                "id": np.arange(start + 1, start + size + 1),
+                "timestamp": pa.array(
+                    now - rng.integers(0, 30 * 24 * 3600, size=size).astype("timedelta64[s]"),
+                    type=pa.timestamp("us", tz="UTC"),
+                ),
+                "feed_id": rng.integers(1, NUM_ARTICLES + 1, size=size),
+                "lead_id": rng.integers(1, num_leads + 1, size=size),
+            }
+        )
+        if writer is None:
+            writer = pq.ParquetWriter(os.path.join(path, "form_articlehits", "part-00000.parquet"), hits.schema)
+        writer.write_table(hits)
+    writer.close()
+
+
+def run_pipeline(path: str, batch_size: int) -> dict:
+    "Run the pipeline on a dataset in a child process and return its statistics"
+    output = os.path.join(path, "transformed_zone")
+    shutil.rmtree(output, ignore_errors=True)
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "etl_pipeline.py"),
+            "--leads",
+            os.path.join(path, "form_leads"),
+            "--hits",
+            os.path.join(path, "form_articlehits"),
+            "--users",
+            os.path.join(path, "users"),
+            "--output",
+            output,
+            "--batch-size",
+            str(batch_size),
+            "--json",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the local ETL pipeline.")
+    parser.add_argument(
+        "--sizes", type=str, default=",".join(map(str, SIZES)), help="Comma-separated numbers of article hits"
+    )
+    parser.add_argument("--work-dir", type=str, default="etl_benchmark", help="Folder for the generated datasets")
+    parser.add_argument("--batch-size", type=int, default=1_000_000, help="Article hits processed per batch")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated datasets")
+    args = parser.parse_args()
+
+    print(f"{'hits':>12} {'output rows':>12} {'seconds':>9} {'hits/s':>12} {'peak MB':>9}")
+    for size in [int(float(s)) for s in args.sizes.split(",")]:
+        path = os.path.join(args.work_dir, f"hits_{size}")
+        generate_dataset(path, size)
+        stats = run_pipeline(path, args.batch_size)
+        print(
+            f"{stats['input_hits']:>12} {stats['output_rows']:>12} {stats['seconds']:>9.2f} "
+            f"{stats['hits_per_second']:>12} {stats['peak_rss_mb']:>9.1f}"
+        )
+        if not args.keep:
+            shutil.rmtree(path, ignore_errors=True)
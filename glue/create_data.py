@@ -7,15 +7,27 @@ This script does the following:
 4. Creates a CSV file with as many rows as PERC_USERS of the users generated, with the following columns:
     - email: The email of the user.
     - country: The country of the user (randomly generated).
+
+All the sizes can be changed from the command line (see `--help`). With `--bulk`, the rows are generated in vectorized
+batches (NumPy) and streamed to PostgreSQL with `COPY ... FROM STDIN` instead of one INSERT per row, which is needed to
+generate millions of article hits. `--workers N` splits the generation in N shards run by a process pool, each with
+its own seed and its own COPY stream (or its own files, with `--output-dir`).
 """
 
 import csv
+import io
+import os
 import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
-from typing import List, Tuple
+from typing import Iterable, List, Tuple
 
 import faker
+import faker.providers.address.en_US
+import numpy as np
 import psycopg2
+import psycopg2.extras
 from tqdm import tqdm
 
 MAX_NUM_ARTICLES = 1000  # Maximum number of articles to fetch from the database
@@ -24,16 +36,356 @@ MIN_ARTICLE_HITS = 10  # Minimum number of article hits per user
 MAX_ARTICLE_HITS = 100  # Maximum number of article hits per user
 MAX_PAST_DAYS = 30  # Maximum number of days in the past for random timestamps
 PERC_USERS = 0.9  # Percentage of users to include in the CSV file
+BATCH_SIZE = 100_000  # Number of rows sent to the database in each batch (only with --bulk)
+
+
+def normalize_email(email: str) -> str:
+    "The normalized email of a lead, as `Leads.normalize_email` in form/models.py"
+    return email.strip().lower()
+
+
+def copy_rows(cursor, table: str, columns: List[str], rows: Iterable[tuple]):
+    """
+    Stream rows into a table with `COPY ... FROM STDIN`, which is much faster than one INSERT per row.
+    Args:
+        cursor: The psycopg2 cursor.
+        table (str): The name of the table.
+        columns (List[str]): The columns of the table to fill, in the same order as the values of each row.
+        rows (Iterable[tuple]): The rows to insert. Values must not contain commas, quotes or new lines.
+    """
+    buffer = io.StringIO("\n".join(",".join(map(str, row)) for row in rows))
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def format_timestamps(timestamps: np.ndarray) -> List[str]:
+    "Format UTC datetime64 values as strings PostgreSQL understands as timestamps with time zone"
+    return np.char.add(np.datetime_as_string(timestamps, unit="us"), "+00").tolist()
+
+
+def generate_hits(
+    rng: np.random.Generator,
+    user_ids: np.ndarray,
+    article_ids: np.ndarray,
+    min_article_hits: int,
+    max_article_hits: int,
+    max_past_days: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Generate random article hits for a batch of users, vectorized with NumPy.
+    Args:
+        rng (np.random.Generator): The random generator.
+        user_ids (np.ndarray): The ids of the users (leads).
+        article_ids (np.ndarray): The ids of the articles (feeds) that can be clicked.
+        min_article_hits (int): Minimum number of hits per user.
+        max_article_hits (int): Maximum number of hits per user.
+        max_past_days (int): Maximum number of days in the past of the hits.
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The lead ids, feed ids and timestamps (datetime64, UTC) of the hits.
+    """
+    num_hits = rng.integers(min_article_hits, max_article_hits, size=len(user_ids), endpoint=True)
+    lead_ids = np.repeat(user_ids, num_hits)
+    feed_ids = rng.choice(article_ids, size=len(lead_ids))
+    now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "us")
+    seconds_ago = rng.integers(0, max_past_days * 24 * 60 * 60, size=len(lead_ids), endpoint=True)
+    return lead_ids, feed_ids, now - seconds_ago.astype("timedelta64[s]")
+
+
+class DatabaseWriter:
+    "Writes the generated rows to PostgreSQL (leads with multi-row INSERTs, hits with COPY)"
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+
+    def write_leads(self, rows: List[Tuple[str, str, bool]]) -> List[Tuple[int, str]]:
+        # Leads whose normalized email already exists (Faker may generate the same email twice) are skipped
+        users = psycopg2.extras.execute_values(
+            self.cursor,
+            "INSERT INTO form_leads (name, email, email_normalized, preview) VALUES %s "
+            "ON CONFLICT (email_normalized) DO NOTHING RETURNING id, email",
+            [(name, email, normalize_email(email), preview) for name, email, preview in rows],
+            page_size=len(rows),
+            fetch=True,
+        )
+        self.conn.commit()
+        return users
+
+    def write_hits(self, lead_ids: np.ndarray, feed_ids: np.ndarray, timestamps: np.ndarray):
+        copy_rows(
+            self.cursor,
+            "form_articlehits",
+            ["lead_id", "feed_id", "timestamp"],
+            zip(lead_ids.tolist(), feed_ids.tolist(), format_timestamps(timestamps)),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.cursor.close()
+
+
+class FileWriter:
+    """
+    Writes the generated rows to partitioned files instead of the database, one file per shard and table:
+    - `<output_dir>/form_leads/part-<shard>.<format>`: id, name, email, email_normalized, preview
+    - `<output_dir>/form_articlehits/part-<shard>.<format>`: lead_id, feed_id, timestamp
+    The lead ids are assigned from `first_lead_id`, and the leads with an email already written by the shard are
+    skipped (email_normalized is unique). The shards do not see each other's emails, so the emails of every shard but
+    the first get a `+<shard>` tag in their local part (Faker emails have none), and the files of all the shards can
+    be loaded into the same table. CSV files have no header and can be loaded with
+    `\\copy form_leads (id, name, email, email_normalized, preview) FROM 'part-00000.csv' WITH CSV` and
+    `\\copy form_articlehits (lead_id, feed_id, timestamp) FROM 'part-00000.csv' WITH CSV`.
+    Parquet files need pyarrow.
+    """
+
+    def __init__(self, output_dir: str, shard: int, file_format: str, first_lead_id: int):
+        if file_format not in ("csv", "parquet"):
+            raise ValueError(f"Unknown file format: {file_format}")
+        self.file_format = file_format
+        self.next_lead_id = first_lead_id
+        self.email_tag = f"+{shard}" if shard else ""
+        self.emails = set()  # Normalized emails of the shard, which must be unique
+        self.paths = {}
+        for table in ("form_leads", "form_articlehits"):
+            os.makedirs(os.path.join(output_dir, table), exist_ok=True)
+            self.paths[table] = os.path.join(output_dir, table, f"part-{shard:05d}.{file_format}")
+        self._files = {}
+        self._parquet_writers = {}
+
+    def write_leads(self, rows: List[Tuple[str, str, bool]]) -> List[Tuple[int, str]]:
+        unique_rows = []
+        for name, email, preview in rows:
+            if self.email_tag:
+                local, _, domain = email.rpartition("@")
+                email = f"{local}{self.email_tag}@{domain}"
+            if normalize_email(email) not in self.emails:
+                self.emails.add(normalize_email(email))
+                unique_rows.append((name, email, normalize_email(email), preview))
+        if not unique_rows:
+            return []
+        ids = list(range(self.next_lead_id, self.next_lead_id + len(unique_rows)))
+        self.next_lead_id += len(unique_rows)
+        names, emails, normalized, previews = zip(*unique_rows)
+        self._write(
+            "form_leads",
+            {"id": ids, "name": names, "email": emails, "email_normalized": normalized, "preview": previews},
+        )
+        return list(zip(ids, emails))
+
+    def write_hits(self, lead_ids: np.ndarray, feed_ids: np.ndarray, timestamps: np.ndarray):
+        self._write("form_articlehits", {"lead_id": lead_ids, "feed_id": feed_ids, "timestamp": timestamps})
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        for writer in self._parquet_writers.values():
+            writer.close()
 
+    def _write(self, table: str, columns: dict):
+        if self.file_format == "csv":
+            if table not in self._files:
+                self._files[table] = open(self.paths[table], "w", newline="")
+            if "timestamp" in columns:
+                columns = {**columns, "timestamp": format_timestamps(columns["timestamp"])}
+            csv.writer(self._files[table]).writerows(zip(*(list(c) for c in columns.values())))
+            return
 
-def main(pg_host: str, pg_port: int, pg_db: str, pg_user: str, pg_password: str, csv_file_path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if "timestamp" in columns:
+            columns = {**columns, "timestamp": pa.array(columns["timestamp"], type=pa.timestamp("us", tz="UTC"))}
+        batch = pa.table({name: (c if isinstance(c, pa.Array) else pa.array(c)) for name, c in columns.items()})
+        if table not in self._parquet_writers:
+            self._parquet_writers[table] = pq.ParquetWriter(self.paths[table], batch.schema, compression="snappy")
+        self._parquet_writers[table].write_table(batch)
+
+
+def bulk_generate(
+    writer,
+    fake: faker.Faker,
+    rng: np.random.Generator,
+    article_ids: List[int],
+    csv_file_path: str,
+    num_users: int,
+    min_article_hits: int,
+    max_article_hits: int,
+    max_past_days: int,
+    perc_users: float,
+    batch_size: int,
+    progress: bool = True,
+) -> Tuple[int, int]:
+    """
+    High-volume version of the generation done in `main`: users are written in batches and the article hits are
+    generated in vectorized batches.
+    Args:
+        writer (DatabaseWriter | FileWriter): Where the leads and hits are written.
+        ...: See `main`.
+        progress (bool): Whether to show progress bars.
+    Returns:
+        Tuple[int, int]: The number of users and article hits created.
+    """
+    article_ids = np.asarray(article_ids, dtype=np.int64)
+
+    # Faker is the slowest part: the names and emails are the only values generated one by one
+    users: List[Tuple[int, str]] = []
+    batches = range(0, num_users, batch_size)
+    for start in tqdm(batches, desc="Inserting random users", unit="batch", ncols=100, disable=not progress):
+        size = min(batch_size, num_users - start)
+        previews = rng.integers(0, 2, size=size).astype(bool).tolist()
+        users += writer.write_leads([(fake.name(), fake.email(), preview) for preview in previews])
+    if progress:
+        print(f"Created {len(users)} random users.")
+
+    # Batches of users such that each batch generates around batch_size hits
+    user_ids = np.fromiter((user_id for user_id, _ in users), dtype=np.int64, count=len(users))
+    users_per_batch = max(1, batch_size * 2 // (min_article_hits + max_article_hits + 1))
+    total_hits = 0
+    batches = range(0, len(users), users_per_batch)
+    for start in tqdm(batches, desc="Copying article hits", unit="batch", ncols=100, disable=not progress):
+        lead_ids, feed_ids, timestamps = generate_hits(
+            rng, user_ids[start : start + users_per_batch], article_ids, min_article_hits, max_article_hits, max_past_days
+        )
+        writer.write_hits(lead_ids, feed_ids, timestamps)
+        total_hits += len(lead_ids)
+    if progress:
+        print(f"Created {total_hits} random article hits for {len(users)} users.")
+
+    # Countries are drawn from Faker's list instead of calling fake.country() for every user
+    countries = np.asarray(faker.providers.address.en_US.Provider.countries)
+    selected = rng.choice(len(users), size=int(len(users) * perc_users), replace=False)
+    with open(csv_file_path, "a", newline="") as csvfile:
+        csv.writer(csvfile).writerows(
+            zip((users[i][1] for i in selected.tolist()), rng.choice(countries, size=len(selected)))
+        )
+    if progress:
+        print(f"Created CSV file with random user data at {csv_file_path}.")
+    writer.close()
+    return len(users), total_hits
+
+
+def generate_shard(
+    shard: int,
+    seed_sequence: np.random.SeedSequence,
+    pg_params: dict,
+    output_dir: str,
+    file_format: str,
+    first_lead_id: int,
+    article_ids: List[int],
+    csv_file_path: str,
+    *args,
+) -> Tuple[int, int]:
+    """
+    Generate one shard of the data in a worker process (see `--workers`).
+    The shard has its own random seed, derived from the global one, so the output is reproducible for a given seed
+    and number of workers. Its country rows are written to `<csv_file_path>.part-<shard>`, to be merged by the parent.
+    Args:
+        shard (int): The index of the shard.
+        seed_sequence (np.random.SeedSequence): The seed of the shard.
+        pg_params (dict): The connection parameters, when writing to the database.
+        output_dir (str): The output directory, when writing to files (pg_params is then ignored).
+        file_format (str): The format of the files ("csv" or "parquet").
+        first_lead_id (int): The first lead id of the shard, when writing to files.
+        article_ids (List[int]): The ids of the articles that can be clicked.
+        csv_file_path (str): The path of the CSV file with the countries of the users.
+        *args: The remaining arguments of `bulk_generate`.
+    Returns:
+        Tuple[int, int]: The number of users and article hits created.
+    """
+    fake = faker.Faker()
+    fake.seed_instance(int(seed_sequence.generate_state(1)[0]))
+    rng = np.random.default_rng(seed_sequence)
+    if output_dir:
+        writer = FileWriter(output_dir, shard, file_format, first_lead_id)
+    else:
+        writer = DatabaseWriter(psycopg2.connect(**pg_params))
+    try:
+        return bulk_generate(writer, fake, rng, article_ids, f"{csv_file_path}.part-{shard:05d}", *args, progress=False)
+    finally:
+        if not output_dir:
+            writer.conn.close()
+
+
+def parallel_generate(
+    workers: int,
+    seed: int,
+    pg_params: dict,
+    output_dir: str,
+    file_format: str,
+    first_lead_id: int,
+    article_ids: List[int],
+    csv_file_path: str,
+    num_users: int,
+    *args,
+):
+    """
+    Split the generation of `num_users` users (and their hits) in `workers` shards run by a process pool.
+    Each shard writes to its own COPY stream (its own connection) or to its own files.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    sizes = [num_users // workers + (1 if i < num_users % workers else 0) for i in range(workers)]
+    offsets = np.cumsum([first_lead_id] + sizes[:-1]).tolist()
+    total_users, total_hits = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                generate_shard,
+                i,
+                seeds[i],
+                pg_params,
+                output_dir,
+                file_format,
+                offsets[i],
+                article_ids,
+                csv_file_path,
+                sizes[i],
+                *args,
+            )
+            for i in range(workers)
+        ]
+        for future in tqdm(as_completed(futures), total=workers, desc="Generating shards", unit="shard", ncols=100):
+            users, hits = future.result()
+            total_users += users
+            total_hits += hits
+    print(f"Created {total_users} random users and {total_hits} random article hits in {workers} shards.")
+
+    # Merge the country rows of every shard, in shard order
+    with open(csv_file_path, "a", newline="") as csvfile:
+        for i in range(workers):
+            part_path = f"{csv_file_path}.part-{i:05d}"
+            with open(part_path, "r", newline="") as part:
+                shutil.copyfileobj(part, csvfile)
+            os.remove(part_path)
+    print(f"Created CSV file with random user data at {csv_file_path}.")
+
+
+def main(
+    pg_host: str,
+    pg_port: int,
+    pg_db: str,
+    pg_user: str,
+    pg_password: str,
+    csv_file_path: str,
+    max_num_articles: int = MAX_NUM_ARTICLES,
+    num_users: int = NUM_USERS,
+    min_article_hits: int = MIN_ARTICLE_HITS,
+    max_article_hits: int = MAX_ARTICLE_HITS,
+    max_past_days: int = MAX_PAST_DAYS,
+    perc_users: float = PERC_USERS,
+    bulk: bool = False,
+    batch_size: int = BATCH_SIZE,
+    seed: int = None,
+    workers: int = 1,
+    output_dir: str = None,
+    file_format: str = "csv",
+    first_lead_id: int = 1,
+):
     # Connect to the PostgreSQL database
     conn = psycopg2.connect(host=pg_host, port=pg_port, database=pg_db, user=pg_user, password=pg_password)
     cursor = conn.cursor()
 
-    # Read a sample of at most 1000 articles
+    # Read a sample of at most max_num_articles articles
     print("Fetching articles from the database...")
-    cursor.execute(f"SELECT id FROM form_feeds ORDER BY RANDOM() LIMIT {MAX_NUM_ARTICLES:d}")  # Avoid SQL injection
+    cursor.execute(f"SELECT id FROM form_feeds ORDER BY RANDOM() LIMIT {max_num_articles:d}")  # Avoid SQL injection
     articles: List[Tuple[int]] = cursor.fetchall()
     article_ids = [article[0] for article in articles]
 
@@ -46,18 +398,36 @@ def main(pg_host: str, pg_port: int, pg_db: str, pg_user: str, pg_password: str,
         # Please check that you've followed the instructions in the README file.
         raise ValueError("No articles found in the database.")
 
-    # Create 100 random users with random names, emails and countries
+    if seed is not None:
+        random.seed(seed)
+        fake.seed_instance(seed)
+
+    bulk_args = (csv_file_path, num_users, min_article_hits, max_article_hits, max_past_days, perc_users, batch_size)
+    if workers > 1 or output_dir:
+        conn.close()
+        pg_params = {"host": pg_host, "port": pg_port, "database": pg_db, "user": pg_user, "password": pg_password}
+        parallel_generate(workers, seed, pg_params, output_dir, file_format, first_lead_id, article_ids, *bulk_args)
+        return
+    if bulk:
+        bulk_generate(DatabaseWriter(conn), fake, np.random.default_rng(seed), article_ids, *bulk_args)
+        conn.close()
+        return
+
+    # Create num_users random users with random names, emails and countries
     users: List[Tuple[int, str]] = []
-    for _ in tqdm(range(NUM_USERS), desc="Generating random users", unit="user", leave=False, ncols=100):
+    for _ in tqdm(range(num_users), desc="Generating random users", unit="user", leave=False, ncols=100):
         name = fake.name()
         email = fake.email()
         preview = random.choice([True, False])
+        # email_normalized is the column used by the app to find the lead of a click (unique, see form/models.py)
         cursor.execute(
-            "INSERT INTO form_leads (name, email, preview) VALUES (%s, %s, %s) RETURNING id, email",
-            (name, email, preview),
+            "INSERT INTO form_leads (name, email, email_normalized, preview) VALUES (%s, %s, %s, %s) "
+            "ON CONFLICT (email_normalized) DO NOTHING RETURNING id, email",
+            (name, email, normalize_email(email), preview),
         )
-        user_id, email = cursor.fetchone()
-        users.append((user_id, email))
+        row = cursor.fetchone()
+        if row is not None:  # Faker may generate the same email twice
+            users.append(row)
 
     conn.commit()
     print(f"Created {len(users)} random users.")
@@ -65,10 +435,10 @@ def main(pg_host: str, pg_port: int, pg_db: str, pg_user: str, pg_password: str,
     # Create random article hits for each user
     total_hits = 0
     for user_id, _ in tqdm(users, desc="Generating random article hits", unit="user", leave=False, ncols=100):
-        num_hits = random.randint(MIN_ARTICLE_HITS, MAX_ARTICLE_HITS)
+        num_hits = random.randint(min_article_hits, max_article_hits)
         for _ in range(num_hits):
             article_id = random.choice(article_ids)
-            seconds_ago = random.randint(0, MAX_PAST_DAYS * 24 * 60 * 60)
+            seconds_ago = random.randint(0, max_past_days * 24 * 60 * 60)
             timestamp = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
             cursor.execute(
                 "INSERT INTO form_articlehits (lead_id, feed_id, timestamp) VALUES (%s, %s, %s)",
@@ -84,7 +454,7 @@ def main(pg_host: str, pg_port: int, pg_db: str, pg_user: str, pg_password: str,
         writer = csv.DictWriter(csvfile, fieldnames=["email", "country"])
 
         # Select a sample of the created users
-        num_users_to_include = int(len(users) * PERC_USERS)
+        num_users_to_include = int(len(users) * perc_users)
         users_to_include = random.sample(users, num_users_to_include)
         for _, email in tqdm(users_to_include, desc="Generating countries in CSV", unit="user", leave=False, ncols=100):
             country = fake.country()
@@ -104,6 +474,20 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Create random user data.")
     parser.add_argument("dotenv_path", type=str, help="Path to the .env file")
+    parser.add_argument("--num-users", type=int, default=NUM_USERS, help="Number of random users to create")
+    parser.add_argument("--min-hits", type=int, default=MIN_ARTICLE_HITS, help="Minimum number of hits per user")
+    parser.add_argument("--max-hits", type=int, default=MAX_ARTICLE_HITS, help="Maximum number of hits per user")
+    parser.add_argument("--max-past-days", type=int, default=MAX_PAST_DAYS, help="Maximum age of the hits in days")
+    parser.add_argument("--max-articles", type=int, default=MAX_NUM_ARTICLES, help="Maximum number of articles used")
+    parser.add_argument("--perc-users", type=float, default=PERC_USERS, help="Fraction of users in the CSV file")
+    parser.add_argument("--csv-file", type=str, default="user_data.csv", help="Path of the CSV file")
+    parser.add_argument("--bulk", action="store_true", help="Vectorized generation and COPY-based inserts")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per batch (only with --bulk)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed, for reproducible data")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes generating data in parallel")
+    parser.add_argument("--output-dir", type=str, default=None, help="Write partitioned files instead of the database")
+    parser.add_argument("--format", type=str, default="csv", choices=["csv", "parquet"], help="Format of --output-dir")
+    parser.add_argument("--first-lead-id", type=int, default=1, help="First lead id (only with --output-dir)")
     args = parser.parse_args()
 
     env_vars = dotenv.dotenv_values(args.dotenv_path)
@@ -123,5 +507,18 @@ if __name__ == "__main__":
         pg_db=pg_db,
         pg_user=pg_user,
         pg_password=pg_password,
-        csv_file_path="user_data.csv",
+        csv_file_path=args.csv_file,
+        max_num_articles=args.max_articles,
+        num_users=args.num_users,
+        min_article_hits=args.min_hits,
+        max_article_hits=args.max_hits,
+        max_past_days=args.max_past_days,
+        perc_users=args.perc_users,
+        bulk=args.bulk,
+        batch_size=args.batch_size,
+        seed=args.seed,
+        workers=args.workers,
+        output_dir=args.output_dir,
+        file_format=args.format,
+        first_lead_id=args.first_lead_id,
     )
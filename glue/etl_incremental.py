@@ -0,0 +1,279 @@
+"""
+Incremental version of the ETL job: instead of re-reading the whole `form_articlehits` table, every run only extracts
+the hits newer than a persisted high-watermark, and merges them into daily aggregates in the transformed zone.
+
+The output is `<output>/dt=YYYY-MM-DD/part-00000.parquet` (Hive-style partitions, as `export_parquet.py`), with the
+number of hits per day, lead and article:
+    lead_id, email, country, feed_id, hits
+As in the Glue job, only the hits of leads that appear in the users (country) file are kept.
+
+Watermark and late-arriving rows:
+- The state file stores the largest hit timestamp processed so far, and the ids of the hits merged whose timestamp is
+    within `late_window` of it (in a Parquet file next to the state file).
+- A run extracts the hits with `timestamp >= max_timestamp - late_window`, which is a range scan of the
+    `(timestamp, id)` index, and skips the ids already merged. Ids are not used as a watermark: they are taken from the
+    sequence before the transaction commits, so a hit can become visible after a hit with a larger id (concurrent
+    transactions, batches of the click pipeline, several workers). Hits committed late with a timestamp up to
+    `late_window` older than the newest one processed are picked up by the next run; older ones are ignored.
+- The output partitions are written next to the existing ones first, and only replace them once the new state is
+    saved (the state lists them as pending until then), so re-running after a failure never counts the same hit twice.
+
+Usage:
+    python3 etl_incremental.py src/.env --users user_data.csv --output transformed_zone/daily_hits
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+import dotenv
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from export_parquet import read_query_batches, select_columns
+from etl_pipeline import USERS_SCHEMA, open_dataset, read_columns
+
+LATE_WINDOW_HOURS = 48
+PART_FILE = "part-00000.parquet"
+PENDING_SUFFIX = ".pending"
+HITS_SCHEMA = pa.schema(
+    [("id", pa.int64()), ("timestamp", pa.timestamp("us")), ("feed_id", pa.int64()), ("lead_id", pa.int64())]
+)
+LEADS_SCHEMA = pa.schema([("id", pa.int64()), ("email", pa.string())])
+OUTPUT_SCHEMA = pa.schema(
+    [
+        ("lead_id", pa.int64()),
+        ("email", pa.string()),
+        ("country", pa.string()),
+        ("feed_id", pa.int64()),
+        ("hits", pa.int64()),
+    ]
+)
+KEYS = ["lead_id", "email", "country", "feed_id"]
+
+
+def load_state(path: str) -> dict:
+    "Load the watermark of the previous runs (an empty state extracts all the hits)"
+    if not os.path.exists(path):
+        return {"max_timestamp": None, "run": 0, "seen_ids": None, "pending": []}
+    with open(path, "r") as f:
+        return {"run": 0, "seen_ids": None, "pending": [], **json.load(f)}
+
+
+def save_state(path: str, state: dict):
+    "Save the watermark atomically, so an interrupted run leaves the previous state"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_seen_ids(state_path: str, state: dict) -> pa.Array:
+    "The ids of the hits already merged, within the late window of the watermark"
+    if not state.get("seen_ids"):
+        return pa.array([], pa.int64())
+    path = os.path.join(os.path.dirname(os.path.abspath(state_path)), state["seen_ids"])
+    return pq.read_table(path).column("id").combine_chunks()
+
+
+def partition_path(output_path: str, dt: str) -> str:
+    return os.path.join(output_path, f"dt={dt}", PART_FILE)
+
+
+def commit_partitions(output_path: str, state_path: str, state: dict):
+    """
+    Replace the output partitions with the pending ones written by a run whose state was saved (also completes the
+    commit of an interrupted run), and forget the pending partitions of a run whose state was not saved.
+    """
+    for dt in state["pending"]:
+        path = partition_path(output_path, dt)
+        if os.path.exists(f"{path}{PENDING_SUFFIX}"):
+            os.replace(f"{path}{PENDING_SUFFIX}", path)
+    if state["pending"]:
+        state["pending"] = []
+        save_state(state_path, state)
+    if os.path.isdir(output_path):
+        for name in os.listdir(output_path):
+            stale = os.path.join(output_path, name, f"{PART_FILE}{PENDING_SUFFIX}")
+            if os.path.exists(stale):
+                os.remove(stale)
+
+
+def extraction_since(state: dict, late_window: timedelta) -> Optional[datetime]:
+    "The oldest timestamp extracted by the next run (None: all the hits)"
+    if state["max_timestamp"] is None:
+        return None
+    return datetime.fromisoformat(state["max_timestamp"]) - late_window
+
+
+def extraction_query(cursor, state: dict, late_window: timedelta) -> str:
+    "The query extracting the hits after the watermark minus the late window (already merged ids are skipped later)"
+    query = f"SELECT {select_columns(HITS_SCHEMA)} FROM form_articlehits"
+    since = extraction_since(state, late_window)
+    if since is None:
+        return query
+    return cursor.mogrify(query + ' WHERE "timestamp" >= %(since)s', {"since": since}).decode()
+
+
+def write_pending_partition(output_path: str, dt: str, new: pa.Table):
+    """
+    Add the new aggregates of a day to its output partition, written next to it (see `commit_partitions`), so the
+    partition is never left half-written nor merged twice.
+    """
+    path = partition_path(output_path, dt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new = new.select(OUTPUT_SCHEMA.names).cast(OUTPUT_SCHEMA)
+    if os.path.exists(path):
+        new = pa.concat_tables([pq.read_table(path, schema=OUTPUT_SCHEMA), new])
+    merged = new.group_by(KEYS).aggregate([("hits", "sum")]).rename_columns(KEYS + ["hits"])
+    merged = merged.select(OUTPUT_SCHEMA.names).cast(OUTPUT_SCHEMA)
+    pq.write_table(merged, f"{path}{PENDING_SUFFIX}", compression="snappy")
+
+
+def update(
+    batches: Iterable[pa.RecordBatch],
+    dimension: pa.Table,
+    state: dict,
+    state_path: str,
+    output_path: str,
+    late_window: timedelta,
+) -> int:
+    """
+    Merge the extracted hits (see `extraction_query`) that were not merged yet into the daily partitions, and save the
+    new watermark.
+    Args:
+        batches (Iterable[pa.RecordBatch]): The extracted hits (HITS_SCHEMA).
+        dimension (pa.Table): The leads kept, with their email and country (lead_id, email, country).
+        state (dict): The state loaded by `load_state`, after `commit_partitions`.
+        state_path (str): Path of the state file.
+        output_path (str): Folder of the daily partitions.
+        late_window (timedelta): How late a hit can be committed.
+    Returns:
+        int: The number of hits merged.
+    """
+    seen = load_seen_ids(state_path, state)
+    merged, max_timestamp = 0, None
+    extracted_ids, extracted_timestamps, aggregates = [], [], []
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        extracted_ids.append(batch.column("id"))
+        extracted_timestamps.append(batch.column("timestamp"))
+        max_timestamp = max(filter(None, [max_timestamp, pc.max(batch.column("timestamp")).as_py()]))
+        hits = pa.Table.from_batches([batch])
+        hits = hits.filter(pc.invert(pc.is_in(hits.column("id"), value_set=seen)))
+        if "max_id" in state:
+            # State of a previous version, which merged all the hits up to this id
+            hits = hits.filter(pc.greater(hits.column("id"), state["max_id"]))
+        if hits.num_rows == 0:
+            continue
+        merged += hits.num_rows
+        hits = hits.append_column("dt", pc.strftime(hits.column("timestamp"), format="%Y-%m-%d"))
+        aggregates.append(
+            hits.group_by(["dt", "lead_id", "feed_id"]).aggregate([("id", "count")]).rename_columns(
+                ["dt", "lead_id", "feed_id", "hits"]
+            )
+        )
+    if merged == 0:
+        return 0
+
+    new = pa.concat_tables(aggregates).group_by(["dt", "lead_id", "feed_id"]).aggregate([("hits", "sum")])
+    new = new.rename_columns(["dt", "lead_id", "feed_id", "hits"]).join(dimension, keys="lead_id", join_type="inner")
+    days = sorted(set(new.column("dt").to_pylist()))
+    for dt in days:
+        write_pending_partition(output_path, dt, new.filter(pc.equal(new.column("dt"), dt)))
+
+    # The ids to skip next time: the extracted hits that the next extraction reads again
+    max_timestamp = max_timestamp.replace(tzinfo=timezone.utc)
+    if state["max_timestamp"] is not None:
+        max_timestamp = max(max_timestamp, datetime.fromisoformat(state["max_timestamp"]))
+    new_state = {**state, "max_timestamp": max_timestamp.isoformat(), "run": state["run"] + 1, "pending": days}
+    new_state.pop("max_id", None)
+    since = extraction_since(new_state, late_window).astimezone(timezone.utc).replace(tzinfo=None)
+    ids = pa.chunked_array(extracted_ids, pa.int64())
+    recent = pc.greater_equal(pa.chunked_array(extracted_timestamps, HITS_SCHEMA.field("timestamp").type), since)
+    new_state["seen_ids"] = f"{os.path.basename(state_path)}.ids-{new_state['run']}.parquet"
+    directory = os.path.dirname(os.path.abspath(state_path))
+    pq.write_table(pa.table({"id": ids.filter(recent)}), os.path.join(directory, new_state["seen_ids"]))
+
+    save_state(state_path, new_state)
+    commit_partitions(output_path, state_path, new_state)
+    if state["seen_ids"]:
+        os.remove(os.path.join(directory, state["seen_ids"]))
+    state.clear()
+    state.update(new_state)
+    return merged
+
+
+def main(
+    pg_host: str,
+    pg_port: int,
+    pg_db: str,
+    pg_user: str,
+    pg_password: str,
+    users_path: str,
+    output_path: str,
+    state_path: str,
+    late_window_hours: float = LATE_WINDOW_HOURS,
+):
+    state = load_state(state_path)
+    # Finish (or forget) the partitions of an interrupted run
+    commit_partitions(output_path, state_path, state)
+    conn = psycopg2.connect(host=pg_host, port=pg_port, database=pg_db, user=pg_user, password=pg_password)
+    cursor = conn.cursor()
+    os.makedirs(output_path, exist_ok=True)
+
+    late_window = timedelta(hours=late_window_hours)
+    users = pa.Table.from_batches(read_columns(open_dataset(users_path, USERS_SCHEMA), USERS_SCHEMA), USERS_SCHEMA)
+    with tempfile.TemporaryDirectory(dir=output_path) as tmp_dir:
+        leads = pa.Table.from_batches(
+            read_query_batches(cursor, f"SELECT {select_columns(LEADS_SCHEMA)} FROM form_leads", LEADS_SCHEMA, tmp_dir),
+            LEADS_SCHEMA,
+        )
+        dimension = leads.join(users, keys="email", join_type="inner").rename_columns(["lead_id", "email", "country"])
+        query = extraction_query(cursor, state, late_window)
+        print(f"Extracting: {query}")
+        batches = read_query_batches(cursor, query, HITS_SCHEMA, tmp_dir)
+        merged = update(batches, dimension, state, state_path, output_path, late_window)
+    cursor.close()
+    conn.close()
+
+    if merged == 0:
+        print("No new article hits.")
+        return
+    print(f"Merged {merged} new article hits, watermark {state['max_timestamp']}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally aggregate the new article hits.")
+    parser.add_argument("dotenv_path", type=str, help="Path to the .env file")
+    parser.add_argument("--users", type=str, default="user_data.csv", help="Users (email, country): CSV or Parquet")
+    parser.add_argument("--output", type=str, default="transformed_zone/daily_hits", help="Output folder")
+    parser.add_argument("--state", type=str, default="etl_state.json", help="File with the watermark")
+    parser.add_argument(
+        "--late-window-hours", type=float, default=LATE_WINDOW_HOURS, help="How late a hit can be stored"
+    )
+    args = parser.parse_args()
+
+    env_vars = dotenv.dotenv_values(args.dotenv_path)
+    if not "POSTGRES_HOST" in env_vars:
+        raise ValueError("POSTGRES_HOST is not set in the provided .env file")
+    if not "POSTGRES_PASSWORD" in env_vars:
+        raise ValueError("POSTGRES_PASSWORD is not set in the provided .env file")
+
+    main(
+        pg_host=env_vars.get("POSTGRES_HOST"),
+        pg_port=int(env_vars.get("POSTGRES_PORT", 5432)),
+        pg_db=env_vars.get("POSTGRES_DB", "postgres"),
+        pg_user=env_vars.get("POSTGRES_USER", "postgres"),
+        pg_password=env_vars.get("POSTGRES_PASSWORD"),
+        users_path=args.users,
+        output_path=args.output,
+        state_path=args.state,
+        late_window_hours=args.late_window_hours,
+    )
@@ -0,0 +1,222 @@
+"""
+Local implementation of the Glue ETL job described in the README, to test and benchmark it without AWS:
+1. `form_leads` OUTER JOIN `article_hits` ON leads.id = article_hit_lead_id (hit columns prefixed with `article_hit_`).
+2. The result INNER JOIN `users` ON email = user_email (user columns prefixed with `user_`).
+3. The output is written as Snappy-compressed Parquet files to the transformed zone.
+
+Since the second join is an inner join on the email of the lead, the hits of unknown leads are dropped, so this is
+computed as `(leads INNER JOIN users) LEFT JOIN hits`. The joined leads/users table is kept in memory, but the article
+hits (by far the largest input) are streamed in batches, so inputs larger than RAM can be processed.
+
+The inputs can be the header-less CSV files of the README (`\\copy (SELECT <the columns of LEADS_SCHEMA/HITS_SCHEMA>
+...) TO ... WITH CSV`) or folders of Parquet files (e.g. from `export_parquet.py` or `create_data.py --output-dir`),
+whose other columns are ignored.
+
+Usage:
+    python3 etl_pipeline.py --leads form_leads.csv --hits article_hits.csv --users user_data.csv --output transformed_zone
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from typing import Dict, Iterator
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+BATCH_SIZE = 1_000_000  # Article hits processed per batch
+MAX_ROWS_PER_FILE = 10_000_000  # Rows per output Parquet file
+
+# Columns of the inputs, in the order of the header-less CSV files
+LEADS_SCHEMA = pa.schema([("id", pa.int64()), ("name", pa.string()), ("email", pa.string()), ("preview", pa.string())])
+HITS_SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("feed_id", pa.int64()),
+        ("lead_id", pa.int64()),
+    ]
+)
+USERS_SCHEMA = pa.schema([("email", pa.string()), ("country", pa.string())])
+
+HIT_COLUMNS = {f"article_hit_{f.name}": f.type for f in HITS_SCHEMA}
+OUTPUT_SCHEMA = pa.schema(
+    list(LEADS_SCHEMA) + list(HIT_COLUMNS.items()) + [("user_email", pa.string()), ("user_country", pa.string())]
+)
+
+
+def open_dataset(path: str, schema: pa.Schema) -> ds.Dataset:
+    """
+    Open a CSV file (without header) or a file/folder of Parquet files.
+    Args:
+        path (str): The path of the input.
+        schema (pa.Schema): The columns of the input, in the order of the CSV file.
+    """
+    if path.endswith(".csv"):
+        file_format = ds.CsvFileFormat(
+            read_options=pa_csv.ReadOptions(column_names=schema.names),
+            convert_options=pa_csv.ConvertOptions(column_types=schema),
+        )
+        return ds.dataset(path, format=file_format, schema=schema)
+    # Without pre-buffering, Parquet files are read one row group at a time instead of (almost) whole
+    file_format = ds.ParquetFileFormat(default_fragment_scan_options=ds.ParquetFragmentScanOptions(pre_buffer=False))
+    return ds.dataset(path, format=file_format, partitioning="hive")
+
+
+def read_columns(dataset: ds.Dataset, schema: pa.Schema, **scan_options) -> Iterator[pa.RecordBatch]:
+    "Scan the columns of `schema` from a dataset, casting them to the expected types (missing columns are null)"
+    present = [name for name in schema.names if name in dataset.schema.names]
+    for batch in dataset.to_batches(columns=present, **scan_options):
+        yield pa.RecordBatch.from_arrays(
+            [
+                batch.column(f.name).cast(f.type) if f.name in present else pa.nulls(batch.num_rows, f.type)
+                for f in schema
+            ],
+            schema=schema,
+        )
+
+
+def build_dimension(leads_path: str, users_path: str) -> pa.Table:
+    """
+    Join the leads with the users (countries), i.e. the part of the job that does not depend on the hits.
+    Returns:
+        pa.Table: The columns of the leads and of the users, with the user columns prefixed with `user_`.
+    """
+    leads = pa.Table.from_batches(read_columns(open_dataset(leads_path, LEADS_SCHEMA), LEADS_SCHEMA), LEADS_SCHEMA)
+    users = pa.Table.from_batches(read_columns(open_dataset(users_path, USERS_SCHEMA), USERS_SCHEMA), USERS_SCHEMA)
+    users = users.rename_columns(["user_email", "user_country"])
+    return leads.join(users, keys="email", right_keys="user_email", join_type="inner", coalesce_keys=False)
+
+
+class RollingParquetWriter:
+    "Writes tables to `part-NNNNN.parquet` files in a folder, starting a new file every `max_rows_per_file` rows"
+
+    def __init__(self, path: str, schema: pa.Schema, max_rows_per_file: int = MAX_ROWS_PER_FILE):
+        self.path = path
+        self.schema = schema
+        self.max_rows_per_file = max_rows_per_file
+        self.rows = 0
+        self._files = 0
+        self._rows_in_file = 0
+        self._writer = None
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, table: pa.Table):
+        if table.num_rows == 0:
+            return
+        if self._writer is None or self._rows_in_file >= self.max_rows_per_file:
+            self.close()
+            self._writer = pq.ParquetWriter(
+                os.path.join(self.path, f"part-{self._files:05d}.parquet"), self.schema, compression="snappy"
+            )
+            self._files += 1
+            self._rows_in_file = 0
+        self._writer.write_table(table.select(self.schema.names).cast(self.schema))
+        self._rows_in_file += table.num_rows
+        self.rows += table.num_rows
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def run(
+    leads_path: str,
+    hits_path: str,
+    users_path: str,
+    output_path: str,
+    batch_size: int = BATCH_SIZE,
+    max_rows_per_file: int = MAX_ROWS_PER_FILE,
+) -> Dict[str, float]:
+    """
+    Run the ETL job.
+    Args:
+        leads_path (str): The leads (CSV file or Parquet folder).
+        hits_path (str): The article hits (CSV file or Parquet folder).
+        users_path (str): The users with their country (CSV file or Parquet folder).
+        output_path (str): The output folder (transformed zone).
+        batch_size (int): Article hits processed per batch, which bounds the memory used by the hits.
+        max_rows_per_file (int): Rows per output Parquet file.
+    Returns:
+        Dict[str, float]: Statistics of the run (input/output rows, seconds, rows/s, peak memory).
+    """
+    start = time.perf_counter()
+    dimension = build_dimension(leads_path, users_path)
+    writer = RollingParquetWriter(output_path, OUTPUT_SCHEMA, max_rows_per_file)
+
+    input_hits = 0
+    matched_leads = []
+    # Reading without threads nor read-ahead keeps the memory bounded to about one batch of hits
+    hits_batches = read_columns(
+        open_dataset(hits_path, HITS_SCHEMA),
+        HITS_SCHEMA,
+        batch_size=batch_size,
+        batch_readahead=1,
+        fragment_readahead=1,
+        use_threads=False,
+    )
+    for batch in hits_batches:
+        input_hits += batch.num_rows
+        hits = pa.Table.from_batches([batch]).rename_columns(list(HIT_COLUMNS))
+        joined = dimension.join(
+            hits, keys="id", right_keys="article_hit_lead_id", join_type="inner", coalesce_keys=False
+        )
+        writer.write(joined)
+        matched_leads.append(pc.unique(hits.column("article_hit_lead_id")))
+        if sum(len(ids) for ids in matched_leads) > 2 * dimension.num_rows:
+            # Keep the list of seen leads bounded by the number of leads, not by the number of hits
+            matched_leads = [pc.unique(pa.chunked_array(matched_leads, type=pa.int64()))]
+
+    # Leads without any hit are kept by the outer join, with empty hit columns
+    if matched_leads:
+        seen = pc.unique(pa.chunked_array(matched_leads, type=pa.int64()))
+        unmatched = dimension.filter(pc.invert(pc.is_in(dimension.column("id"), value_set=seen)))
+    else:
+        unmatched = dimension
+    for name, type_ in HIT_COLUMNS.items():
+        unmatched = unmatched.append_column(name, pa.nulls(unmatched.num_rows, type_))
+    writer.write(unmatched)
+    writer.close()
+
+    seconds = time.perf_counter() - start
+    return {
+        "input_hits": input_hits,
+        "output_rows": writer.rows,
+        "seconds": round(seconds, 3),
+        "hits_per_second": round(input_hits / seconds) if seconds > 0 else 0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def peak_rss_mb() -> float:
+    "Peak resident memory of this process, in MB"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Glue ETL job (leads x article hits x users) locally.")
+    parser.add_argument("--leads", type=str, required=True, help="Leads: header-less CSV file or Parquet folder")
+    parser.add_argument("--hits", type=str, required=True, help="Article hits: header-less CSV file or Parquet folder")
+    parser.add_argument("--users", type=str, required=True, help="Users (email, country): CSV file or Parquet folder")
+    parser.add_argument("--output", type=str, default="transformed_zone", help="Output folder")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Article hits processed per batch")
+    parser.add_argument("--max-rows-per-file", type=int, default=MAX_ROWS_PER_FILE, help="Rows per output file")
+    parser.add_argument("--json", action="store_true", help="Print the statistics as JSON")
+    args = parser.parse_args()
+
+    stats = run(args.leads, args.hits, args.users, args.output, args.batch_size, args.max_rows_per_file)
+    if args.json:
+        print(json.dumps(stats))
+    else:
+        print(
+            f"Joined {stats['input_hits']} article hits into {stats['output_rows']} rows in {stats['seconds']}s "
+            f"({stats['hits_per_second']} hits/s, peak memory {stats['peak_rss_mb']} MB)"
+        )
@@ -0,0 +1,298 @@
+"""
+This script exports the data of the application to the landing zone as Parquet files, which Athena and Glue read much
+faster (and scanning much fewer bytes) than CSV files. It does the following:
+1. Streams `form_leads`, `form_feeds` and `form_articlehits` out of PostgreSQL with `COPY ... TO STDOUT`, and converts
+    them to Parquet in batches, so tables larger than memory can be exported.
+2. Partitions the article hits by day (`dt=YYYY-MM-DD` folders, Hive style), so queries filtering by date only read
+    the matching partitions.
+3. Converts the users CSV file (email, country) created by `create_data.py` to Parquet.
+4. Writes `ddl.sql` with the matching Athena/Glue `CREATE EXTERNAL TABLE` statements, using partition projection for
+    the article hits (no crawler nor `MSCK REPAIR TABLE` needed when new days are uploaded).
+
+The output folder can then be uploaded as the landing zone, e.g.:
+    aws s3 sync parquet_export s3://<your_bucket_name>/landing_zone/parquet/
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, List
+
+import dotenv
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+ROW_GROUP_SIZE = 1_000_000  # Rows per Parquet row group
+READ_BLOCK_SIZE = 64 << 20  # Bytes of CSV read from PostgreSQL's output per batch
+COMPRESSION = "snappy"
+
+# Exported columns and their types. The timestamps are exported in UTC.
+TABLES: Dict[str, pa.Schema] = {
+    "form_leads": pa.schema(
+        [("id", pa.int64()), ("name", pa.string()), ("email", pa.string()), ("preview", pa.bool_())]
+    ),
+    "form_feeds": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("title", pa.string()),
+            ("link", pa.string()),
+            ("summary", pa.string()),
+            ("author", pa.string()),
+            ("hits", pa.int64()),
+        ]
+    ),
+    "form_articlehits": pa.schema(
+        [("id", pa.int64()), ("timestamp", pa.timestamp("us")), ("feed_id", pa.int64()), ("lead_id", pa.int64())]
+    ),
+}
+USERS_SCHEMA = pa.schema([("email", pa.string()), ("country", pa.string())])
+ATHENA_TYPES = {pa.int64(): "bigint", pa.string(): "string", pa.bool_(): "boolean"}
+
+
+def read_table_batches(cursor, table: str, schema: pa.Schema, tmp_dir: str) -> Iterator[pa.RecordBatch]:
+    """
+    Stream a PostgreSQL table as Arrow record batches.
+    Args:
+        cursor: The psycopg2 cursor.
+        table (str): The name of the table.
+        schema (pa.Schema): The columns to export and their types.
+        tmp_dir (str): Directory for the temporary CSV file.
+    """
+    yield from read_query_batches(cursor, f"SELECT {select_columns(schema)} FROM {table}", schema, tmp_dir)
+
+
+def select_columns(schema: pa.Schema) -> str:
+    "The SELECT list of the columns of a schema, with the timestamps converted to UTC"
+    return ", ".join(
+        f'"{f.name}" AT TIME ZONE \'UTC\'' if pa.types.is_timestamp(f.type) else f'"{f.name}"' for f in schema
+    )
+
+
+def read_query_batches(cursor, query: str, schema: pa.Schema, tmp_dir: str) -> Iterator[pa.RecordBatch]:
+    """
+    Stream the result of a query as Arrow record batches.
+    The result is copied to a temporary CSV file with `COPY ... TO STDOUT` (much faster than fetching rows through the
+    cursor), which is then parsed by Arrow's multithreaded CSV reader, one block at a time.
+    Args:
+        cursor: The psycopg2 cursor.
+        query (str): The query, returning the columns of `schema` in the same order.
+        schema (pa.Schema): The columns returned and their types.
+        tmp_dir (str): Directory for the temporary CSV file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", f)
+        if os.path.getsize(path) == 0:
+            return  # Arrow cannot open an empty CSV file
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(column_names=schema.names, block_size=READ_BLOCK_SIZE),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types=schema, true_values=["t"], false_values=["f"], strings_can_be_null=False
+            ),
+        )
+        yield from reader
+    finally:
+        os.remove(path)
+
+
+class PartitionedParquetWriter:
+    """
+    Writes record batches to a folder of Parquet files, optionally partitioned by the day of a timestamp column
+    (`<path>/dt=YYYY-MM-DD/part-00000.parquet`). Rows are buffered per partition until a full row group can be
+    written, so the files have row groups of `row_group_size` rows regardless of the size of the input batches.
+    To bound memory when there are many partitions, every partition is flushed when more than
+    `MAX_BUFFERED_ROW_GROUPS` row groups worth of rows are buffered in total.
+    """
+
+    MAX_BUFFERED_ROW_GROUPS = 4
+
+    def __init__(self, path: str, schema: pa.Schema, compression: str, row_group_size: int, partition_by: str = None):
+        self.path = path
+        self.schema = schema
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.partition_by = partition_by
+        self.rows = 0
+        self._writers: Dict[str, pq.ParquetWriter] = {}
+        self._buffers: Dict[str, List[pa.RecordBatch]] = {}
+        self._buffered: Dict[str, int] = {}
+
+    def write(self, batch: pa.RecordBatch):
+        self.rows += batch.num_rows
+        if self.partition_by is None:
+            self._append("", batch)
+            return
+        days = pc.cast(batch.column(self.partition_by), pa.date32())
+        for day in pc.unique(days).to_pylist():
+            self._append(f"dt={day.isoformat()}", batch.filter(pc.equal(days, pa.scalar(day, pa.date32()))))
+
+    def close(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for writer in self._writers.values():
+            writer.close()
+
+    def partitions(self) -> List[str]:
+        return sorted(self._writers)
+
+    def _append(self, partition: str, batch: pa.RecordBatch):
+        self._buffers.setdefault(partition, []).append(batch)
+        self._buffered[partition] = self._buffered.get(partition, 0) + batch.num_rows
+        if self._buffered[partition] >= self.row_group_size:
+            self._flush(partition)
+        elif sum(self._buffered.values()) > self.MAX_BUFFERED_ROW_GROUPS * self.row_group_size:
+            for p in list(self._buffers):
+                self._flush(p)
+
+    def _flush(self, partition: str):
+        batches = self._buffers.pop(partition, [])
+        self._buffered.pop(partition, None)
+        if not batches:
+            return
+        if partition not in self._writers:
+            folder = os.path.join(self.path, partition)
+            os.makedirs(folder, exist_ok=True)
+            self._writers[partition] = pq.ParquetWriter(
+                os.path.join(folder, "part-00000.parquet"),
+                self.schema,
+                compression=None if self.compression == "none" else self.compression,
+            )
+        self._writers[partition].write_table(
+            pa.Table.from_batches(batches, schema=self.schema), row_group_size=self.row_group_size
+        )
+
+
+def athena_ddl(database: str, location: str, table: str, schema: pa.Schema, partitioned: bool) -> str:
+    """
+    Build the Athena/Glue `CREATE EXTERNAL TABLE` statement of an exported table.
+    Args:
+        database (str): The Glue database.
+        location (str): The S3 folder of the export (e.g. s3://bucket/landing_zone/parquet).
+        table (str): The name of the table (and of its folder).
+        schema (pa.Schema): The exported columns.
+        partitioned (bool): Whether the table is partitioned by day (`dt`).
+    """
+    columns = ",\n".join(
+        f"  `{f.name}` {'timestamp' if pa.types.is_timestamp(f.type) else ATHENA_TYPES[f.type]}" for f in schema
+    )
+    table_location = f"{location.rstrip('/')}/{table}/"
+    ddl = f"CREATE EXTERNAL TABLE IF NOT EXISTS {database}.{table} (\n{columns}\n)\n"
+    if partitioned:
+        ddl += "PARTITIONED BY (`dt` string)\n"
+    ddl += f"STORED AS PARQUET\nLOCATION '{table_location}'\n"
+    if partitioned:
+        # Partition projection: Athena computes the partitions from the query, no need to register them
+        ddl += (
+            "TBLPROPERTIES (\n"
+            "  'projection.enabled'='true',\n"
+            "  'projection.dt.type'='date',\n"
+            "  'projection.dt.format'='yyyy-MM-dd',\n"
+            "  'projection.dt.range'='2020-01-01,NOW',\n"
+            f"  'storage.location.template'='{table_location}dt=${{dt}}/'\n"
+            ")"
+        )
+    return ddl.rstrip() + ";\n"
+
+
+def main(
+    pg_host: str,
+    pg_port: int,
+    pg_db: str,
+    pg_user: str,
+    pg_password: str,
+    output_dir: str,
+    users_csv: str,
+    compression: str = COMPRESSION,
+    row_group_size: int = ROW_GROUP_SIZE,
+    s3_location: str = "s3://<your_bucket_name>/landing_zone/parquet",
+    database: str = "landing_zone_db",
+):
+    conn = psycopg2.connect(host=pg_host, port=pg_port, database=pg_db, user=pg_user, password=pg_password)
+    cursor = conn.cursor()
+    os.makedirs(output_dir, exist_ok=True)
+    statements = []
+
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp_dir:
+        for table, schema in TABLES.items():
+            start = time.time()
+            partition_by = "timestamp" if table == "form_articlehits" else None
+            writer = PartitionedParquetWriter(
+                os.path.join(output_dir, table), schema, compression, row_group_size, partition_by
+            )
+            for batch in read_table_batches(cursor, table, schema, tmp_dir):
+                writer.write(batch)
+            writer.close()
+            print(
+                f"Exported {writer.rows} rows of {table} to {len(writer.partitions())} partition(s) "
+                f"in {time.time() - start:.1f}s"
+            )
+            statements.append(athena_ddl(database, s3_location, table, schema, partition_by is not None))
+
+    cursor.close()
+    conn.close()
+
+    if users_csv:
+        table = pa_csv.read_csv(
+            users_csv,
+            read_options=pa_csv.ReadOptions(column_names=USERS_SCHEMA.names),
+            convert_options=pa_csv.ConvertOptions(column_types=USERS_SCHEMA),
+        )
+        os.makedirs(os.path.join(output_dir, "users"), exist_ok=True)
+        pq.write_table(
+            table,
+            os.path.join(output_dir, "users", "part-00000.parquet"),
+            compression=None if compression == "none" else compression,
+            row_group_size=row_group_size,
+        )
+        print(f"Exported {table.num_rows} rows of {users_csv}")
+        statements.append(athena_ddl(database, s3_location, "users", USERS_SCHEMA, False))
+
+    with open(os.path.join(output_dir, "ddl.sql"), "w") as f:
+        f.write("\n".join(statements))
+    print(f"Athena DDL written to {os.path.join(output_dir, 'ddl.sql')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the application tables to partitioned Parquet files.")
+    parser.add_argument("dotenv_path", type=str, help="Path to the .env file")
+    parser.add_argument("--output-dir", type=str, default="parquet_export", help="Output folder")
+    parser.add_argument("--users-csv", type=str, default="user_data.csv", help="Users CSV file (empty to skip)")
+    parser.add_argument(
+        "--compression", type=str, default=COMPRESSION, choices=["snappy", "zstd", "gzip", "none"], help="Codec"
+    )
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE, help="Rows per Parquet row group")
+    parser.add_argument(
+        "--s3-location",
+        type=str,
+        default="s3://<your_bucket_name>/landing_zone/parquet",
+        help="S3 folder where the export will be uploaded (used in the DDL)",
+    )
+    parser.add_argument("--database", type=str, default="landing_zone_db", help="Glue database (used in the DDL)")
+    args = parser.parse_args()
+
+    env_vars = dotenv.dotenv_values(args.dotenv_path)
+    if not "POSTGRES_HOST" in env_vars:
+        raise ValueError("POSTGRES_HOST is not set in the provided .env file")
+    if not "POSTGRES_PASSWORD" in env_vars:
+        raise ValueError("POSTGRES_PASSWORD is not set in the provided .env file")
+
+    main(
+        pg_host=env_vars.get("POSTGRES_HOST"),
+        pg_port=int(env_vars.get("POSTGRES_PORT", 5432)),
+        pg_db=env_vars.get("POSTGRES_DB", "postgres"),
+        pg_user=env_vars.get("POSTGRES_USER", "postgres"),
+        pg_password=env_vars.get("POSTGRES_PASSWORD"),
+        output_dir=args.output_dir,
+        users_csv=args.users_csv,
+        compression=args.compression,
+        row_group_size=args.row_group_size,
+        s3_location=args.s3_location,
+        database=args.database,
+    )
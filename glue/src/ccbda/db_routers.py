@@ -0,0 +1,91 @@
+"""
+Routing of the queries between the primary database ("default") and its read replica ("replica").
+
+Enabled by setting POSTGRES_REPLICA_HOST (see DATABASES in settings.py). Writes always go to the primary, reads go to
+the replica, except:
+- during a request that may write (POST, PUT, ...), so it reads what it has just written;
+- during the following `REPLICA_STICKY_SECONDS` seconds for the same browser (read-your-writes): the replica may lag
+    behind the primary, and e.g. the lead who has just signed up must be found by the next pages;
+- inside a `use_primary()` block, for background jobs that read and write the same rows.
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = "default"
+REPLICA = "replica"
+STICKY_COOKIE = "read_primary"
+
+_read_primary = contextvars.ContextVar("read_primary", default=False)
+
+
+@contextmanager
+def use_primary():
+    "Send the reads of the current thread (or task) to the primary database"
+    token = _read_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_primary.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return PRIMARY if _read_primary.get() else REPLICA
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is migrated through replication
+        return db == PRIMARY
+
+
+class ReadYourWritesMiddleware:
+    """
+    Reads from the primary during the requests that may write, and during the next `REPLICA_STICKY_SECONDS` seconds
+    (with a short-lived cookie), so users see their own writes even if the replica lags behind.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _read_primary.set(self.reads_primary(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_primary.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _read_primary.set(self.reads_primary(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_primary.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def reads_primary(request) -> bool:
+        return request.method not in ("GET", "HEAD", "OPTIONS") or STICKY_COOKIE in request.COOKIES
+
+    @staticmethod
+    def pin(request, response):
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS, httponly=True)
+        return response
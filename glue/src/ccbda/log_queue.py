@@ -0,0 +1,37 @@
+"""
+Logging off the request thread, in both server modes (see asgi.py and wsgi.py).
+"""
+
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+if settings.DYNATRACE_LOGS:
+    # Queues the record as is: it is also formatted in the background, and the Dynatrace handler still gets its
+    # arguments and exception
+    from dynatrace.backend.dynatrace_logger import DeferredQueueHandler
+else:
+    DeferredQueueHandler = QueueHandler
+
+
+def log_in_background(*loggers: logging.Logger) -> QueueListener:
+    """
+    Replace the handlers of the loggers with a queue, emptied by a background thread. Writing to the console or to a
+    file is blocking, as is building the Dynatrace records: in ASGI mode it would block the event loop (i.e. every
+    request served by the worker), in WSGI mode it would add to the latency of the request.
+    """
+    handlers = []
+    log_queue = queue.SimpleQueue()
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+            if handler not in handlers:
+                handlers.append(handler)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
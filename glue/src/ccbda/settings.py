@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import copy
+import importlib.util
 import logging
 import os
 from pathlib import Path
@@ -101,6 +103,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "ccbda.wsgi.application"
+ASGI_APPLICATION = "ccbda.asgi.application"
+# "wsgi" or "asgi" (Uvicorn workers), see gunicorn.conf.py
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -115,6 +120,17 @@ if not "POSTGRES_HOST" in os.environ:
     logger.error("POSTGRES_HOST not set")
 
 
+# Connection reuse, one of:
+# - Persistent connections (default): each worker keeps its connection for POSTGRES_CONN_MAX_AGE seconds (0 opens a
+#   new connection per request), checking that it is still usable before reusing it.
+# - POSTGRES_POOL=True: a psycopg 3 connection pool per worker process (requires `psycopg[pool]`, see
+#   https://docs.djangoproject.com/en/5.2/ref/databases/#connection-pool). Incompatible with persistent connections.
+# The driver is psycopg 3 (requirements.txt); Django falls back to psycopg2 only if psycopg 3 is not installed.
+# - POSTGRES_PGBOUNCER=True: the host is a PgBouncer in transaction pooling mode, so server-side cursors and
+#   prepared statements, which are bound to a server connection, are disabled.
+POSTGRES_POOL = os.getenv("POSTGRES_POOL", "False") == "True"
+POSTGRES_PGBOUNCER = os.getenv("POSTGRES_PGBOUNCER", "False") == "True"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -124,8 +140,67 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST"),
         "PORT": os.getenv("POSTGRES_PORT", 5432),
+        # Async views run their queries in per-request threads, whose persistent connections would never be reused
+        "CONN_MAX_AGE": 0 if POSTGRES_POOL or SERVER_MODE == "asgi" else int(os.getenv("POSTGRES_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": os.getenv("POSTGRES_CONN_HEALTH_CHECKS", "True") == "True",
+        "OPTIONS": {},
     },
 }
+if POSTGRES_POOL:
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", 1)),
+        "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", 4)),
+        "timeout": float(os.getenv("POSTGRES_POOL_TIMEOUT", 10)),
+    }
+if POSTGRES_PGBOUNCER:
+    # The driver Django loads (psycopg 3 if installed, else psycopg2)
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    if is_psycopg3:
+        # psycopg 3 prepares the statements executed several times (server-side); psycopg2 never does
+        DATABASES["default"]["OPTIONS"]["prepare_threshold"] = None
+
+# Optional read replica: the feed samples and lead lookups are read from it, see ccbda/db_routers.py
+if os.getenv("POSTGRES_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **copy.deepcopy(DATABASES["default"]),
+        "HOST": os.getenv("POSTGRES_REPLICA_HOST"),
+        "PORT": os.getenv("POSTGRES_REPLICA_PORT", DATABASES["default"]["PORT"]),
+        # Tests use the primary for both aliases
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_ROUTERS = ["ccbda.db_routers.PrimaryReplicaRouter"]
+    MIDDLEWARE.append("ccbda.db_routers.ReadYourWritesMiddleware")
+# Tests and local development without PostgreSQL (DJANGO_SQLITE=True): SQLite files, the second one standing in for the
+# read replica (unused unless the router is enabled, e.g. by the tests). PostgreSQL-only features, such as the
+# partitions of form_articlehits, are skipped. Tests: DJANGO_SQLITE=True DJANGO_SECRET_KEY=test python manage.py test
+if os.getenv("DJANGO_SQLITE", "False") == "True":
+    DATABASES = {
+        "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3"},
+        "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db-replica.sqlite3"},
+    }
+# Seconds during which a browser reads from the primary after a write (e.g. a sign-up)
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
+# Cache: in the memory of each worker process by default, or shared by all the workers (and instances) in a Redis
+# (or Redis-compatible, e.g. ElastiCache/Valkey) server if REDIS_URL is set, e.g. redis://host:6379/0
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+            "KEY_PREFIX": "ccbda",
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "ccbda",
+        },
+    }
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -212,6 +287,24 @@ LOGGING = {
     },
 }
 
+# Ship the logs to Dynatrace as structured records (level, logger, code location, `extra` values as attributes) when
+# its credentials are set and dynatrace/backend is importable (the repository root in PYTHONPATH). In both server modes,
+# the handlers run behind a queue, in a background thread (see ccbda/log_queue.py), and the Dynatrace one only buffers
+# the records, another thread sends them in batches (see dynatrace/backend/dynatrace_logger.py).
+DYNATRACE_LOGS = bool(os.getenv("DYNATRACE_ENV_ID") or os.getenv("DYNATRACE_LOGS_ENDPOINT"))
+try:
+    DYNATRACE_LOGS = DYNATRACE_LOGS and importlib.util.find_spec("dynatrace.backend.dynatrace_logger") is not None
+except ModuleNotFoundError:
+    DYNATRACE_LOGS = False
+if DYNATRACE_LOGS:
+    LOGGING["handlers"]["dynatrace"] = {
+        "class": "dynatrace.backend.dynatrace_logger.DynatraceLogHandler",
+        "level": os.getenv("DYNATRACE_LOG_LEVEL", "INFO"),
+        "service": os.getenv("DYNATRACE_SERVICE_NAME", "ccbda"),
+    }
+    LOGGING["root"]["handlers"].append("dynatrace")
+    LOGGING["loggers"]["django"]["handlers"].append("dynatrace")
+
 RSS_URLS = [
     "https://www.cloudcomputing-news.net/feed/",
     "https://feeds.feedburner.com/cioreview/fvHK",
@@ -219,3 +312,41 @@ RSS_URLS = [
     "https://aws.amazon.com/blogs/aws/feed/",
     "https://cloudtweaks.com/feed/",
 ]
+RSS_FETCH_WORKERS = int(os.getenv("RSS_FETCH_WORKERS", 8))
+RSS_FETCH_TIMEOUT = float(os.getenv("RSS_FETCH_TIMEOUT", 10))
+
+# Hit counting of the article clicks, by the click writer (see form/counters.py): "atomic" (one UPDATE per feed of each
+# batch of clicks) or "buffered" (per-feed increments are accumulated in memory and flushed every HIT_COUNTER_FLUSH_MS
+# milliseconds)
+HIT_COUNTER_MODE = os.getenv("HIT_COUNTER_MODE", "atomic")
+HIT_COUNTER_FLUSH_MS = int(os.getenv("HIT_COUNTER_FLUSH_MS", 500))
+
+# Batched, asynchronous storage of article clicks (ArticleHits), see form/clicks.py
+CLICK_PIPELINE = {
+    "BATCH_SIZE": int(os.getenv("CLICK_PIPELINE_BATCH_SIZE", 500)),
+    "MAX_LATENCY_MS": int(os.getenv("CLICK_PIPELINE_MAX_LATENCY_MS", 200)),
+    "QUEUE_SIZE": int(os.getenv("CLICK_PIPELINE_QUEUE_SIZE", 10000)),
+    "BACKPRESSURE": os.getenv("CLICK_PIPELINE_BACKPRESSURE", "block"),  # "block", "drop" or "inline"
+    "BLOCK_TIMEOUT_MS": int(os.getenv("CLICK_PIPELINE_BLOCK_TIMEOUT_MS", 50)),
+    "RETRY_DELAY_MS": int(os.getenv("CLICK_PIPELINE_RETRY_DELAY_MS", 500)),
+}
+
+# Random sample of feeds on the home page, see form/sampling.py
+FEED_SAMPLE_STRATEGY = os.getenv("FEED_SAMPLE_STRATEGY", "range")  # "range" or "ids"
+FEED_SAMPLE_REFRESH_SECONDS = int(os.getenv("FEED_SAMPLE_REFRESH_SECONDS", 300))
+FEED_FRAGMENT_CACHE_SECONDS = int(os.getenv("FEED_FRAGMENT_CACHE_SECONDS", 30))
+# Extra seconds a stale feed block is served while a single request renders the new one, see form/cache.py
+FEED_FRAGMENT_STALE_SECONDS = int(os.getenv("FEED_FRAGMENT_STALE_SECONDS", 30))
+
+# Per-worker cache of email -> lead id used to resolve the clicks, see form/lru.py
+LEAD_CACHE_SIZE = int(os.getenv("LEAD_CACHE_SIZE", 10000))
+LEAD_CACHE_TTL = int(os.getenv("LEAD_CACHE_TTL", 300))
+LEAD_CACHE_NEGATIVE_TTL = int(os.getenv("LEAD_CACHE_NEGATIVE_TTL", 5))
+# Per-worker cache of feed id -> link used by the article redirects (unknown ids for FEED_CACHE_NEGATIVE_TTL seconds)
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", 10000))
+FEED_CACHE_TTL = int(os.getenv("FEED_CACHE_TTL", 300))
+FEED_CACHE_NEGATIVE_TTL = int(os.getenv("FEED_CACHE_NEGATIVE_TTL", 5))
+
+# Monthly partitions of form_articlehits (PostgreSQL only), see form/partitions.py and `manage.py manage_partitions`
+ARTICLE_HITS_PARTITION_MONTHS_AHEAD = int(os.getenv("ARTICLE_HITS_PARTITION_MONTHS_AHEAD", 3))
+ARTICLE_HITS_RETENTION_MONTHS = int(os.getenv("ARTICLE_HITS_RETENTION_MONTHS", 0))  # 0 keeps all the hits
@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ccbda.settings')
 
 application = get_wsgi_application()
+
+from ccbda.log_queue import log_in_background  # noqa: E402 (needs the settings)
+
+log_in_background(logging.getLogger(), logging.getLogger("django"))
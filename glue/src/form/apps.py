@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 
 class FormConfig(AppConfig):
-    name = 'form'
\ No newline at end of file
+    name = 'form'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,46 @@
+import logging
+import time
+from typing import Callable
+
+from django.core.cache import cache
+
+logger = logging.getLogger("django")
+
+
+def get_or_compute(key: str, compute: Callable[[], object], ttl: float, stale_ttl: float = None, lock_timeout: float = 10):
+    """
+    Get a value from the cache, computing it on a miss, with protection against cache stampedes.
+
+    The value is stored with a soft expiry (`ttl`) and kept `stale_ttl` more seconds in the cache. When the soft expiry
+    has passed, a single caller (the one that wins the `cache.add` lock) recomputes the value, while the concurrent
+    callers keep getting the stale value instead of all recomputing it at once. On a cold cache, the callers that do
+    not get the lock wait for the value (up to `lock_timeout` seconds) before computing it themselves.
+    Args:
+        key (str): The cache key.
+        compute (Callable[[], object]): Computes the value (must be picklable).
+        ttl (float): Seconds during which the value is fresh.
+        stale_ttl (float): Seconds during which the stale value can still be served (defaults to `ttl`).
+        lock_timeout (float): Seconds after which the lock of a caller that died while computing expires.
+    """
+    stale_ttl = ttl if stale_ttl is None else stale_ttl
+    entry = cache.get(key)
+    if entry is not None and entry[1] > time.time():
+        return entry[0]
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, lock_timeout):
+        if entry is not None:
+            return entry[0]
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        logger.warning(f"Timeout waiting for {key} to be computed, computing it")
+    try:
+        value = compute()
+        cache.set(key, (value, time.time() + ttl), ttl + stale_ttl)
+    finally:
+        cache.delete(lock_key)
+    return value
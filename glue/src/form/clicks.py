@@ -0,0 +1,266 @@
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from typing import List, NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, router, transaction
+from django.utils import timezone
+
+from . import rollups
+from .counters import HitCounter, hit_counter
+from .models import ArticleHits, Feeds, Leads
+
+logger = logging.getLogger("django")
+
+
+class ClickEvent(NamedTuple):
+    "A click on an article, to be counted and, if its user has the `email` cookie, stored as an `ArticleHits` row"
+
+    email: Optional[str]
+    feed_id: int
+    timestamp: object
+
+
+class ClickPipeline:
+    """
+    In-process, batched ingestion of article clicks.
+
+    The `hit` view only puts a `ClickEvent` on a bounded queue and returns the redirect. A background writer thread
+    drains the queue and stores the events with a single multi-row INSERT per batch: a batch is written as soon as it
+    has `batch_size` events or its oldest event has waited `max_latency_ms` milliseconds. The clicks of the batch are
+    also counted by `counter` (`Feeds.hits`, see `form.counters`), in the same transaction.
+
+    When the queue is full, `backpressure` decides what happens to new clicks:
+    - "block": wait up to `block_timeout_ms` for room in the queue, then drop the click.
+    - "drop": drop the click immediately.
+    - "inline": write the click synchronously in the request (without retry, see below).
+
+    A batch whose write fails in the background writer (e.g. the database connection was lost) is retried once, on a
+    new connection, after `retry_delay_ms` milliseconds; if it fails again, its clicks are counted in `dropped` (with
+    the clicks rejected by the backpressure), see `stats`.
+
+    Pending events are flushed when the worker shuts down cleanly (see `close`).
+    """
+
+    BACKPRESSURE_MODES = ("block", "drop", "inline")
+
+    def __init__(
+        self,
+        batch_size: int = 500,
+        max_latency_ms: int = 200,
+        queue_size: int = 10000,
+        backpressure: str = "block",
+        block_timeout_ms: int = 50,
+        retry_delay_ms: int = 500,
+        counter: HitCounter = None,
+    ):
+        if backpressure not in self.BACKPRESSURE_MODES:
+            raise ValueError(f"Unknown backpressure mode: {backpressure}")
+        self.batch_size = batch_size
+        self.max_latency_ms = max_latency_ms
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self.block_timeout_ms = block_timeout_ms
+        self.retry_delay_ms = retry_delay_ms
+        self.counter = counter
+        self.dropped = 0
+        self.written = 0
+        self.retried = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        # The counters are updated by the writer thread and by the requests (backpressure)
+        self._stats_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def submit(self, email: str, feed_id: int) -> bool:
+        """
+        Enqueue a click to be counted and stored as an `ArticleHits` row.
+        Args:
+            email (str): The email of the lead who clicked (from the cookie), None for anonymous clicks (only counted).
+            feed_id (int): The id of the clicked feed.
+        Returns:
+            bool: True if the click was accepted, False if it was dropped.
+        """
+        event = ClickEvent(email, feed_id, timezone.now())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+        if self.backpressure == "inline":
+            return self._write([event], retry=False)
+        if self.backpressure == "block":
+            try:
+                self._queue.put(event, timeout=self.block_timeout_ms / 1000)
+                return True
+            except queue.Full:
+                pass
+        return self._reject(event)
+
+    async def asubmit(self, email: str, feed_id: int) -> bool:
+        """
+        Async version of `submit`, which never blocks the event loop: the "block" backpressure waits for room in the
+        queue with `asyncio.sleep`, and the "inline" one writes the click in a thread.
+        """
+        event = ClickEvent(email, feed_id, timezone.now())
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+        if self.backpressure == "inline":
+            return await sync_to_async(self._write)([event], retry=False)
+        if self.backpressure == "block":
+            deadline = time.monotonic() + self.block_timeout_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.005)
+                try:
+                    self._queue.put_nowait(event)
+                    return True
+                except queue.Full:
+                    pass
+        return self._reject(event)
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _reject(self, event: ClickEvent) -> bool:
+        self._count(dropped=1)
+        logger.warning(f"Click queue full, dropping click of {event.email} on feed {event.feed_id}")
+        return False
+
+    def stats(self) -> dict:
+        "Counters of this worker process: clicks written, dropped (queue full or write failed), batches retried"
+        with self._stats_lock:
+            return {
+                "written": self.written,
+                "dropped": self.dropped,
+                "retried": self.retried,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        """
+        Stop the background writer and write any pending events.
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._stopping = True
+            thread.join(timeout=10)
+            self._thread = None
+        self._write(self._drain(self._queue.qsize()))
+
+    def _ensure_started(self):
+        # Gunicorn forks the workers after the app is imported, so the thread is started lazily in each process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._thread = threading.Thread(target=self._run, name="click-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency_ms / 1000
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            close_old_connections()
+
+    def _drain(self, max_events: int) -> List[ClickEvent]:
+        events = []
+        while len(events) < max_events:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _write(self, events: List[ClickEvent], retry: bool = True) -> bool:
+        "Store the events; the background writer retries a failed batch once (not a request, which would wait)"
+        if not events:
+            return True
+        try:
+            self._store(events)
+            return True
+        except Exception as e:
+            if not retry:
+                return self._drop(events, e)
+            logger.warning(f"Error storing {len(events)} article hits, retrying: {e}")
+        self._count(retried=1)
+        # Drop the broken connection, if any: the retry opens a new one
+        close_old_connections()
+        time.sleep(self.retry_delay_ms / 1000)
+        try:
+            self._store(events)
+            return True
+        except Exception as e:
+            return self._drop(events, e)
+
+    def _drop(self, events: List[ClickEvent], error: Exception) -> bool:
+        self._count(dropped=len(events))
+        logger.error(f"Error storing {len(events)} article hits, dropped ({self.dropped} in total): {error}")
+        return False
+
+    def _store(self, events: List[ClickEvent]):
+        emails = {e.email for e in events if e.email}
+        lead_ids = Leads.get_lead_ids_by_email(emails) if emails else {}
+        primary = router.db_for_write(ArticleHits)
+        if len(lead_ids) < len(emails) and router.db_for_read(Leads) != primary:
+            # Leads who have just signed up may not be on the read replica yet
+            lead_ids.update(Leads.get_lead_ids_by_email(emails - lead_ids.keys(), using=primary))
+        feed_ids = set(
+            Feeds.objects.using(primary).filter(pk__in={e.feed_id for e in events}).values_list("id", flat=True)
+        )
+        hits = [
+            ArticleHits(lead_id=lead_ids[e.email], feed_id=e.feed_id, timestamp=e.timestamp)
+            for e in events
+            if e.email in lead_ids and e.feed_id in feed_ids
+        ]
+        with transaction.atomic(using=primary):
+            ArticleHits.objects.bulk_create(hits, batch_size=self.batch_size)
+            rollups.record_hits(hits, using=primary)
+            if self.counter is not None:
+                self.counter.record(Counter(e.feed_id for e in events if e.feed_id in feed_ids), using=primary)
+        self._count(written=len(hits))
+        logger.info(f"Stored {len(hits)} article hits ({len(events) - len(hits)} anonymous, or unknown leads or feeds)")
+
+
+click_pipeline = ClickPipeline(
+    batch_size=settings.CLICK_PIPELINE["BATCH_SIZE"],
+    max_latency_ms=settings.CLICK_PIPELINE["MAX_LATENCY_MS"],
+    queue_size=settings.CLICK_PIPELINE["QUEUE_SIZE"],
+    backpressure=settings.CLICK_PIPELINE["BACKPRESSURE"],
+    block_timeout_ms=settings.CLICK_PIPELINE["BLOCK_TIMEOUT_MS"],
+    retry_delay_ms=settings.CLICK_PIPELINE["RETRY_DELAY_MS"],
+    counter=hit_counter,
+)
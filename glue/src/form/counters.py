@@ -0,0 +1,118 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Dict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Feeds
+
+logger = logging.getLogger("django")
+
+
+class HitCounter:
+    """
+    Counts article clicks (`Feeds.hits`). The clicks are recorded by the click writer (see `form.clicks`), off the
+    request, once per batch of clicks.
+
+    Two modes are supported:
+    - "atomic": every batch issues one `UPDATE form_feeds SET hits = hits + N` per feed, touching only the `hits`
+        column, in the transaction that stores the clicks.
+    - "buffered": clicks are accumulated per feed in memory and a background thread flushes them every `flush_ms`
+        milliseconds, issuing one atomic increment per feed. A popular article clicked thousands of times per
+        second costs one UPDATE per flush instead of one per batch.
+
+    Buffered increments that have not been flushed yet are lost if the worker is killed, which is acceptable for a
+    popularity counter. A clean shutdown flushes them (see `close`).
+    """
+
+    def __init__(self, mode: str = "atomic", flush_ms: int = 500):
+        if mode not in ("atomic", "buffered"):
+            raise ValueError(f"Unknown hit counter mode: {mode}")
+        self.mode = mode
+        self.flush_ms = flush_ms
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, counts: Dict[int, int], using: str = None):
+        """
+        Count clicks, in the transaction that stores them: the atomic mode writes the increments in it, the buffered
+        one buffers them once it commits (so a batch that is rolled back and retried is not counted twice).
+        Args:
+            counts (Dict[int, int]): The number of clicks of each (existing) feed.
+            using (str): The database alias of the transaction (the default one if None).
+        """
+        if self.mode == "atomic":
+            # Sorted to always take the row locks in the same order and avoid deadlocks between workers
+            for feed_id, amount in sorted(counts.items()):
+                Feeds.increment_hits(feed_id, amount, using=using)
+            return
+        counts = dict(counts)
+        transaction.on_commit(lambda: self._buffer(counts), using=using)
+
+    def _buffer(self, counts: Dict[int, int]):
+        self._ensure_started()
+        with self._lock:
+            self._pending.update(counts)
+
+    def flush(self) -> int:
+        """
+        Write all the buffered increments to the database.
+        Returns:
+            int: The number of feeds updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                # Sorted to always take the row locks in the same order and avoid deadlocks between workers
+                for feed_id, amount in sorted(pending.items()):
+                    Feeds.increment_hits(feed_id, amount)
+        except Exception as e:
+            logger.error(f"Error flushing hit counters: {e}")
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        return len(pending)
+
+    def close(self):
+        """
+        Stop the background flusher and write any pending increments.
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            self._thread = None
+            self._wakeup.set()
+            thread.join(timeout=5)
+        self.flush()
+
+    def _ensure_started(self):
+        # Gunicorn forks the workers after the app is imported, so the thread is started lazily in each process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = Counter()
+            self._wakeup.clear()
+            self._thread = threading.Thread(target=self._run, name="hit-counter-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while self._thread is not None:
+            self._wakeup.wait(self.flush_ms / 1000)
+            self.flush()
+            close_old_connections()
+
+
+hit_counter = HitCounter(mode=settings.HIT_COUNTER_MODE, flush_ms=settings.HIT_COUNTER_FLUSH_MS)
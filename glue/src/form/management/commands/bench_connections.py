@@ -0,0 +1,102 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+# Environment overrides of the configurations compared by --compare (see DATABASES in ccbda/settings.py)
+MODES = {
+    "per-request": {"POSTGRES_CONN_MAX_AGE": "0", "POSTGRES_POOL": "False"},
+    "persistent": {"POSTGRES_CONN_MAX_AGE": "600", "POSTGRES_POOL": "False"},
+    "pool": {"POSTGRES_POOL": "True"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the database connection overhead per request: runs a query inside simulated request cycles "
+        "(request_started/request_finished signals, as Django does for every request) with the current settings, "
+        "or with each connection mode when --compare is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Number of simulated requests.")
+        parser.add_argument("--query", type=str, default="SELECT 1", help="Query executed in each request.")
+        parser.add_argument("--compare", action="store_true", help="Run the benchmark with every connection mode.")
+        parser.add_argument("--json", action="store_true", help="Print the statistics as JSON.")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1.")
+        if options["compare"]:
+            self.compare(options["requests"], options["query"])
+            return
+        stats = self.run(options["requests"], options["query"])
+        if options["json"]:
+            self.stdout.write(json.dumps(stats))
+        else:
+            self.print_stats(self.mode(), stats)
+
+    def run(self, requests: int, query: str) -> dict:
+        # Every connect() of the database wrapper: a new connection, or a checkout from the pool
+        opened = []
+
+        def on_connection_created(sender, **kwargs):
+            opened.append(1)
+
+        connection_created.connect(on_connection_created)
+        latencies = []
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute(query)
+                    cursor.fetchall()
+                request_finished.send(sender=self.__class__)
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection_created.disconnect(on_connection_created)
+            connection.close()
+        latencies.sort()
+        return {
+            "requests": requests,
+            "connections": len(opened),
+            "mean_ms": round(statistics.mean(latencies), 3),
+            "p50_ms": round(latencies[len(latencies) // 2], 3),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        }
+
+    def compare(self, requests: int, query: str):
+        manage_py = os.path.join(settings.BASE_DIR, "manage.py")
+        for mode, env in MODES.items():
+            result = subprocess.run(
+                [sys.executable, manage_py, "bench_connections", "--requests", str(requests), "--query", query, "--json"],
+                env={**os.environ, **env},
+                capture_output=True,
+                text=True,
+            )
+            if result.returncode != 0:
+                error = (result.stderr.strip().splitlines() or ["unknown error"])[-1]
+                self.stdout.write(f"{mode:>12}: failed ({error})")
+                continue
+            self.print_stats(mode, json.loads(result.stdout.strip().splitlines()[-1]))
+
+    def mode(self) -> str:
+        database = settings.DATABASES["default"]
+        if database.get("OPTIONS", {}).get("pool"):
+            return "pool"
+        return "persistent" if database.get("CONN_MAX_AGE") else "per-request"
+
+    def print_stats(self, mode: str, stats: dict):
+        self.stdout.write(
+            f"{mode:>12}: {stats['requests']} requests, {stats['connections']} connects, "
+            f"mean {stats['mean_ms']:.2f} ms, p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms"
+        )
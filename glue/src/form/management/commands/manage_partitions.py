@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from form import partitions
+
+
+class Command(BaseCommand):
+    help = "Create the future monthly partitions of form_articlehits and drop the expired ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months-ahead", type=int, help="Months after the current one with a partition (default from settings)."
+        )
+        parser.add_argument(
+            "--months-back",
+            type=int,
+            default=0,
+            help="Also create the partitions of the previous MONTHS_BACK months, e.g. before loading old hits.",
+        )
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            help="Drop the partitions older than this number of months (default from settings, 0 keeps them all).",
+        )
+        parser.add_argument(
+            "--detach-only", action="store_true", help="Detach the expired partitions instead of dropping them."
+        )
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            raise CommandError(f"{partitions.TABLE} is not a partitioned PostgreSQL table, run the migrations first.")
+        created = partitions.ensure_partitions(options["months_ahead"], options["months_back"])
+        expired = partitions.drop_expired(options["retention_months"], options["detach_only"])
+        self.stdout.write(f"Created partitions: {', '.join(created) or 'none'}")
+        self.stdout.write(f"{'Detached' if options['detach_only'] else 'Dropped'} partitions: {', '.join(expired) or 'none'}")
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from form import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly/daily rollups of the article hits from form_articlehits."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            help="Only recompute the last DAYS days (today included). By default, all the rollups are recomputed.",
+        )
+
+    def handle(self, *args, **options):
+        since = rollups.last_days(options["days"]) if options["days"] else None
+        start = time.monotonic()
+        written = rollups.rebuild(since)
+        self.stdout.write(f"{written} rollup rows written in {time.monotonic() - start:.2f}s")
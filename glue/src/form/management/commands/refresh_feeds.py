@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from form.rss import FeedIngestor
+
+
+class Command(BaseCommand):
+    help = "Fetch the RSS feeds in settings.RSS_URLS concurrently and store the new articles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, help="Number of feeds fetched in parallel.")
+        parser.add_argument("--timeout", type=float, help="Timeout (seconds) of each feed request.")
+        parser.add_argument("--force", action="store_true", help="Ignore ETag/Last-Modified and fetch every feed.")
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Keep running and refresh the feeds every INTERVAL seconds (0, the default, runs once).",
+        )
+
+    def handle(self, *args, **options):
+        ingestor = FeedIngestor(workers=options["workers"], timeout=options["timeout"], conditional=not options["force"])
+        while True:
+            start = time.monotonic()
+            inserted = ingestor.run()
+            self.stdout.write(f"{inserted} new articles stored in {time.monotonic() - start:.2f}s")
+            if options["interval"] <= 0:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2025-05-20 10:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('form', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='articlehits',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
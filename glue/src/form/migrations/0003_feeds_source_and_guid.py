@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2025-05-21 09:40
+
+from urllib.parse import parse_qs, urlparse
+
+from django.db import migrations, models
+
+
+def backfill_source_link(apps, schema_editor):
+    "Recover the original article URL from the hit link of the existing articles, so they are not inserted again"
+    Feeds = apps.get_model("form", "Feeds")
+    db = schema_editor.connection.alias
+    articles = list(Feeds.objects.using(db).filter(source_link="").only("id", "link"))
+    for article in articles:
+        article.source_link = parse_qs(urlparse(article.link).query).get("url", [""])[0][:500]
+    Feeds.objects.using(db).bulk_update(articles, ["source_link"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('form', '0002_alter_articlehits_timestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, default='', max_length=500)),
+                ('last_modified', models.CharField(blank=True, default='', max_length=100)),
+                ('fetched_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='feeds',
+            name='guid',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='feeds',
+            name='source_link',
+            field=models.URLField(blank=True, db_index=True, default='', max_length=500),
+        ),
+        migrations.RunPython(backfill_source_link, migrations.RunPython.noop),
+    ]
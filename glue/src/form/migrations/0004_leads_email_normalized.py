@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2025-05-22 16:05
+
+from django.db import migrations, models
+
+
+def backfill_email_normalized(apps, schema_editor):
+    "Fill the normalized email of the existing leads; for duplicated emails only the oldest lead gets it"
+    Leads = apps.get_model("form", "Leads")
+    db = schema_editor.connection.alias
+    seen = set()
+    leads = []
+    for lead in Leads.objects.using(db).order_by("id").only("id", "email").iterator(chunk_size=2000):
+        key = (lead.email or "").strip().lower()
+        if key and key not in seen:
+            seen.add(key)
+            lead.email_normalized = key
+            leads.append(lead)
+    Leads.objects.using(db).bulk_update(leads, ["email_normalized"], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('form', '0003_feeds_source_and_guid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leads',
+            name='email_normalized',
+            field=models.CharField(editable=False, max_length=254, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+    ]
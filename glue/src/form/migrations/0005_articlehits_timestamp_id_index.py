@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2025-05-26 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('form', '0004_leads_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='articlehits',
+            index=models.Index(fields=['timestamp', 'id'], name='form_hits_timestamp_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2 on 2025-05-27 09:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('form', '0005_articlehits_timestamp_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedHitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('hits', models.BigIntegerField(default=0)),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='form.feeds')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'feed'), name='form_feed_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LeadHitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('hits', models.BigIntegerField(default=0)),
+                ('lead', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='form.leads')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'lead'), name='form_lead_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2 on 2025-05-28 10:05
+
+from django.conf import settings
+from django.db import migrations
+
+TABLE = "form_articlehits"
+NEW_TABLE = f"{TABLE}_new"
+
+
+def _rebuild(schema_editor, partitioned):
+    """
+    Copy form_articlehits into a new (partitioned or plain) table with the same columns, indexes and foreign keys.
+    The table is locked during the copy: for very large tables, run this migration in a maintenance window.
+    """
+    from form.partitions import DEFAULT_PARTITION, add_months, create_partition
+
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, TABLE)
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        if partitioned:
+            # A partitioned table cannot have an identity column before PostgreSQL 17: the id uses a sequence instead
+            cursor.execute(
+                f'CREATE TABLE {NEW_TABLE} ("id" bigint NOT NULL, "timestamp" timestamp with time zone NOT NULL, '
+                f'"feed_id" bigint NOT NULL, "lead_id" bigint NOT NULL) PARTITION BY RANGE ("timestamp")'
+            )
+            cursor.execute(f'SELECT min("timestamp"), now() FROM {TABLE}')
+            first, now = cursor.fetchone()
+            month = (first or now).date().replace(day=1)
+            last = add_months(now.date(), settings.ARTICLE_HITS_PARTITION_MONTHS_AHEAD)
+            while month <= last:
+                create_partition(cursor, month, parent=NEW_TABLE)
+                month = add_months(month, 1)
+            cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {NEW_TABLE} DEFAULT")
+        else:
+            cursor.execute(
+                f'CREATE TABLE {NEW_TABLE} ("id" bigint NOT NULL GENERATED BY DEFAULT AS IDENTITY, '
+                f'"timestamp" timestamp with time zone NOT NULL, "feed_id" bigint NOT NULL, "lead_id" bigint NOT NULL)'
+            )
+        columns = '"id", "timestamp", "feed_id", "lead_id"'
+        cursor.execute(f"INSERT INTO {NEW_TABLE} ({columns}) SELECT {columns} FROM {TABLE}")
+        cursor.execute(f"DROP TABLE {TABLE}")
+        cursor.execute(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}")
+
+        if partitioned:
+            # The primary key of a partitioned table must include the partition key. Ids stay unique (sequence).
+            cursor.execute(f"CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id")
+            cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ("id", "timestamp")')
+        else:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY ("id")')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(max(id), 0) + 1, false) FROM {TABLE}", [TABLE]
+        )
+        for name, constraint in constraints.items():
+            columns = ", ".join(f'"{c}"' for c in constraint["columns"])
+            if constraint["foreign_key"]:
+                ref_table, ref_column = constraint["foreign_key"]
+                cursor.execute(
+                    f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} FOREIGN KEY ({columns}) REFERENCES {ref_table} ("{ref_column}") '
+                    "DEFERRABLE INITIALLY DEFERRED"
+                )
+            elif constraint["index"] and not constraint["primary_key"] and not constraint["unique"]:
+                cursor.execute(f"CREATE INDEX {name} ON {TABLE} ({columns})")
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        _rebuild(schema_editor, partitioned=True)
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        _rebuild(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+    """
+    Partition form_articlehits by month of `timestamp` (PostgreSQL only, see form/partitions.py).
+    The Django model is unchanged: `id` is still unique and used as the primary key by the ORM.
+    """
+
+    dependencies = [
+        ('form', '0006_hit_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -1,21 +1,45 @@
 import logging
-from urllib.parse import urlencode, urljoin
+from typing import Optional
 
-import feedparser
-import requests
-from bs4 import BeautifulSoup
 from django.conf import settings
-from django.db import models
-from django.shortcuts import reverse
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .lru import TTLCache
 
 logger = logging.getLogger("django")
 
+# email_normalized -> lead id (or None if there is no such lead), local to each worker process
+lead_id_cache = TTLCache(maxsize=settings.LEAD_CACHE_SIZE, ttl=settings.LEAD_CACHE_TTL)
+# feed id -> link of the feed (None if it does not exist), so the hit view checks and logs it without a query
+feed_link_cache = TTLCache(maxsize=settings.FEED_CACHE_SIZE, ttl=settings.FEED_CACHE_TTL)
+_NOT_CACHED = object()
+
 
 class Leads(models.Model):
     name = models.CharField(max_length=200)
     email = models.EmailField()
+    # Lower-cased email, unique and indexed: this is the column used to find a lead from the `email` cookie.
+    # Leads created before it existed with a duplicated email keep it empty (only the oldest one gets it, see
+    # migration 0004), also when they are saved again.
+    email_normalized = models.CharField(max_length=254, unique=True, null=True, editable=False)
     preview = models.BooleanField(default=False)
 
+    @staticmethod
+    def normalize_email(email: str) -> str:
+        return (email or "").strip().lower()
+
+    def save(self, *args, **kwargs):
+        key = self.normalize_email(self.email) or None
+        if key is not None and self.pk is not None and self.email_normalized is None and not self._state.adding:
+            # An existing lead without the normalized email: a duplicate left empty by the backfill, unless its email
+            # is not used by another lead (anymore)
+            if Leads.objects.filter(email_normalized=key).exclude(pk=self.pk).exists():
+                key = None
+        self.email_normalized = key
+        super().save(*args, **kwargs)
+
     @classmethod
     def insert_lead(cls, name: str, email: str, preview_access: bool = False):
         """
@@ -24,11 +48,33 @@ class Leads(models.Model):
             name (str): The name of the lead.
             email (str): The email of the lead.
             preview_access (bool): Whether the lead has preview access or not.
+        Returns:
+            Leads: The new lead, or None if it could not be inserted.
+        Raises:
+            IntegrityError: A lead with the same (normalized) email already exists, e.g. inserted by a concurrent
+                signup after the caller checked it.
         """
         try:
-            res = cls.objects.create(name=name, email=email, preview=preview_access)
-            res.save()
+            with transaction.atomic():
+                res = cls.objects.create(name=name, email=email, preview=preview_access)
+            logger.info(f"Lead inserted: {name}, {email}")
+        except IntegrityError:
+            logger.info(f"Lead already exists: {email}")
+            raise
+        except Exception as e:
+            logger.error(f"Error inserting lead: {e}")
+            return None
+        return res
+
+    @classmethod
+    async def ainsert_lead(cls, name: str, email: str, preview_access: bool = False):
+        "Async version of `insert_lead`"
+        try:
+            res = await cls.objects.acreate(name=name, email=email, preview=preview_access)
             logger.info(f"Lead inserted: {name}, {email}")
+        except IntegrityError:
+            logger.info(f"Lead already exists: {email}")
+            raise
         except Exception as e:
             logger.error(f"Error inserting lead: {e}")
             return None
@@ -37,17 +83,85 @@ class Leads(models.Model):
     @classmethod
     def get_lead_by_email(cls, email: str):
         """
-        Get a lead by email.
+        Get a lead by email (case-insensitive).
         Args:
             email (str): The email of the lead.
         Returns:
             Leads: The lead object if found, else None.
         """
-        try:
-            return cls.objects.get(email=email)
-        except cls.DoesNotExist:
+        key = cls.normalize_email(email)
+        lead = cls.objects.filter(email_normalized=key).first() if key else None
+        if lead is None:
             logger.warning(f"Lead not found: {email}")
-            return None
+        return lead
+
+    @classmethod
+    def get_lead_ids_by_email(cls, emails, using: str = None) -> dict:
+        """
+        Resolve many emails to lead ids, using the per-worker `lead_id_cache` and a single query for the misses.
+        Args:
+            emails (Iterable[str]): The emails to look up.
+            using (str): Query this database alias, ignoring the cached misses (e.g. to look up on the primary the
+                leads not found on the replica). By default, the database router decides.
+        Returns:
+            dict: A mapping email -> lead id, only for the emails that were found.
+        """
+        keys, found, missing = cls._cached_lead_ids(emails)
+        if using is not None:
+            missing = set(keys.values()) - found.keys()
+        if missing:
+            rows = cls.objects.using(using) if using else cls.objects
+            fetched = dict(rows.filter(email_normalized__in=missing).values_list("email_normalized", "id"))
+            found.update(cls._cache_lead_ids(missing, fetched))
+        return {email: found[key] for email, key in keys.items() if key in found}
+
+    @classmethod
+    async def aget_lead_ids_by_email(cls, emails, using: str = None) -> dict:
+        "Async version of `get_lead_ids_by_email`"
+        keys, found, missing = cls._cached_lead_ids(emails)
+        if using is not None:
+            missing = set(keys.values()) - found.keys()
+        if missing:
+            rows = cls.objects.using(using) if using else cls.objects
+            rows = rows.filter(email_normalized__in=missing).values_list("email_normalized", "id")
+            fetched = {key: lead_id async for key, lead_id in rows}
+            found.update(cls._cache_lead_ids(missing, fetched))
+        return {email: found[key] for email, key in keys.items() if key in found}
+
+    @classmethod
+    def get_lead_id_by_email(cls, email: str, using: str = None):
+        """
+        Get the id of a lead by email, see `get_lead_ids_by_email`.
+        Returns:
+            int: The id of the lead if found, else None.
+        """
+        return cls.get_lead_ids_by_email([email], using=using).get(email)
+
+    @classmethod
+    async def aget_lead_id_by_email(cls, email: str, using: str = None):
+        "Async version of `get_lead_id_by_email`"
+        return (await cls.aget_lead_ids_by_email([email], using=using)).get(email)
+
+    @classmethod
+    def _cached_lead_ids(cls, emails):
+        # Returns the normalized key of each email, the cached lead ids and the keys that are not cached
+        keys = {email: cls.normalize_email(email) for email in set(emails) if email}
+        found, missing = {}, set()
+        for key in set(keys.values()):
+            lead_id = lead_id_cache.get(key, _NOT_CACHED)
+            if lead_id is _NOT_CACHED:
+                missing.add(key)
+            elif lead_id is not None:
+                found[key] = lead_id
+        return keys, found, missing
+
+    @staticmethod
+    def _cache_lead_ids(missing, fetched: dict) -> dict:
+        for key in missing:
+            lead_id = fetched.get(key)
+            # Unknown emails are cached too (for a shorter time), so anonymous clicks do not hit the database
+            lead_id_cache.set(key, lead_id, None if lead_id else settings.LEAD_CACHE_NEGATIVE_TTL)
+        return fetched
 
 
 class Feeds(models.Model):
@@ -56,33 +170,83 @@ class Feeds(models.Model):
     summary = models.TextField()
     author = models.CharField(max_length=120)
     hits = models.BigIntegerField(default=0)
+    # Identity of the RSS entry, used to avoid inserting the same article twice
+    guid = models.CharField(max_length=500, blank=True, default="", db_index=True)
+    source_link = models.URLField(max_length=500, blank=True, default="", db_index=True)
+
+    @classmethod
+    def get_link(cls, feed_id: int) -> Optional[str]:
+        """
+        The link of a feed, cached in the worker (`feed_link_cache`), or None if it does not exist. Unknown ids are
+        cached for a shorter time.
+        """
+        link = feed_link_cache.get(feed_id, _NOT_CACHED)
+        if link is _NOT_CACHED:
+            link = cls.objects.filter(pk=feed_id).values_list("link", flat=True).first()
+            feed_link_cache.set(feed_id, link, None if link is not None else settings.FEED_CACHE_NEGATIVE_TTL)
+        return link
+
+    @classmethod
+    async def aget_link(cls, feed_id: int) -> Optional[str]:
+        "Async version of `get_link`"
+        link = feed_link_cache.get(feed_id, _NOT_CACHED)
+        if link is _NOT_CACHED:
+            link = await cls.objects.filter(pk=feed_id).values_list("link", flat=True).afirst()
+            feed_link_cache.set(feed_id, link, None if link is not None else settings.FEED_CACHE_NEGATIVE_TTL)
+        return link
+
+    @classmethod
+    def increment_hits(cls, feed_id: int, amount: int = 1, using: str = None) -> int:
+        """
+        Atomically increment the hit counter of a feed.
+        The increment is done by the database (`UPDATE ... SET hits = hits + N`), so concurrent workers never
+        lose clicks and only the `hits` column is written.
+        Args:
+            feed_id (int): The id of the feed.
+            amount (int): The number of hits to add.
+            using (str): The database to write to (the router's choice if None).
+        Returns:
+            int: The number of rows updated (0 if the feed does not exist).
+        """
+        queryset = cls.objects.using(using) if using else cls.objects
+        return queryset.filter(pk=feed_id).update(hits=F("hits") + amount)
 
     def refresh_data(self):
-        for u in settings.RSS_URLS:
-            response = requests.get(u)
-            try:
-                feed = feedparser.parse(response.content)
-                for entry in feed.entries:
-                    article = Feeds.objects.create(title=entry.title, link="", summary="", author=entry.author)
-                    base_link = reverse("form:hit", kwargs={"id": article.id})
-                    article.link = urljoin(base_link, "?" + urlencode({"url": entry.link}))
-                    summary = BeautifulSoup(entry.summary, "html.parser")
-                    for anchor in summary.find_all("a"):
-                        anchor["href"] = urljoin(base_link, "?" + urlencode({"url": anchor["href"]}))
-                        anchor["target"] = "_blank"
-                    article.summary = str(summary)
-                    article.save()
-                    logger.info(f'Create article "{entry.title}"')
-            except Exception as e:
-                logger.error(f"Feed reading error: {e}")
+        """
+        Fetch the RSS feeds in `settings.RSS_URLS` and store the new articles.
+        Kept for backwards compatibility, see `form.rss.FeedIngestor` and the `refresh_feeds` management command.
+        """
+        from .rss import FeedIngestor
+
+        FeedIngestor().run()
+
+
+class FeedSource(models.Model):
+    "An RSS feed URL, with the validators of its last successful fetch (used for conditional GETs)"
+
+    url = models.URLField(max_length=500, unique=True)
+    etag = models.CharField(max_length=500, blank=True, default="")
+    last_modified = models.CharField(max_length=100, blank=True, default="")
+    fetched_at = models.DateTimeField(null=True, blank=True)
 
 
 class ArticleHits(models.Model):
-    "A user (Lead) has clicked on an article (Feed) link"
+    """
+    A user (Lead) has clicked on an article (Feed) link.
+    On PostgreSQL the table is partitioned by month of `timestamp` (see `form.partitions`): its primary key is
+    (id, timestamp), but ids are still unique, so the ORM keeps using `id` as the primary key.
+    """
 
     lead = models.ForeignKey(Leads, on_delete=models.CASCADE)
     feed = models.ForeignKey(Feeds, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the click happens, not when the row is written (hits may be written in batches, see `form.clicks`)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Incremental ETL extractions read the hits newer than a (timestamp, id) watermark
+            models.Index(fields=["timestamp", "id"], name="form_hits_timestamp_id_idx"),
+        ]
 
     def __str__(self):
         return f"{self.lead.name} clicked on {self.feed.title} at {self.timestamp}"
@@ -95,11 +259,55 @@ class ArticleHits(models.Model):
             lead (Leads): The lead who clicked the link.
             feed (Feeds): The feed that was clicked.
         """
+        from .rollups import record_hits
+
         try:
-            res = cls.objects.create(lead=lead, feed=feed)
-            res.save()
+            with transaction.atomic():
+                res = cls.objects.create(lead=lead, feed=feed)
+                record_hits([res])
             logger.info(f"Hit created: {lead.name} clicked on {feed.title}")
         except Exception as e:
             logger.error(f"Error creating hit: {e}")
             return None
         return res
+
+
+class HitRollup(models.Model):
+    """
+    Pre-aggregated number of article hits per time bucket (see `form.rollups`).
+    Subclasses add the dimension of the aggregate (feed or lead).
+    """
+
+    HOUR = "hour"
+    DAY = "day"
+    GRANULARITIES = [(HOUR, "Hour"), (DAY, "Day")]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITIES)
+    # Start of the bucket (UTC), truncated to the hour or the day
+    bucket = models.DateTimeField()
+    hits = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class FeedHitRollup(HitRollup):
+    "Hits of an article (Feed) per hour/day"
+
+    feed = models.ForeignKey(Feeds, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["granularity", "bucket", "feed"], name="form_feed_rollup_unique"),
+        ]
+
+
+class LeadHitRollup(HitRollup):
+    "Hits of a user (Lead) per hour/day"
+
+    lead = models.ForeignKey(Leads, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["granularity", "bucket", "lead"], name="form_lead_rollup_unique"),
+        ]
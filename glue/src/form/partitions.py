@@ -0,0 +1,158 @@
+"""
+Monthly partitions of `form_articlehits` (PostgreSQL declarative partitioning by range of `timestamp`).
+
+Migration `0007_partition_articlehits` turns the table into a partitioned table with one partition per month
+(`form_articlehits_pYYYY_MM`) and a default partition (`form_articlehits_default`) for the rows of months without a
+partition, so a click is never rejected. The ORM does not notice the difference: `ArticleHits` is still queried and
+inserted into as before, PostgreSQL routes the rows to their partition and prunes the partitions outside the range of
+a `timestamp` filter.
+
+Future partitions are created ahead of time, and the expired ones are detached and dropped, by the
+`manage_partitions` management command (e.g. from a daily cron job). Dropping a partition is instantaneous, unlike
+a `DELETE` of millions of rows. The rollups (`form.rollups`) are kept, so the analytics of expired months survive.
+"""
+
+import logging
+import re
+from datetime import date
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger("django")
+
+TABLE = "form_articlehits"
+DEFAULT_PARTITION = f"{TABLE}_default"
+COLUMNS = '"id", "timestamp", "feed_id", "lead_id"'
+_PARTITION_NAME = re.compile(rf"^{TABLE}_p(\d{{4}})_(\d{{2}})$")
+
+
+def add_months(month: date, months: int) -> date:
+    "The first day of the month `months` months after (or before, if negative) the month of a date"
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_p{month.year:04d}_{month.month:02d}"
+
+
+def is_partitioned() -> bool:
+    "Whether `form_articlehits` is a partitioned table (always False on databases other than PostgreSQL)"
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def list_partitions(cursor, parent: str = TABLE) -> List[Tuple[str, date]]:
+    """
+    The monthly partitions of the table.
+    Returns:
+        List[Tuple[str, date]]: (name, first day of the month) of each partition, in chronological order.
+    """
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.oid = to_regclass(%s)",
+        [parent],
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def create_partition(cursor, month: date, parent: str = TABLE) -> bool:
+    """
+    Create the partition of a month, if it does not exist yet.
+    If the default partition already has rows of that month, they are moved to the new partition (PostgreSQL does
+    not allow creating a partition whose rows are in the default partition).
+    Args:
+        cursor: A cursor of the default database connection.
+        month (date): Any day of the month.
+        parent (str): The partitioned table (only changed by the migration that creates it).
+    Returns:
+        bool: True if the partition was created.
+    """
+    month = month.replace(day=1)
+    name = partition_name(month)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass(%s) IS NOT NULL", [name, DEFAULT_PARTITION])
+    exists, has_default = cursor.fetchone()
+    if exists:
+        return False
+    bounds = [f"{month.isoformat()} 00:00:00+00", f"{add_months(month, 1).isoformat()} 00:00:00+00"]
+    create = f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)"
+    in_range = '"timestamp" >= %s AND "timestamp" < %s'
+    with transaction.atomic():
+        misplaced = False
+        if has_default:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})", bounds)
+            misplaced = cursor.fetchone()[0]
+        if not misplaced:
+            cursor.execute(create, bounds)
+        else:
+            cursor.execute(f"ALTER TABLE {parent} DETACH PARTITION {DEFAULT_PARTITION}")
+            cursor.execute(create, bounds)
+            cursor.execute(
+                f"INSERT INTO {name} ({COLUMNS}) SELECT {COLUMNS} FROM {DEFAULT_PARTITION} WHERE {in_range}", bounds
+            )
+            logger.info(f"Moved {cursor.rowcount} article hits from {DEFAULT_PARTITION} to {name}")
+            cursor.execute(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}", bounds)
+            cursor.execute(f"ALTER TABLE {parent} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+    logger.info(f"Created partition {name}")
+    return True
+
+
+def ensure_partitions(months_ahead: int = None, months_back: int = 0, today: date = None) -> List[str]:
+    """
+    Create the partitions from `months_back` months ago to `months_ahead` months after the current month.
+    Returns:
+        List[str]: The names of the partitions created.
+    """
+    if months_ahead is None:
+        months_ahead = settings.ARTICLE_HITS_PARTITION_MONTHS_AHEAD
+    current = (today or timezone.now().date()).replace(day=1)
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(-months_back, months_ahead + 1):
+            month = add_months(current, offset)
+            if create_partition(cursor, month):
+                created.append(partition_name(month))
+    return created
+
+
+def drop_expired(retention_months: int = None, detach_only: bool = False, today: date = None) -> List[str]:
+    """
+    Detach (and drop) the partitions whose whole month is older than the retention period.
+    Args:
+        retention_months (int): Months of hits kept, besides the current one. 0 keeps every partition.
+        detach_only (bool): Only detach the partitions, e.g. to archive them before dropping them by hand.
+        today (date): The current date (for tests).
+    Returns:
+        List[str]: The names of the partitions detached (or dropped).
+    """
+    if retention_months is None:
+        retention_months = settings.ARTICLE_HITS_RETENTION_MONTHS
+    if retention_months <= 0:
+        return []
+    oldest_kept = add_months((today or timezone.now().date()).replace(day=1), -retention_months)
+    expired = []
+    with connection.cursor() as cursor:
+        for name, month in list_partitions(cursor):
+            if month >= oldest_kept:
+                break
+            with transaction.atomic():
+                cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+                if not detach_only:
+                    cursor.execute(f"DROP TABLE {name}")
+            logger.info(f"{'Detached' if detach_only else 'Dropped'} expired partition {name}")
+            expired.append(name)
+    return expired
@@ -0,0 +1,172 @@
+"""
+Hourly and daily rollups of the article hits, so that analytics queries ("top articles this week", "clicks of a lead
+per day") read a few summary rows instead of scanning `form_articlehits`.
+
+The rollups are kept up to date by the ingestion path: every batch of hits stored by the click pipeline is added to
+`FeedHitRollup` and `LeadHitRollup` in the same transaction (see `record_hits`). Hits inserted by other means (e.g.
+`create_data.py --bulk`) are not counted until the `rebuild_rollups` management command is run.
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from ccbda.db_routers import use_primary
+
+from .models import ArticleHits, FeedHitRollup, HitRollup, LeadHitRollup
+
+logger = logging.getLogger("django")
+
+GRANULARITIES = (HitRollup.HOUR, HitRollup.DAY)
+TRUNCATE = {HitRollup.HOUR: TruncHour, HitRollup.DAY: TruncDay}
+
+
+def truncate(value: datetime, granularity: str) -> datetime:
+    "The start of the bucket (UTC) containing a datetime"
+    value = timezone.localtime(value, dt_timezone.utc)
+    if granularity == HitRollup.DAY:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def record_hits(hits: Iterable[ArticleHits], using: str = None):
+    """
+    Add new hits to the rollups, with one `INSERT ... ON CONFLICT DO UPDATE SET hits = hits + N` per rollup table.
+    It should run in the transaction that stores the hits, so the rollups never count hits that were rolled back.
+    Args:
+        hits (Iterable[ArticleHits]): The stored hits (only `feed_id`, `lead_id` and `timestamp` are used).
+        using (str): The database to write to (the router's choice if None).
+    """
+    feeds, leads = Counter(), Counter()
+    for hit in hits:
+        for granularity in GRANULARITIES:
+            bucket = truncate(hit.timestamp, granularity)
+            feeds[(granularity, bucket, hit.feed_id)] += 1
+            leads[(granularity, bucket, hit.lead_id)] += 1
+    _upsert(FeedHitRollup, "feed_id", feeds, using)
+    _upsert(LeadHitRollup, "lead_id", leads, using)
+
+
+def _upsert(model, column: str, counts: Counter, using: str = None):
+    if not counts:
+        return
+    connection = connections[using or router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    # Sorted, so concurrent workers lock the rollup rows in the same order and cannot deadlock
+    rows = sorted(counts.items())
+    sql = (
+        f"INSERT INTO {table} (granularity, bucket, {column}, hits) VALUES "
+        + ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+        + f" ON CONFLICT (granularity, bucket, {column}) DO UPDATE SET hits = {table}.hits + EXCLUDED.hits"
+    )
+    params = []
+    for (granularity, bucket, key), hits in rows:
+        params += [granularity, connection.ops.adapt_datetimefield_value(bucket), key, hits]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def rebuild(since: datetime = None) -> int:
+    """
+    Recompute the rollups from the raw hits, e.g. after loading hits without the click pipeline.
+    Args:
+        since (datetime): Only recompute the buckets from the start of this day (UTC). All of them if None.
+    Returns:
+        int: The number of rollup rows written.
+    """
+    hits = ArticleHits.objects.all()
+    if since is not None:
+        since = truncate(since, HitRollup.DAY)
+        hits = hits.filter(timestamp__gte=since)
+    written = 0
+    with transaction.atomic(), use_primary():
+        for model, column in ((FeedHitRollup, "feed_id"), (LeadHitRollup, "lead_id")):
+            stale = model.objects.all() if since is None else model.objects.filter(bucket__gte=since)
+            stale.delete()
+            for granularity in GRANULARITIES:
+                rows = (
+                    hits.annotate(bucket=TRUNCATE[granularity]("timestamp", tzinfo=dt_timezone.utc))
+                    .values("bucket", column)
+                    .annotate(hits=Count("id"))
+                    .order_by()
+                )
+                written += len(
+                    model.objects.bulk_create(
+                        (model(granularity=granularity, **row) for row in rows.iterator()), batch_size=1000
+                    )
+                )
+    logger.info(f"Rebuilt {written} rollup rows")
+    return written
+
+
+def _range(model, granularity: str, since: datetime, until: datetime = None):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown rollup granularity: {granularity}")
+    rows = model.objects.filter(granularity=granularity, bucket__gte=truncate(since, granularity))
+    if until is not None:
+        rows = rows.filter(bucket__lt=until)
+    return rows
+
+
+def top_feeds(since: datetime, until: datetime = None, limit: int = 10, granularity: str = HitRollup.DAY) -> List[dict]:
+    """
+    The most clicked articles in a period.
+    The period is rounded to whole buckets: `since` down to the start of its bucket, and `until` (excluded) up to the
+    end of its bucket. Use the hourly rollups for periods that do not start at midnight.
+    Args:
+        since (datetime): Start of the period.
+        until (datetime): End of the period (now if None).
+        limit (int): The number of articles.
+        granularity (str): The rollups to read ("hour" or "day").
+    Returns:
+        List[dict]: The articles (`feed_id`, `title` and `hits`), most clicked first.
+    """
+    rows = (
+        _range(FeedHitRollup, granularity, since, until)
+        .values("feed_id", "feed__title")
+        .annotate(total=Sum("hits"))
+        .order_by("-total", "feed_id")[:limit]
+    )
+    return [{"feed_id": r["feed_id"], "title": r["feed__title"], "hits": r["total"]} for r in rows]
+
+
+def hits_per_lead(
+    since: datetime, until: datetime = None, lead_ids: Iterable[int] = None, granularity: str = HitRollup.DAY
+) -> Dict[int, int]:
+    """
+    The number of clicks of each lead in a period (rounded to whole buckets, see `top_feeds`).
+    Args:
+        since (datetime): Start of the period.
+        until (datetime): End of the period (now if None).
+        lead_ids (Iterable[int]): Only these leads (all the leads with clicks if None).
+        granularity (str): The rollups to read ("hour" or "day").
+    Returns:
+        Dict[int, int]: A mapping lead id -> number of clicks, for the leads with clicks.
+    """
+    rows = _range(LeadHitRollup, granularity, since, until)
+    if lead_ids is not None:
+        rows = rows.filter(lead_id__in=list(lead_ids))
+    return dict(rows.values("lead_id").annotate(total=Sum("hits")).values_list("lead_id", "total"))
+
+
+def feed_timeseries(
+    feed_id: int, since: datetime, until: datetime = None, granularity: str = HitRollup.HOUR
+) -> List[Tuple[datetime, int]]:
+    """
+    The clicks of an article per hour or per day. Buckets without clicks are omitted.
+    Returns:
+        List[Tuple[datetime, int]]: (start of the bucket, number of clicks), in chronological order.
+    """
+    rows = _range(FeedHitRollup, granularity, since, until).filter(feed_id=feed_id).order_by("bucket")
+    return list(rows.values_list("bucket", "hits"))
+
+
+def last_days(days: int) -> datetime:
+    "The start of the period covering the last `days` days, today included"
+    return truncate(timezone.now(), HitRollup.DAY) - timedelta(days=days - 1)
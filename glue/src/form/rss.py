@@ -0,0 +1,197 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+from urllib.parse import urlencode, urljoin
+
+import feedparser
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.shortcuts import reverse
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from ccbda.db_routers import use_primary
+
+from .models import Feeds, FeedSource
+
+logger = logging.getLogger("django")
+
+# The identity of an article, as stored
+GUID_LENGTH = Feeds._meta.get_field("guid").max_length
+LINK_LENGTH = Feeds._meta.get_field("source_link").max_length
+
+
+class FetchResult(NamedTuple):
+    "The outcome of fetching one RSS feed"
+
+    url: str
+    entries: List[dict]
+    etag: str
+    last_modified: str
+    not_modified: bool = False
+    error: Optional[str] = None
+
+
+def hit_link(article_id: int, url: str) -> str:
+    """
+    Build the link that counts a click on an article before redirecting to `url`.
+    Args:
+        article_id (int): The id of the article (Feeds).
+        url (str): The final URL.
+    """
+    return urljoin(reverse("form:hit", kwargs={"id": article_id}), "?" + urlencode({"url": url}))
+
+
+class FeedIngestor:
+    """
+    Fetches the RSS feeds concurrently and stores the new articles.
+
+    - All the feeds are fetched in parallel by a thread pool sharing one pooled HTTP session, with a timeout.
+    - Conditional GETs (ETag / Last-Modified, stored in `FeedSource`) skip the feeds that have not changed.
+    - Entries are deduplicated by GUID and link, both within the run and against the articles already stored.
+    - New articles are inserted with one multi-row INSERT (plus one UPDATE for the links, which need the ids), in a
+        single transaction.
+    """
+
+    def __init__(self, urls: List[str] = None, workers: int = None, timeout: float = None, conditional: bool = True):
+        self.urls = urls if urls is not None else settings.RSS_URLS
+        self.workers = workers or settings.RSS_FETCH_WORKERS
+        self.timeout = timeout or settings.RSS_FETCH_TIMEOUT
+        self.conditional = conditional
+
+    def run(self) -> int:
+        """
+        Fetch all the feeds and store the new articles.
+        Returns:
+            int: The number of articles inserted.
+        """
+        sources = {s.url: s for s in FeedSource.objects.filter(url__in=self.urls)}
+        with requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=len(self.urls) or 1, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rss-fetch") as pool:
+                results = list(pool.map(lambda u: self._fetch(session, u, sources.get(u)), self.urls))
+
+        # The articles already stored are read from the primary: a lagging replica would let duplicates through
+        with transaction.atomic(), use_primary():
+            inserted = self._store([e for r in results if r.error is None for e in r.entries])
+            for r in results:
+                if r.error is None and not r.not_modified:
+                    FeedSource.objects.update_or_create(
+                        url=r.url,
+                        defaults={"etag": r.etag, "last_modified": r.last_modified, "fetched_at": timezone.now()},
+                    )
+        if inserted:
+            from .sampling import feed_sampler
+
+            feed_sampler.invalidate()
+        logger.info(f"RSS refresh: {inserted} new articles from {len(self.urls)} feeds")
+        return inserted
+
+    def _fetch(self, session: requests.Session, url: str, source: Optional[FeedSource]) -> FetchResult:
+        headers = {}
+        if self.conditional and source is not None:
+            if source.etag:
+                headers["If-None-Match"] = source.etag
+            if source.last_modified:
+                headers["If-Modified-Since"] = source.last_modified
+        try:
+            response = session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304:
+                logger.info(f"Feed not modified: {url}")
+                return FetchResult(url, [], "", "", not_modified=True)
+            response.raise_for_status()
+            feed = feedparser.parse(response.content)
+            entries = [
+                {
+                    "guid": entry.get("id") or entry.link,
+                    "link": entry.link,
+                    "title": entry.title,
+                    "author": entry.get("author", ""),
+                    "summary": entry.get("summary", ""),
+                }
+                for entry in feed.entries
+            ]
+            return FetchResult(
+                url, entries, response.headers.get("ETag", ""), response.headers.get("Last-Modified", "")
+            )
+        except Exception as e:
+            logger.error(f"Feed reading error ({url}): {e}")
+            return FetchResult(url, [], "", "", error=str(e))
+
+    def _store(self, entries: List[dict]) -> int:
+        # Compared as stored (truncated to the length of the columns), or long GUIDs and links would never match
+        entries = [
+            {**e, "guid_key": e["guid"][:GUID_LENGTH], "link_key": e["link"][:LINK_LENGTH]} for e in entries
+        ]
+        unique, guids, links = [], set(), set()
+        for entry in entries:
+            if entry["guid_key"] not in guids and entry["link_key"] not in links:
+                unique.append(entry)
+            guids.add(entry["guid_key"])
+            links.add(entry["link_key"])
+        if not unique:
+            return 0
+        existing = Feeds.objects.filter(
+            Q(guid__in=[e["guid_key"] for e in unique]) | Q(source_link__in=[e["link_key"] for e in unique])
+        ).values_list("guid", "source_link")
+        seen = {value for pair in existing for value in pair}
+        entries = [e for e in unique if e["guid_key"] not in seen and e["link_key"] not in seen]
+        if not entries:
+            return 0
+
+        articles = Feeds.objects.bulk_create(
+            [
+                Feeds(
+                    title=e["title"][:200],
+                    link="",
+                    summary="",
+                    author=e["author"][:120],
+                    guid=e["guid_key"],
+                    source_link=e["link_key"],
+                )
+                for e in entries
+            ]
+        )
+        # The links point to the hit view of the article, so they can only be built once the ids are known
+        for article, entry in zip(articles, entries):
+            article.link = hit_link(article.id, entry["link"])
+            summary = BeautifulSoup(entry["summary"], "html.parser")
+            for anchor in summary.find_all("a", href=True):
+                anchor["href"] = hit_link(article.id, anchor["href"])
+                anchor["target"] = "_blank"
+            article.summary = str(summary)
+            logger.info(f'Create article "{entry["title"]}"')
+        Feeds.objects.bulk_update(articles, ["link", "summary"], batch_size=500)
+        return len(articles)
+
+
+_background_lock = threading.Lock()
+
+
+def refresh_in_background() -> bool:
+    """
+    Run a `FeedIngestor` in a background thread, unless one is already running in this process.
+    Used when the home page finds no articles, so that a cold start does not block the request.
+    Returns:
+        bool: True if a refresh was started.
+    """
+    if not _background_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            FeedIngestor().run()
+        except Exception as e:
+            logger.error(f"Background RSS refresh failed: {e}")
+        finally:
+            connection.close()
+            _background_lock.release()
+
+    threading.Thread(target=run, name="rss-refresh", daemon=True).start()
+    return True
@@ -0,0 +1,130 @@
+import logging
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .models import Feeds
+
+logger = logging.getLogger("django")
+
+
+class FeedSampler:
+    """
+    Picks a random sample of feeds without `ORDER BY RANDOM()` over the whole `form_feeds` table (except as a last
+    resort when the ids are very sparse).
+
+    Two strategies are available, both normally only read the sampled rows through the primary key index:
+    - "range": the min and max feed ids are cached, random ids are drawn in that range (with some oversampling to
+        account for gaps left by deleted rows or sequence caching) and looked up by primary key. The draw is repeated,
+        with more oversampling, until the sample is full (at most `max_rounds` times, and with at most
+        `max_candidates` times k ids per draw); if the ids are too sparse for that, the rest of the sample is read
+        with `ORDER BY RANDOM()`.
+    - "ids": the full list of feed ids is cached, and the sample is drawn from it. Exact, but the list is kept in the
+        cache, so it is better suited to tables of up to a few hundred thousand feeds or with many gaps in the ids.
+
+    The cached ids/bounds are refreshed every `refresh_seconds`, so new feeds appear on the home page after at most
+    that time.
+    """
+
+    STRATEGIES = ("range", "ids")
+
+    def __init__(
+        self,
+        strategy: str = "range",
+        refresh_seconds: int = 300,
+        oversampling: float = 2.0,
+        max_rounds: int = 3,
+        max_candidates: int = 8,
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown feed sampling strategy: {strategy}")
+        self.strategy = strategy
+        self.refresh_seconds = refresh_seconds
+        self.oversampling = oversampling
+        self.max_rounds = max_rounds
+        self.max_candidates = max_candidates
+
+    def sample(self, k: int):
+        """
+        Get a random sample of feeds.
+        Args:
+            k (int): The number of feeds to sample.
+        Returns:
+            QuerySet: A lazy queryset with at most k random feeds. It is empty if there are no feeds.
+        """
+        if self.strategy == "ids":
+            ids = self._get_ids()
+            sample = random.sample(ids, min(k, len(ids)))
+            return Feeds.objects.filter(pk__in=sample)
+        low, high = self._get_bounds()
+        if high is None:
+            return Feeds.objects.none()
+        found = self._sample_range(k, low, high)
+        return Feeds.objects.filter(pk__in=found).order_by("?")
+
+    def _sample_range(self, k: int, low: int, high: int) -> set:
+        # Ids of up to k random existing feeds, see the "range" strategy
+        found, tried = set(), set()
+        oversampling = self.oversampling
+        for _ in range(self.max_rounds):
+            untried = high - low + 1 - len(tried)
+            if untried <= 0:
+                return found
+            wanted = int((k - len(found)) * oversampling) + 1
+            if wanted > max(k, 1) * self.max_candidates:
+                break
+            size = min(wanted, untried)
+            candidates = set()
+            while len(candidates) < size:
+                candidate = random.randint(low, high)
+                if candidate not in tried:
+                    candidates.add(candidate)
+            tried |= candidates
+            hits = set(Feeds.objects.filter(pk__in=candidates).values_list("id", flat=True))
+            found |= set(random.sample(sorted(hits), min(len(hits), k - len(found))))
+            if len(found) >= k:
+                return found
+            # Draw enough candidates for the density of existing ids seen so far
+            oversampling = max(oversampling, 2 * len(tried) / max(len(found), 1))
+        # Very sparse ids: the rest of the sample is drawn by sorting the remaining feeds
+        missing = k - len(found)
+        found.update(Feeds.objects.exclude(pk__in=found).order_by("?").values_list("id", flat=True)[:missing])
+        logger.info(f"Sparse feed ids: sample completed with ORDER BY RANDOM() ({len(found)} feeds)")
+        return found
+
+    def is_empty(self) -> bool:
+        """
+        Check whether there are feeds to sample from, using the cached ids/bounds.
+        """
+        if self.strategy == "ids":
+            return len(self._get_ids()) == 0
+        return self._get_bounds()[1] is None
+
+    def invalidate(self):
+        """
+        Forget the cached ids/bounds, e.g. after new feeds have been inserted.
+        """
+        cache.delete_many(["form:feed_ids", "form:feed_id_bounds"])
+
+    def _get_ids(self):
+        ids = cache.get("form:feed_ids")
+        if ids is None:
+            ids = list(Feeds.objects.values_list("id", flat=True))
+            logger.info(f"Refreshed feed id list ({len(ids)} feeds)")
+            if ids:
+                cache.set("form:feed_ids", ids, self.refresh_seconds)
+        return ids
+
+    def _get_bounds(self):
+        bounds = cache.get("form:feed_id_bounds")
+        if bounds is None:
+            res = Feeds.objects.aggregate(low=Min("id"), high=Max("id"))
+            bounds = (res["low"], res["high"])
+            if bounds[1] is not None:
+                cache.set("form:feed_id_bounds", bounds, self.refresh_seconds)
+        return bounds
+
+
+feed_sampler = FeedSampler(strategy=settings.FEED_SAMPLE_STRATEGY, refresh_seconds=settings.FEED_SAMPLE_REFRESH_SECONDS)
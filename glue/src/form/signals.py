@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Leads, lead_id_cache
+
+
+@receiver(post_save, sender=Leads)
+@receiver(post_delete, sender=Leads)
+def invalidate_lead_cache(sender, instance, **kwargs):
+    "Forget the cached lead id of this email (e.g. a click cached as anonymous just before the signup)"
+    if instance.email_normalized:
+        lead_id_cache.invalidate(instance.email_normalized)
@@ -1,3 +1,506 @@
-from django.test import TestCase
+"""
+Tests of the form app. They run on SQLite (see DJANGO_SQLITE in ccbda/settings.py):
 
-# Create your tests here.
+    DJANGO_SQLITE=True DJANGO_SECRET_KEY=test python manage.py test form
+"""
+
+import importlib
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import mock, skipIf, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from ccbda.db_routers import PRIMARY, REPLICA, STICKY_COOKIE, ReadYourWritesMiddleware, use_primary
+
+from . import partitions, rollups
+from .cache import get_or_compute
+from .clicks import ClickEvent, ClickPipeline
+from .counters import HitCounter
+from .models import (
+    ArticleHits,
+    FeedHitRollup,
+    Feeds,
+    FeedSource,
+    HitRollup,
+    LeadHitRollup,
+    Leads,
+    feed_link_cache,
+    lead_id_cache,
+)
+from .rss import GUID_LENGTH, FeedIngestor, FetchResult
+from .sampling import FeedSampler
+
+
+class CacheClearingTestCase(TestCase):
+    "Clears the per-worker caches, which outlive the rolled back transaction of each test"
+
+    def setUp(self):
+        lead_id_cache.clear()
+        feed_link_cache.clear()
+
+
+@override_settings(DATABASE_ROUTERS=["ccbda.db_routers.PrimaryReplicaRouter"])
+class PrimaryReplicaRouterTest(CacheClearingTestCase):
+    "The replica is a second SQLite database, which only gets the rows written to it explicitly (no replication)"
+
+    databases = {PRIMARY, REPLICA}
+
+    def setUp(self):
+        super().setUp()
+        self.lead = Leads.objects.create(name="Ada", email="ada@example.com")
+
+    def test_writes_go_to_the_primary_and_reads_to_the_replica(self):
+        self.assertEqual(router.db_for_write(Leads), PRIMARY)
+        self.assertEqual(router.db_for_read(Leads), REPLICA)
+        self.assertTrue(Leads.objects.using(PRIMARY).filter(pk=self.lead.pk).exists())
+        # Not replicated yet
+        self.assertIsNone(Leads.get_lead_by_email("ada@example.com"))
+
+    def test_use_primary_reads_from_the_primary(self):
+        with use_primary():
+            self.assertEqual(router.db_for_read(Leads), PRIMARY)
+            self.assertEqual(Leads.get_lead_by_email("ADA@example.com"), self.lead)
+        self.assertEqual(router.db_for_read(Leads), REPLICA)
+
+    def test_unsafe_requests_read_the_primary_and_pin_the_browser(self):
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(Leads))
+            return HttpResponse()
+
+        middleware = ReadYourWritesMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.post("/signup"))
+        self.assertEqual(reads, [PRIMARY])
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        middleware(factory.get("/"))
+        sticky = factory.get("/")
+        sticky.COOKIES[STICKY_COOKIE] = "1"
+        middleware(sticky)
+        self.assertEqual(reads, [PRIMARY, REPLICA, PRIMARY])
+
+    def test_clicks_of_new_leads_are_resolved_on_the_primary(self):
+        feed = Feeds.objects.create(title="News", link="https://example.com", summary="", author="")
+        ClickPipeline()._write([ClickEvent("ada@example.com", feed.pk, timezone.now())])
+        self.assertEqual(ArticleHits.objects.using(PRIMARY).filter(lead=self.lead, feed=feed).count(), 1)
+
+
+class HitCounterTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.feeds = [Feeds.objects.create(title=f"News {i}", link="", summary="", author="") for i in range(2)]
+
+    def hits(self):
+        return [feed.hits for feed in Feeds.objects.order_by("id")]
+
+    def test_atomic_mode_increments_in_the_transaction(self):
+        HitCounter("atomic").record({self.feeds[1].pk: 2, self.feeds[0].pk: 1})
+        self.assertEqual(self.hits(), [1, 2])
+
+    @mock.patch.object(HitCounter, "_ensure_started")  # Flushed by the test, not by the background thread
+    def test_buffered_mode_counts_the_committed_clicks_at_the_next_flush(self, ensure_started):
+        counter = HitCounter("buffered")
+        with self.captureOnCommitCallbacks(execute=True):
+            counter.record({self.feeds[0].pk: 3})
+            self.assertEqual(self.hits(), [0, 0])
+        self.assertEqual(self.hits(), [0, 0])
+        self.assertEqual(counter.flush(), 1)
+        self.assertEqual(self.hits(), [3, 0])
+        self.assertEqual(counter.flush(), 0)
+
+    @mock.patch.object(HitCounter, "_ensure_started")
+    def test_buffered_mode_ignores_the_rolled_back_clicks(self, ensure_started):
+        counter = HitCounter("buffered")
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    counter.record({self.feeds[0].pk: 3})
+                    raise RuntimeError("Batch not stored")
+            except RuntimeError:
+                pass
+        self.assertEqual(counter.flush(), 0)
+
+    @mock.patch.object(HitCounter, "_ensure_started")
+    def test_failed_flush_keeps_the_increments(self, ensure_started):
+        counter = HitCounter("buffered")
+        counter._buffer({self.feeds[0].pk: 2})
+        with mock.patch.object(Feeds, "increment_hits", side_effect=RuntimeError("Connection lost")):
+            self.assertEqual(counter.flush(), 0)
+        counter._buffer({self.feeds[0].pk: 1})
+        self.assertEqual(counter.flush(), 1)
+        self.assertEqual(self.hits(), [3, 0])
+
+
+@mock.patch.object(ClickPipeline, "_ensure_started")  # No writer thread: the queue is only drained by the tests
+class ClickPipelineTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lead = Leads.objects.create(name="Ada", email="ada@example.com")
+        self.feed = Feeds.objects.create(title="News", link="", summary="", author="")
+
+    def pipeline(self, **kwargs) -> ClickPipeline:
+        return ClickPipeline(**{"queue_size": 1, "block_timeout_ms": 10, "retry_delay_ms": 0, **kwargs})
+
+    def test_full_queue_drops_clicks(self, ensure_started):
+        for backpressure in ("drop", "block"):
+            pipeline = self.pipeline(backpressure=backpressure)
+            self.assertTrue(pipeline.submit("ada@example.com", self.feed.pk))
+            self.assertFalse(pipeline.submit("ada@example.com", self.feed.pk))
+            self.assertFalse(async_to_sync(pipeline.asubmit)("ada@example.com", self.feed.pk))
+            self.assertEqual(pipeline.stats(), {"written": 0, "dropped": 2, "retried": 0, "queued": 1})
+
+    def test_full_queue_writes_inline(self, ensure_started):
+        pipeline = self.pipeline(backpressure="inline")
+        pipeline.submit("ada@example.com", self.feed.pk)
+        self.assertTrue(pipeline.submit("ada@example.com", self.feed.pk))
+        self.assertEqual(ArticleHits.objects.count(), 1)
+        self.assertEqual(pipeline.stats(), {"written": 1, "dropped": 0, "retried": 0, "queued": 1})
+
+    def test_batches_are_stored_and_counted(self, ensure_started):
+        pipeline = self.pipeline(queue_size=10, counter=HitCounter("atomic"))
+        now = timezone.now()
+        events = [
+            ClickEvent("ADA@example.com", self.feed.pk, now),
+            ClickEvent(None, self.feed.pk, now),  # Anonymous: only counted
+            ClickEvent("unknown@example.com", self.feed.pk, now),
+            ClickEvent("ada@example.com", self.feed.pk + 1, now),  # Unknown feed: ignored
+        ]
+        self.assertTrue(pipeline._write(events))
+        self.assertEqual(list(ArticleHits.objects.values_list("lead_id", "feed_id")), [(self.lead.pk, self.feed.pk)])
+        self.assertEqual(Feeds.objects.get(pk=self.feed.pk).hits, 3)
+        self.assertEqual(pipeline.stats()["written"], 1)
+
+    @mock.patch("form.clicks.close_old_connections")  # It would close the connection of the test transaction
+    def test_failed_batches_are_retried_once(self, close_old_connections, ensure_started):
+        pipeline = self.pipeline()
+        events = [ClickEvent("ada@example.com", self.feed.pk, timezone.now())]
+        store, attempts = pipeline._store, []
+
+        def fail_once(events):
+            attempts.append(events)
+            if len(attempts) == 1:
+                raise RuntimeError("Connection lost")
+            store(events)
+
+        with mock.patch.object(pipeline, "_store", side_effect=fail_once):
+            self.assertTrue(pipeline._write(events))
+        self.assertEqual(ArticleHits.objects.count(), 1)
+        with mock.patch.object(pipeline, "_store", side_effect=RuntimeError("Connection lost")):
+            self.assertFalse(pipeline._write(events))
+            # Not retried in a request
+            self.assertFalse(pipeline._write(events, retry=False))
+        self.assertEqual(pipeline.stats(), {"written": 1, "dropped": 2, "retried": 2, "queued": 0})
+
+
+class FeedSamplerTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        FeedSampler().invalidate()
+        self.addCleanup(FeedSampler().invalidate)
+        feeds = [Feeds.objects.create(title=f"News {i}", link="", summary="", author="") for i in range(30)]
+        # Gaps in the ids, as left by deleted feeds
+        Feeds.objects.filter(pk__in=[feed.pk for feed in feeds[5:20]]).delete()
+        self.ids = set(Feeds.objects.values_list("id", flat=True))
+
+    def test_samples_are_distinct_existing_feeds(self):
+        for strategy in FeedSampler.STRATEGIES:
+            sampler = FeedSampler(strategy=strategy)
+            for _ in range(20):
+                ids = [feed.pk for feed in sampler.sample(10)]
+                self.assertEqual(len(ids), 10)
+                self.assertEqual(len(set(ids)), 10)
+                self.assertLessEqual(set(ids), self.ids)
+            self.assertEqual({feed.pk for feed in sampler.sample(100)}, self.ids)
+
+    def test_sparse_ids_are_completed_in_random_order(self):
+        sampler = FeedSampler(max_candidates=4)
+        low = min(self.ids)
+        with self.assertNumQueries(2):
+            found = sampler._sample_range(10, low, low + 10**9)
+        self.assertEqual(len(found), 10)
+        self.assertLessEqual(found, self.ids)
+
+    def test_no_feeds(self):
+        Feeds.objects.all().delete()
+        for strategy in FeedSampler.STRATEGIES:
+            sampler = FeedSampler(strategy=strategy)
+            sampler.invalidate()
+            self.assertTrue(sampler.is_empty())
+            self.assertEqual(list(sampler.sample(10)), [])
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            FeedSampler(strategy="random")
+
+
+class FeedIngestorTest(CacheClearingTestCase):
+    def entry(self, guid: str, link: str = None, **fields) -> dict:
+        link = link or f"https://example.com/{guid}"
+        return {"guid": guid, "link": link, "title": guid, "author": "", "summary": "", **fields}
+
+    def test_new_articles_are_stored_with_hit_links(self):
+        summary = '<p>See <a href="https://example.com/more">more</a></p>'
+        self.assertEqual(FeedIngestor(urls=[])._store([self.entry("a", summary=summary)]), 1)
+        article = Feeds.objects.get(guid="a")
+        self.assertEqual(article.source_link, "https://example.com/a")
+        self.assertEqual(article.link, f"/hit/{article.pk}?url=https%3A%2F%2Fexample.com%2Fa")
+        self.assertIn(f'href="/hit/{article.pk}?url=https%3A%2F%2Fexample.com%2Fmore"', article.summary)
+
+    def test_entries_are_deduplicated_by_guid_and_link(self):
+        long_guid = "g" * (GUID_LENGTH + 10)
+        entries = [
+            self.entry("a"),
+            self.entry("a", link="https://example.com/other"),  # Same GUID
+            self.entry("b", link="https://example.com/a"),  # Same link
+            self.entry(long_guid, link="https://example.com/long"),
+            self.entry(long_guid[:GUID_LENGTH] + "x", link="https://example.com/long2"),  # Same GUID once stored
+        ]
+        ingestor = FeedIngestor(urls=[])
+        self.assertEqual(ingestor._store(entries), 2)
+        self.assertEqual(ingestor._store(entries), 0)
+        self.assertEqual(ingestor._store([self.entry("c", link="https://example.com/a")]), 0)
+        self.assertEqual(Feeds.objects.count(), 2)
+
+    def test_run_stores_the_validators_of_the_fetched_feeds(self):
+        results = {
+            "https://example.com/rss": FetchResult("https://example.com/rss", [self.entry("a")], '"v1"', ""),
+            "https://example.com/down": FetchResult("https://example.com/down", [], "", "", error="Timeout"),
+        }
+        with mock.patch.object(FeedIngestor, "_fetch", side_effect=lambda session, url, source: results[url]):
+            self.assertEqual(FeedIngestor(urls=list(results)).run(), 1)
+        self.assertEqual(list(FeedSource.objects.values_list("url", "etag")), [("https://example.com/rss", '"v1"')])
+
+    def test_fetch_is_conditional(self):
+        source = FeedSource(url="https://example.com/rss", etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+        session = mock.Mock()
+        session.get.return_value.status_code = 304
+        result = FeedIngestor(urls=[], timeout=1)._fetch(session, source.url, source)
+        self.assertTrue(result.not_modified)
+        self.assertIsNone(result.error)
+        headers = session.get.call_args.kwargs["headers"]
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+
+class LeadEmailTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lead = Leads.objects.create(name="Ada", email=" Ada@Example.com")
+
+    def test_normalized_email_is_unique(self):
+        self.assertEqual(self.lead.email_normalized, "ada@example.com")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Leads.objects.create(name="Ada", email="ADA@example.com ")
+
+    def test_backfill_keys_the_oldest_lead_of_each_email(self):
+        Leads.objects.bulk_create([Leads(name="Copy", email="ada@example.com"), Leads(name="Bob", email="bob@x.com")])
+        Leads.objects.update(email_normalized=None)
+        migration = importlib.import_module("form.migrations.0004_leads_email_normalized")
+        migration.backfill_email_normalized(apps, SimpleNamespace(connection=connection))
+        keys = list(Leads.objects.order_by("id").values_list("name", "email_normalized"))
+        self.assertEqual(keys, [("Ada", "ada@example.com"), ("Copy", None), ("Bob", "bob@x.com")])
+        # The duplicate can still be saved, without the key
+        copy = Leads.objects.get(name="Copy")
+        copy.save()
+        self.assertIsNone(copy.email_normalized)
+
+    def test_lead_ids_are_cached(self):
+        self.assertEqual(Leads.get_lead_id_by_email("ada@example.COM"), self.lead.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(Leads.get_lead_id_by_email("ADA@example.com"), self.lead.pk)
+            self.assertIsNone(Leads.get_lead_id_by_email(""))
+        self.assertIsNone(Leads.get_lead_id_by_email("bob@example.com"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(Leads.get_lead_id_by_email("bob@example.com"))
+        # The signup forgets the cached miss
+        bob = Leads.objects.create(name="Bob", email="bob@example.com")
+        self.assertEqual(Leads.get_lead_id_by_email("bob@example.com"), bob.pk)
+
+    def test_primary_lookups_ignore_the_cached_misses(self):
+        self.assertIsNone(Leads.get_lead_id_by_email("bob@example.com"))
+        # Inserted by another worker, whose signal does not reach this process' cache
+        (bob,) = Leads.objects.bulk_create([Leads(name="Bob", email="bob@x.com", email_normalized="bob@example.com")])
+        self.assertIsNone(Leads.get_lead_id_by_email("bob@example.com"))
+        self.assertEqual(Leads.get_lead_id_by_email("bob@example.com", using=PRIMARY), bob.pk)
+
+    def test_signing_up_twice_is_a_conflict(self):
+        data = {"name": "Bob", "email": "bob@example.com", "previewAccess": "No"}
+        self.assertEqual(self.client.post(reverse("form:signup"), data).status_code, 200)
+        self.assertEqual(self.client.post(reverse("form:signup"), data).status_code, 409)
+        # Also when the other signup is not visible yet when checking
+        with mock.patch.object(Leads, "get_lead_id_by_email", return_value=None):
+            self.assertEqual(self.client.post(reverse("form:signup"), data).status_code, 409)
+        self.assertEqual(Leads.objects.filter(email="bob@example.com").count(), 1)
+
+
+class RollupsTest(CacheClearingTestCase):
+    databases = {PRIMARY, REPLICA}
+
+    def setUp(self):
+        super().setUp()
+        self.leads = [Leads.objects.create(name=name, email=f"{name}@example.com") for name in ("ada", "bob")]
+        self.feeds = [Feeds.objects.create(title=f"News {i}", link="", summary="", author="") for i in range(2)]
+        self.day = datetime(2025, 5, 20, tzinfo=dt_timezone.utc)
+
+    def hits(self, *clicks) -> list:
+        "Store (lead index, feed index, hours after the start of the day) clicks, as the click pipeline does"
+        hits = ArticleHits.objects.bulk_create(
+            ArticleHits(lead=self.leads[lead], feed=self.feeds[feed], timestamp=self.day + timedelta(hours=hours))
+            for lead, feed, hours in clicks
+        )
+        rollups.record_hits(hits)
+        return hits
+
+    def rows(self, model, column: str) -> set:
+        return set(model.objects.values_list("granularity", "bucket", column, "hits"))
+
+    def test_hits_are_added_to_the_buckets(self):
+        self.hits((0, 0, 1.5), (1, 0, 1.2), (0, 1, 5))
+        self.hits((0, 0, 1.9), (0, 0, 26))
+        feed_id = self.feeds[0].pk
+        self.assertEqual(
+            {row for row in self.rows(FeedHitRollup, "feed_id") if row[2] == feed_id},
+            {
+                (HitRollup.HOUR, self.day + timedelta(hours=1), feed_id, 3),
+                (HitRollup.HOUR, self.day + timedelta(hours=26), feed_id, 1),
+                (HitRollup.DAY, self.day, feed_id, 3),
+                (HitRollup.DAY, self.day + timedelta(days=1), feed_id, 1),
+            },
+        )
+        self.assertEqual(rollups.hits_per_lead(self.day), {self.leads[0].pk: 4, self.leads[1].pk: 1})
+        first_day = rollups.hits_per_lead(self.day, self.day + timedelta(days=1))
+        self.assertEqual(first_day, {self.leads[0].pk: 3, self.leads[1].pk: 1})
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        self.hits((0, 0, 1.5), (1, 0, 1.2), (0, 1, 5), (1, 1, 30))
+        incremental = self.rows(FeedHitRollup, "feed_id"), self.rows(LeadHitRollup, "lead_id")
+        self.assertEqual(rollups.rebuild(), len(incremental[0]) + len(incremental[1]))
+        self.assertEqual((self.rows(FeedHitRollup, "feed_id"), self.rows(LeadHitRollup, "lead_id")), incremental)
+        # Only the buckets from the start of the day of `since`
+        rollups.rebuild(since=self.day + timedelta(days=1, hours=12))
+        self.assertEqual((self.rows(FeedHitRollup, "feed_id"), self.rows(LeadHitRollup, "lead_id")), incremental)
+
+    def test_analytics_queries(self):
+        self.hits((0, 0, 1), (1, 0, 2), (0, 1, 3), (0, 1, 4), (1, 1, 5))
+        top = rollups.top_feeds(self.day, limit=1)
+        self.assertEqual(top, [{"feed_id": self.feeds[1].pk, "title": "News 1", "hits": 3}])
+        timeseries = rollups.feed_timeseries(self.feeds[1].pk, self.day)
+        self.assertEqual(timeseries, [(self.day + timedelta(hours=hours), 1) for hours in (3, 4, 5)])
+        with self.assertRaises(ValueError):
+            rollups.top_feeds(self.day, granularity="week")
+
+    def test_upserts_go_to_the_write_database(self):
+        hit = ArticleHits.objects.create(lead=self.leads[0], feed=self.feeds[0], timestamp=self.day)
+        for model in (Leads, Feeds):
+            model.objects.using(REPLICA).bulk_create(model.objects.all())
+        with mock.patch.object(router, "db_for_write", return_value=REPLICA):
+            rollups.record_hits([hit])
+        self.assertFalse(FeedHitRollup.objects.using(PRIMARY).exists())
+        self.assertEqual(FeedHitRollup.objects.using(REPLICA).count(), 2)
+
+
+class PartitionHelpersTest(TestCase):
+    def test_months(self):
+        self.assertEqual(partitions.add_months(date(2025, 1, 31), 1), date(2025, 2, 1))
+        self.assertEqual(partitions.add_months(date(2025, 1, 15), -1), date(2024, 12, 1))
+        self.assertEqual(partitions.add_months(date(2025, 11, 2), 14), date(2027, 1, 1))
+        self.assertEqual(partitions.partition_name(date(2025, 3, 9)), "form_articlehits_p2025_03")
+
+    @skipIf(connection.vendor == "postgresql", "The table is partitioned on PostgreSQL")
+    def test_other_databases_are_not_partitioned(self):
+        self.assertFalse(partitions.is_partitioned())
+        self.assertEqual(partitions.drop_expired(retention_months=0), [])
+        with self.assertRaises(CommandError):
+            call_command("manage_partitions")
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitions need PostgreSQL")
+class PartitionsTest(CacheClearingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lead = Leads.objects.create(name="Ada", email="ada@example.com")
+        self.feed = Feeds.objects.create(title="News", link="", summary="", author="")
+        self.today = date(2031, 6, 15)  # No partition yet in the test database
+
+    def partitions(self) -> list:
+        with connection.cursor() as cursor:
+            return [name for name, _ in partitions.list_partitions(cursor) if name >= "form_articlehits_p2031"]
+
+    def test_partitions_are_created_ahead(self):
+        created = partitions.ensure_partitions(months_ahead=1, months_back=1, today=self.today)
+        expected = ["form_articlehits_p2031_05", "form_articlehits_p2031_06", "form_articlehits_p2031_07"]
+        self.assertEqual(created, expected)
+        self.assertEqual(self.partitions(), expected)
+        self.assertEqual(partitions.ensure_partitions(months_ahead=1, months_back=1, today=self.today), [])
+
+    def test_hits_of_the_default_partition_are_moved(self):
+        timestamp = datetime(2031, 6, 2, tzinfo=dt_timezone.utc)
+        hit = ArticleHits.objects.create(lead=self.lead, feed=self.feed, timestamp=timestamp)
+        partitions.ensure_partitions(months_ahead=0, today=self.today)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM form_articlehits_p2031_06")
+            self.assertEqual(cursor.fetchall(), [(hit.pk,)])
+            cursor.execute(f"SELECT count(*) FROM {partitions.DEFAULT_PARTITION} WHERE id = %s", [hit.pk])
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_expired_partitions_are_dropped(self):
+        partitions.ensure_partitions(months_ahead=0, months_back=3, today=self.today)
+        dropped = partitions.drop_expired(retention_months=2, today=self.today)
+        self.assertIn("form_articlehits_p2031_03", dropped)
+        self.assertNotIn("form_articlehits_p2031_04", dropped)
+        self.assertEqual(self.partitions()[0], "form_articlehits_p2031_04")
+
+
+class GetOrComputeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.computed = []
+
+    def compute(self):
+        self.computed.append(len(self.computed) + 1)
+        return self.computed[-1]
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), 1)
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), 1)
+        self.assertEqual(self.computed, [1])
+        self.assertIsNone(cache.get("key:lock"))
+
+    def test_stale_value_is_served_while_another_caller_recomputes_it(self):
+        cache.set("key", ("stale", time.time() - 1), 60)
+        cache.add("key:lock", 1, 10)
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), "stale")
+        self.assertEqual(self.computed, [])
+        cache.delete("key:lock")
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), 1)
+
+    def test_cold_cache_waits_for_the_caller_computing_it(self):
+        cache.add("key:lock", 1, 10)
+        other = threading.Timer(0.1, lambda: cache.set("key", ("computed", time.time() + 60), 60))
+        other.start()
+        self.addCleanup(other.join)
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), "computed")
+        self.assertEqual(self.computed, [])
+
+    def test_cold_cache_is_computed_after_the_lock_timeout(self):
+        cache.add("key:lock", 1, 10)
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60, lock_timeout=0.1), 1)
+
+    def test_lock_is_released_when_the_computation_fails(self):
+        with self.assertRaises(RuntimeError):
+            get_or_compute("key", mock.Mock(side_effect=RuntimeError("Database down")), ttl=60)
+        self.assertIsNone(cache.get("key:lock"))
+        self.assertEqual(get_or_compute("key", self.compute, ttl=60), 1)
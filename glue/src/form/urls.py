@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 app_name = "form"
 
+# The async views only under ASGI, see form/views.py
+ASYNC_VIEWS = settings.SERVER_MODE == "asgi"
+
 urlpatterns = [
     path("", views.home, name="home"),
-    path("signup", views.signup, name="signup"),
-    path("hit/<int:id>", views.hit, name="hit"),
+    path("signup", views.asignup if ASYNC_VIEWS else views.signup, name="signup"),
+    path("hit/<int:id>", views.ahit if ASYNC_VIEWS else views.hit, name="hit"),
 ]
@@ -2,29 +2,86 @@ import datetime
 import logging
 from urllib.parse import parse_qs, urlparse
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import IntegrityError
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.views.generic.base import HttpResponseRedirect
 
-from .models import ArticleHits, Feeds, Leads
+from ccbda.db_routers import PRIMARY
+
+from .cache import get_or_compute
+from .clicks import click_pipeline
+from .models import Feeds, Leads
+from .rss import refresh_in_background
+from .sampling import feed_sampler
 
 logger = logging.getLogger("django")
 
+FEEDS_CACHE_KEY = "form:home_feeds"
+
 
 def home(request):
-    if Feeds.objects.all().count() == 0:
-        Feeds().refresh_data()
-    feeds = Feeds.objects.all().order_by("?")[:14]
-    return render(request, "form/index.html", {"feeds": feeds, "email": request.COOKIES.get("email", "")})
+    email = request.COOKIES.get("email", "")
+    # The feed block only depends on whether the visitor has signed up (it is shown or hidden)
+    variant = "lead" if email else "anon"
+
+    def render_feeds():
+        return render_to_string("form/feeds.html", {"feeds": feed_sampler.sample(14), "email": email})
+
+    if feed_sampler.is_empty():
+        # Cold start: fetch the articles without blocking the request (they show up on a later page view)
+        refresh_in_background()
+        feeds_html = render_feeds()
+    else:
+        feeds_html = get_or_compute(
+            f"{FEEDS_CACHE_KEY}:{variant}",
+            render_feeds,
+            ttl=settings.FEED_FRAGMENT_CACHE_SECONDS,
+            stale_ttl=settings.FEED_FRAGMENT_STALE_SECONDS,
+        )
+    return render(request, "form/index.html", {"feeds_html": mark_safe(feeds_html), "email": email})
+
+
+# `signup` and `hit` have a sync version, served by the WSGI workers, and an async one (`asignup` and `ahit`), served
+# by the ASGI workers (see form/urls.py): Django runs an async view under WSGI in a new event loop for every request.
 
 
 def signup(request):
-    leads = Leads()
-    lead = leads.insert_lead(request.POST["name"], request.POST["email"], request.POST["previewAccess"] == "Yes")
-    if lead is None:
-        status = 500
+    # Checked on the primary (and not with the cached misses): the lead may have just signed up from another worker
+    if Leads.get_lead_id_by_email(request.POST["email"], using=PRIMARY) is not None:
+        # Already signed up, the page shows the "you're already on the list" message
+        status = 409
     else:
-        status = 200
+        try:
+            lead = Leads.insert_lead(
+                request.POST["name"], request.POST["email"], request.POST["previewAccess"] == "Yes"
+            )
+            status = 500 if lead is None else 200
+        except IntegrityError:
+            # Signed up concurrently, after the check
+            status = 409
+    return _signup_response(request, status)
+
+
+async def asignup(request):
+    "Async version of `signup`"
+    if await Leads.aget_lead_id_by_email(request.POST["email"], using=PRIMARY) is not None:
+        status = 409
+    else:
+        try:
+            lead = await Leads.ainsert_lead(
+                request.POST["name"], request.POST["email"], request.POST["previewAccess"] == "Yes"
+            )
+            status = 500 if lead is None else 200
+        except IntegrityError:
+            status = 409
+    return _signup_response(request, status)
+
+
+def _signup_response(request, status: int) -> HttpResponse:
     response = HttpResponse("", status=status)
     expiry_date = datetime.datetime.utcnow() + datetime.timedelta(weeks=520)
     response.set_cookie("email", request.POST["email"], expires=expiry_date)
@@ -32,13 +89,24 @@ def signup(request):
 
 
 def hit(request, id):
-    article = Feeds.objects.get(pk=id)
-    article.hits += 1
-    article.save()
-    lead = Leads.get_lead_by_email(request.COOKIES.get("email"))
-    if lead is not None:
-        ArticleHits.create_hit(lead, article)
-    url_article = parse_qs(urlparse(article.link).query).get("url", ["--missing--"])[0]
+    # The click is counted and stored in the background (see form.clicks), the redirect does not wait for the database
+    link = Feeds.get_link(id)
+    if link is None:
+        raise Http404(f"Feed {id} not found")
+    click_pipeline.submit(request.COOKIES.get("email"), id)
+    return _hit_response(request, link)
+
+
+async def ahit(request, id):
+    "Async version of `hit`"
+    link = await Feeds.aget_link(id)
+    if link is None:
+        raise Http404(f"Feed {id} not found")
+    await click_pipeline.asubmit(request.COOKIES.get("email"), id)
+    return _hit_response(request, link)
+
+
+def _hit_response(request, link: str) -> HttpResponseRedirect:
+    url_article = parse_qs(urlparse(link).query).get("url", ["--missing--"])[0]
     logger.info("", {"user": request.COOKIES.get("email"), "article": url_article})
     return HttpResponseRedirect(redirect_to=request.GET.get("url", "#"))
-
@@ -0,0 +1,24 @@
+"""
+Gunicorn configuration (`gunicorn --config gunicorn.conf.py`).
+
+SERVER_MODE selects how the Django app is served:
+- "wsgi" (default): synchronous workers, each one handling a single request at a time.
+- "asgi": Uvicorn workers running an event loop, so each worker handles many concurrent requests while the async
+    views (`ahit`, `asignup`, used instead of `hit` and `signup` in this mode) wait for the database.
+"""
+
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "wsgi")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", 3))
+timeout = 120
+
+if SERVER_MODE == "asgi":
+    wsgi_app = "ccbda.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+elif SERVER_MODE == "wsgi":
+    wsgi_app = "ccbda.wsgi:application"
+else:
+    raise ValueError(f"Unknown SERVER_MODE: {SERVER_MODE}")
@@ -0,0 +1,91 @@
+"""
+Tests of the watermark of etl_incremental.py, without a database: the extraction is emulated on in-memory rows.
+
+    cd glue && python -m pytest test_etl_incremental.py
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import etl_incremental
+from etl_incremental import HITS_SCHEMA, commit_partitions, extraction_since, load_state, partition_path, update
+
+LATE_WINDOW = timedelta(hours=48)
+DAY = datetime(2025, 5, 20)
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, "daily_hits")
+        self.state_path = os.path.join(self.tmp.name, "etl_state.json")
+        self.dimension = pa.table({"lead_id": [1], "email": ["a@example.com"], "country": ["Spain"]})
+        self.rows = []  # The committed rows of form_articlehits: (id, timestamp, feed_id, lead_id)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def insert(self, hit_id, minutes, feed_id=10):
+        self.rows.append((hit_id, DAY + timedelta(minutes=minutes), feed_id, 1))
+
+    def run_etl(self) -> int:
+        "A run of main(), with the rows the extraction query would return"
+        state = load_state(self.state_path)
+        commit_partitions(self.output, self.state_path, state)
+        since = extraction_since(state, LATE_WINDOW)
+        rows = [row for row in self.rows if since is None or row[1] >= since.replace(tzinfo=None)]
+        batch = pa.RecordBatch.from_arrays([pa.array(column) for column in zip(*rows)], schema=HITS_SCHEMA)
+        return update([batch], self.dimension, state, self.state_path, self.output, LATE_WINDOW)
+
+    def hits(self) -> dict:
+        table = pq.read_table(partition_path(self.output, "2025-05-20"))
+        return {row["feed_id"]: row["hits"] for row in table.to_pylist()}
+
+    def test_lower_id_committed_after_the_run_is_merged_once(self):
+        self.insert(1, 0)
+        self.insert(3, 5)
+        self.assertEqual(self.run_etl(), 2)
+        # Took its id before hit 3, but committed after the run
+        self.insert(2, 2, feed_id=11)
+        self.assertEqual(self.run_etl(), 1)
+        self.assertEqual(self.hits(), {10: 2, 11: 1})
+        # Nothing new: the hits in the late window are not merged again
+        self.assertEqual(self.run_etl(), 0)
+        self.assertEqual(self.hits(), {10: 2, 11: 1})
+
+    def test_hits_older_than_the_late_window_are_forgotten(self):
+        self.insert(1, 0)
+        self.insert(2, 60 * 72)
+        self.run_etl()
+        state = load_state(self.state_path)
+        seen = pq.read_table(os.path.join(self.tmp.name, state["seen_ids"])).column("id").to_pylist()
+        self.assertEqual(seen, [2])
+
+    def test_interrupted_run_is_not_merged_twice(self):
+        self.insert(1, 0)
+        self.run_etl()
+        self.insert(2, 1)
+        # The run fails after writing the new partition, before saving its state
+        original = etl_incremental.save_state
+
+        def fail(path, state):
+            raise OSError("disk full")
+
+        etl_incremental.save_state = fail
+        try:
+            with self.assertRaises(OSError):
+                self.run_etl()
+        finally:
+            etl_incremental.save_state = original
+        self.assertEqual(self.hits(), {10: 1})
+        self.assertEqual(self.run_etl(), 1)
+        self.assertEqual(self.hits(), {10: 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Tests of the joins of etl_pipeline.py, on small CSV files in the format of the README exports and on Parquet folders.
+
+    cd glue && python -m pytest test_etl_pipeline.py
+"""
+
+import os
+import tempfile
+import unittest
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from etl_pipeline import HITS_SCHEMA, LEADS_SCHEMA, USERS_SCHEMA, build_dimension, run
+
+# As written by `\copy ... TO ... WITH CSV` (PostgreSQL booleans and timestamps)
+LEADS_CSV = "1,Ada,ada@example.com,f\n2,Bob,bob@example.com,t\n3,Eve,eve@example.com,f\n"
+HITS_CSV = (
+    "10,2025-05-20 10:00:00.123+00,100,1\n"
+    "11,2025-05-20 11:00:00+00,101,1\n"
+    "12,2025-05-20 12:00:00+00,100,3\n"  # Eve is not in the users file
+)
+USERS_CSV = "ada@example.com,Spain\nbob@example.com,France\n"
+
+
+class EtlPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv = {
+            name: self.write(f"{name}.csv", content)
+            for name, content in (("leads", LEADS_CSV), ("hits", HITS_CSV), ("users", USERS_CSV))
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content) -> str:
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def to_parquet(self, name, schema) -> str:
+        "The CSV input as a Parquet folder"
+        table = pa_csv.read_csv(
+            self.csv[name],
+            read_options=pa_csv.ReadOptions(column_names=schema.names),
+            convert_options=pa_csv.ConvertOptions(column_types=schema),
+        )
+        path = os.path.join(self.tmp.name, f"{name}_parquet")
+        os.makedirs(path)
+        pq.write_table(table, os.path.join(path, "part-0.parquet"))
+        return path
+
+    def run_job(self, leads, hits, users, batch_size=2) -> list:
+        output = os.path.join(self.tmp.name, f"output-{len(os.listdir(self.tmp.name))}")
+        run(leads, hits, users, output, batch_size=batch_size)
+        rows = pq.read_table(output).to_pylist()
+        return sorted(rows, key=lambda row: (row["id"], row["article_hit_id"] or 0))
+
+    def test_leads_are_joined_with_their_hits_and_users(self):
+        rows = self.run_job(self.csv["leads"], self.csv["hits"], self.csv["users"])
+        self.assertEqual(
+            [(row["name"], row["article_hit_id"], row["user_country"]) for row in rows],
+            [("Ada", 10, "Spain"), ("Ada", 11, "Spain"), ("Bob", None, "France")],
+        )
+
+    def test_leads_without_hits_have_null_hit_columns(self):
+        rows = self.run_job(self.csv["leads"], self.csv["hits"], self.csv["users"])
+        bob = [row for row in rows if row["name"] == "Bob"]
+        self.assertEqual(len(bob), 1)
+        self.assertTrue(all(bob[0][name] is None for name in bob[0] if name.startswith("article_hit_")))
+
+    def test_hits_of_leads_missing_from_the_users_are_dropped(self):
+        rows = self.run_job(self.csv["leads"], self.csv["hits"], self.csv["users"])
+        self.assertNotIn(12, [row["article_hit_id"] for row in rows])
+        self.assertNotIn("Eve", build_dimension(self.csv["leads"], self.csv["users"]).column("name").to_pylist())
+
+    def test_csv_and_parquet_inputs_give_the_same_output(self):
+        from_csv = self.run_job(self.csv["leads"], self.csv["hits"], self.csv["users"])
+        from_parquet = self.run_job(
+            self.to_parquet("leads", LEADS_SCHEMA), self.to_parquet("hits", HITS_SCHEMA),
+            self.to_parquet("users", USERS_SCHEMA), batch_size=1,
+        )
+        self.assertEqual(from_parquet, from_csv)
+
+
+if __name__ == "__main__":
+    unittest.main()